@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+    bench_logparse
+    ~~~~~~~~~~~~~~
+
+    Measures the throughput, in lines per second, of the scrapers' shared
+    ``logparse`` module against the per-line ``re.search`` approach it
+    replaced, over a synthetic syslog file with a realistic mix of sshd,
+    envmodules, sudo and unrelated traffic. Some lines carry a prefix, such
+    as a ``<13>`` priority or a relay's header, and days are padded in
+    each of the ways syslog daemons write them.
+
+    Usage::
+
+        ?> python benchmarks/bench_logparse.py --size 4G
+        ?> python benchmarks/bench_logparse.py --path /var/log/messages
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(
+    0,
+    os.path.join(
+        HERE, "..", "src", "openacct", "contrib", "login_records",
+        "static", "login_records", "client",
+    ),
+)
+
+from logparse import LogParser  # noqa: E402
+
+
+LEGACY_PATTERNS = {
+    "ssh": (
+        r"(?P<when>\w{3}\s+\d+ \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
+        + r"(?P<service>\S+)\[\d+\]: Accepted (?P<method>.+) for (?P<user>.+) "
+        + r"from (?P<from>.+) port \d+ (?P<rem>.*)$"
+    ),
+    "cmd": (
+        r"(?P<when>\w{3}\s+\d+ \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
+        + r"(?P<service>\S+)\[\d+\]: (?P<type>module-cmd) (?P<data>{.*})$"
+    ),
+    "event": (
+        r"(?P<when>\w{3}\s+\d+ \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
+        + r"(?P<service>\S+)\[\d+\]: (?P<type>module-event) (?P<data>{.*})$"
+    ),
+}
+
+TEMPLATES = [
+    (60, "kernel: [{n}.000000] audit: type=1400 audit({n}.123:42): apparmor=\"STATUS\""),
+    (15, "systemd[1]: Started Session {n} of user u{u}."),
+    (8, "CROND[{n}]: (root) CMD (/usr/lib64/sa/sa1 1 1)"),
+    (5, "sshd[{n}]: Accepted publickey for u{u} from 10.0.{u}.{n2} port 5{n2} ssh2: RSA SHA256:abc"),
+    (5, "sshd[{n}]: Connection closed by 10.0.{u}.{n2} port 5{n2} [preauth]"),
+    (3, "user[{n}]: module-cmd {{ \"uuid\": \"{n}-{u}\", \"user\": \"u{u}\", \"command\": \"module load gcc/{n2}\" }}"),
+    (3, "user[{n}]: module-event {{ \"uuid\": \"{n}-{u}\", \"mode\": \"load\", \"module\": \"gcc/{n2}\", \"modfile\": \"/sw/modules/gcc/{n2}\", \"auto\": false }}"),
+    (1, "sudo:      u{u} : TTY=pts/0 ; PWD=/home/u{u} ; USER=root ; COMMAND=/bin/systemctl restart sshd"),
+]
+# Prefixes written before the syslog header, and the ways days are padded
+PREFIXES = [
+    (90, ""),
+    (5, "<13>"),
+    (5, "2024-01-05T10:00:00+00:00 relay01 "),
+]
+DAY_FORMATS = ["{:>2}", "{:02}", "{}"]
+MONTH_NAMES = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+
+
+def parse_size(value):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if value[-1].upper() in units:
+        return int(float(value[:-1]) * units[value[-1].upper()])
+    return int(value)
+
+
+def generate(path, size):
+    """Write a synthetic syslog of roughly ``size`` bytes to ``path``"""
+    rng = random.Random(0)
+    weights = [w for w, _ in TEMPLATES]
+    formats = [t for _, t in TEMPLATES]
+    prefix_weights = [w for w, _ in PREFIXES]
+    prefixes = [p for _, p in PREFIXES]
+    written, second = 0, 0
+    with open(path, "w") as f:
+        while written < size:
+            chunk = []
+            for fmt, prefix in zip(
+                rng.choices(formats, weights, k=10000),
+                rng.choices(prefixes, prefix_weights, k=10000),
+            ):
+                second += rng.random() < 0.2
+                day, rem = divmod(second, 86400)
+                stamp = "{} {} {:02}:{:02}:{:02}".format(
+                    MONTH_NAMES[(day // 28) % 12],
+                    rng.choice(DAY_FORMATS).format(day % 28 + 1),
+                    rem // 3600, rem // 60 % 60, rem % 60,
+                )
+                n, n2, u = rng.randrange(1 << 16), rng.randrange(256), rng.randrange(200)
+                chunk.append(
+                    "{}{} node{:04} {}\n".format(
+                        prefix, stamp, u, fmt.format(n=n, n2=n2, u=u)
+                    )
+                )
+            data = "".join(chunk)
+            f.write(data)
+            written += len(data)
+
+
+def run_legacy(path):
+    matched = lines = 0
+    with open(path) as f:
+        for line in f:
+            lines += 1
+            for label in LEGACY_PATTERNS:
+                if re.search(LEGACY_PATTERNS[label], line.rstrip()):
+                    matched += 1
+    return lines, matched
+
+
+def run_logparse(path):
+    parser = LogParser(["sshd", "envmodules", "sudo"], 2024)
+    matched = lines = 0
+    with open(path) as f:
+        for line in f:
+            lines += 1
+            if parser.parse(line.rstrip("\n")) is not None:
+                matched += 1
+    return lines, matched
+
+
+def report(label, func, path):
+    start = time.perf_counter()
+    lines, matched = func(path)
+    elapsed = time.perf_counter() - start
+    mbytes = os.path.getsize(path) / (1 << 20)
+    print(
+        f"{label:>9}: {lines:>12,} lines {matched:>11,} matched "
+        f"{elapsed:8.2f}s {lines / elapsed:>12,.0f} lines/s {mbytes / elapsed:8.1f} MiB/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", help="Benchmark an existing log instead of generating one")
+    parser.add_argument("--size", default="2G", help="Size of the synthetic log, e.g. 512M or 4G")
+    parser.add_argument("--keep", action="store_true", help="Don't delete the generated log")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time logparse")
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="bench_logparse_", suffix=".log")
+        os.close(fd)
+        print(f"Generating {args.size} synthetic syslog at {path}")
+        generate(path, parse_size(args.size))
+
+    try:
+        if not args.skip_legacy:
+            report("legacy", run_legacy, path)
+        report("logparse", run_logparse, path)
+    finally:
+        if args.path is None and not args.keep:
+            os.remove(path)
@@ -22,6 +22,9 @@ CLASSIFIERS = [
     "Topic :: Internet :: WWW/HTTP :: Dynamic Content"
 ]
 INSTALL_REQUIRES = []
+EXTRAS_REQUIRE = {
+    "geoip": ["maxminddb"],
+}
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
@@ -57,4 +60,5 @@ setup(
     include_package_data=True,
     classifiers=CLASSIFIERS,
     install_requires=INSTALL_REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
 )
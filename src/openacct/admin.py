@@ -12,14 +12,24 @@ from .models import (
     StorageCommitment,
     Invoice,
     BalanceSheet,
+    Task,
 )
 
+from .export import ExportAdminMixin
+from .pagination import (
+    CachedValuesFieldListFilter,
+    CursorChangeList,
+    EstimatedCountPaginator,
+)
 from .shortcuts import add_user_to_project, create_account
+from .tasks import queue_invoice
 
 
 class ToggleActiveAdminMixin:
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # ModelAdmin.actions defaults to an immutable tuple
+        self.actions = list(self.actions)
         if "set_active" not in self.actions:
             self.actions.append("set_active")
         if "set_inactive" not in self.actions:
@@ -36,6 +46,20 @@ class ToggleActiveAdminMixin:
     set_inactive.short_description = "Mark selected items as inactive"
 
 
+class LargeTableAdminMixin:
+    """For models with millions of rows. Changelists page through rows by
+    primary key instead of ``OFFSET``, never run a full ``COUNT(*)``, and
+    should set ``list_select_related`` for any foreign keys they display.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ("-pk",)
+
+    def get_changelist(self, request, **kwargs):
+        return CursorChangeList
+
+
 class ProjectMembershipInline(admin.TabularInline):
     model = User.projects.through
     extra = 0
@@ -78,6 +102,8 @@ class UserProjectEventAdmin(admin.ModelAdmin):
 @admin.register(Account)
 class AccountAdmin(ToggleActiveAdminMixin, admin.ModelAdmin):
     list_display = ("name", "project", "active", "created", "expires")
+    list_select_related = ("project",)
+    search_fields = ("name", "project__name")
 
 
 @admin.register(System)
@@ -100,10 +126,14 @@ class ServiceAdmin(ToggleActiveAdminMixin, admin.ModelAdmin):
         "active",
         "created",
     )
+    list_select_related = ("system",)
+    search_fields = ("name", "system__name")
 
 
 @admin.register(Transaction)
-class TransactionAdmin(ToggleActiveAdminMixin, admin.ModelAdmin):
+class TransactionAdmin(
+    LargeTableAdminMixin, ExportAdminMixin, ToggleActiveAdminMixin, admin.ModelAdmin
+):
     list_display = (
         "created",
         "active",
@@ -114,16 +144,21 @@ class TransactionAdmin(ToggleActiveAdminMixin, admin.ModelAdmin):
         "amt_used",
         "amt_charged",
     )
+    list_select_related = ("service", "account", "creator")
+    list_filter = ("tx_type", "active")
+    date_hierarchy = "created"
+    autocomplete_fields = ("service", "account", "creator")
 
 
 @admin.register(Job)
-class JobAdmin(admin.ModelAdmin):
+class JobAdmin(LargeTableAdminMixin, ExportAdminMixin, admin.ModelAdmin):
     class JobTxInline(admin.TabularInline):
         model = Job.transactions.through
         extra = 0
         verbose_name = "Transaction"
         verbose_name_plural = "Transactions"
-    
+        raw_id_fields = ("transaction",)
+
     list_display = (
         "jobid",
         "name",
@@ -132,7 +167,11 @@ class JobAdmin(admin.ModelAdmin):
         "started",
         "completed",
     )
-    list_filter = ("cluster", "account")
+    list_filter = (
+        ("cluster", CachedValuesFieldListFilter),
+        ("account", CachedValuesFieldListFilter),
+    )
+    date_hierarchy = "queued"
     search_fields = ("jobid", "name", "submitter", "account", "cluster")
 
     inlines = [JobTxInline]
@@ -146,6 +185,7 @@ class StorageCommitmentAdmin(admin.ModelAdmin):
         extra = 0
         verbose_name = "Transaction"
         verbose_name_plural = "Transactions"
+        raw_id_fields = ("transaction",)
 
     list_display = (
         "path",
@@ -157,7 +197,7 @@ class StorageCommitmentAdmin(admin.ModelAdmin):
         "end_date",
     )
     list_filter = ("dir_type", "created", "allocated")
-    search_fields = ("project", "filesystem", "path")
+    search_fields = ("project__name", "filesystem", "path")
     inlines = [StorCommTxInline]
     exclude = ("transactions",)
 
@@ -167,13 +207,39 @@ class InvoiceAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
         if not change:
-            obj.generate_balance_sheets()
+            queue_invoice(obj)
+
+    def regenerate_balance_sheets(self, request, queryset):
+        for invoice in queryset:
+            queue_invoice(invoice)
+
+    regenerate_balance_sheets.short_description = "Regenerate balance sheets"
 
     class BalanceSheetInline(admin.TabularInline):
         extra = 0
         model = BalanceSheet
+        exclude = ("transactions",)
 
     inlines = [BalanceSheetInline]
-    list_display = ("created", "project", "start_time", "end_time")
+    list_display = (
+        "created", "project", "start_time", "end_time", "status", "progress"
+    )
+    list_filter = ("status",)
+    list_select_related = ("project",)
+    readonly_fields = ("status", "progress", "error")
+    actions = ("regenerate_balance_sheets",)
+
+
+@admin.register(BalanceSheet)
+class BalanceSheetAdmin(ExportAdminMixin, admin.ModelAdmin):
+    list_display = ("invoice", "account", "balance")
+    list_select_related = ("invoice", "account")
+    search_fields = ("account__name", "invoice__project__name")
+    exclude = ("transactions",)
 
 
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ("created", "function", "status", "started", "finished")
+    list_filter = ("status",)
+    readonly_fields = ("started", "finished", "error")
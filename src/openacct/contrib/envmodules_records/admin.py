@@ -1,15 +1,24 @@
 from django.contrib import admin
 
-from .models import EnvmodulesCommandRecord, EnvmodulesEventRecord
+from openacct.export import ExportAdminMixin
+
+from .models import (
+    EnvmodulesCommandRecord,
+    EnvmodulesDailyUsage,
+    EnvmodulesEventRecord,
+    EnvmodulesModfile,
+    EnvmodulesModule,
+)
 
 
 @admin.register(EnvmodulesCommandRecord)
-class EnvmodulesCommandRecordAdmin(admin.ModelAdmin):
+class EnvmodulesCommandRecordAdmin(ExportAdminMixin, admin.ModelAdmin):
     class EnvmodulesEventRecordInline(admin.TabularInline):
         model = EnvmodulesEventRecord
         extra = 0
         verbose_name = "Environment Module Event"
         verbose_name_plural = "Environment Module Events"
+        raw_id_fields = ("module", "modfile")
 
     list_display = (
         "when", "host", "user", "command", "cluster", "account", "jobid"
@@ -18,3 +27,18 @@ class EnvmodulesCommandRecordAdmin(admin.ModelAdmin):
     search_fields = ("host", "user", "command", "jobid")
 
     inlines = [EnvmodulesEventRecordInline]
+
+
+@admin.register(EnvmodulesDailyUsage)
+class EnvmodulesDailyUsageAdmin(admin.ModelAdmin):
+    list_display = (
+        "day", "module", "cluster", "host", "loads", "auto_loads", "users"
+    )
+    list_filter = ("day", "cluster")
+    search_fields = ("module", "host")
+
+
+@admin.register(EnvmodulesModule, EnvmodulesModfile)
+class InternedStringAdmin(admin.ModelAdmin):
+    list_display = ("value",)
+    search_fields = ("value",)
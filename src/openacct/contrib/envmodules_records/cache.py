@@ -0,0 +1,107 @@
+"""
+    openacct.contrib.envmodules_records.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Events reference the command that caused them by session UUID, and a
+    session can issue many commands, so an event always belongs to the most
+    recent command with its UUID. Recently seen UUIDs are kept in a
+    short-lived in-process cache to avoid a lookup per event.
+"""
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import EnvmodulesCommandRecord
+
+
+def command_rank(command):
+    """The order of a command within its session: later commands rank
+    higher, and ``seq`` orders commands issued in the same second.
+    """
+    return (command.when, command.seq or 0, command.pk)
+
+
+class CommandCache:
+    """A bounded mapping of session UUID to the primary key of the latest
+    EnvmodulesCommandRecord with that UUID, along with its ``command_rank``.
+    Entries expire after ``ttl`` seconds so that commands recorded through
+    another process are picked up reasonably quickly.
+    """
+
+    def __init__(self, ttl=300, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def _entry(self, uuid):
+        entry = self._entries.get(uuid)
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            del self._entries[uuid]
+            return None
+        return entry
+
+    def get(self, uuid):
+        entry = self._entry(uuid)
+        return None if entry is None else entry[0]
+
+    def set(self, uuid, pk, rank):
+        self._entries.pop(uuid, None)
+        self._entries[uuid] = (pk, rank, time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def update(self, uuid, pk, rank):
+        """Replace the cached command of ``uuid`` if ``rank`` is higher.
+        Nothing is cached for a UUID without an entry, since a later
+        command may already be stored.
+        """
+        entry = self._entry(uuid)
+        if entry is not None and entry[1] < rank:
+            self.set(uuid, pk, rank)
+
+    def clear(self):
+        self._entries.clear()
+
+
+command_cache = CommandCache(
+    ttl=getattr(settings, "ENVMODULES_UUID_CACHE_TTL", 300),
+    max_size=getattr(settings, "ENVMODULES_UUID_CACHE_SIZE", 10000),
+)
+
+
+def resolve_command(uuid):
+    """Returns the primary key of the latest command issued in the session
+    ``uuid``, or None if there isn't one.
+    """
+    pk = command_cache.get(uuid)
+    if pk is None:
+        command = (
+            EnvmodulesCommandRecord.objects.filter(uuid=uuid)
+            .order_by("-when", F("seq").desc(nulls_last=True), "-pk")
+            .only("pk", "when", "seq")
+            .first()
+        )
+        if command is not None:
+            pk = command.pk
+            command_cache.set(uuid, pk, command_rank(command))
+    return pk
+
+
+def remember_commands(commands):
+    """Once the current transaction commits, cache each of the given saved
+    commands which is later than the one cached for its UUID. Replayed
+    commands are older than those cached, and so leave them in place.
+    """
+    entries = [(c.uuid, c.pk, command_rank(c)) for c in commands]
+
+    def _remember():
+        for uuid, pk, rank in entries:
+            command_cache.update(uuid, pk, rank)
+
+    transaction.on_commit(_remember)
@@ -1,6 +1,9 @@
 from django import forms
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.exceptions import ValidationError
 
+from openacct.contrib.records import intern_fields
+
+from .cache import remember_commands, resolve_command
 from .models import EnvmodulesCommandRecord, EnvmodulesEventRecord
 
 
@@ -8,29 +11,50 @@ class EnvmodulesCommandRecordForm(forms.ModelForm):
     class Meta:
         model = EnvmodulesCommandRecord
         fields = [
-            "when", "host", "user", "uuid", "command", "jobid", "account", "cluster"
+            "when", "host", "user", "uuid", "seq", "command", "jobid", "account",
+            "cluster",
         ]
 
+    def save(self, commit=True):
+        command = super().save(commit=commit)
+        if commit:
+            remember_commands([command])
+        return command
 
-class EnvmodulesEventRecordForm(forms.ModelForm):
 
-    uuid = forms.CharField()
+class EnvmodulesEventForm(forms.ModelForm):
+    """Validates an event whose command is already known, such as one
+    nested under its command in a compound submission. The interned fields
+    are accepted as plain strings, and interned by ``save``.
+    """
+
+    module = forms.CharField(max_length=256)
+    modfile = forms.CharField(max_length=1024)
+    # The seq of the command which caused the event, if logged with it
+    seq = forms.IntegerField(required=False, min_value=0)
 
     class Meta:
         model = EnvmodulesEventRecord
-        fields = ["mode", "auto", "module", "modfile"]
+        fields = ["mode", "auto"]
+
+    def save(self, commit=True):
+        intern_fields(
+            [self.instance], [self.cleaned_data], EnvmodulesEventRecord.dimensions
+        )
+        return super().save(commit=commit)
+
 
+class EnvmodulesEventRecordForm(EnvmodulesEventForm):
+
+    uuid = forms.CharField()
 
     def clean(self):
         cd = super().clean()
         command_uuid = cd['uuid'] = cd.get('uuid', '')
-        try:
-            cd['caused_id'] = EnvmodulesCommandRecord.objects.get(
-                uuid=command_uuid
-            ).pk
-            return cd
-        except ObjectDoesNotExist:
+        cd['caused_id'] = resolve_command(command_uuid)
+        if cd['caused_id'] is None:
             raise ValidationError("No match for the given Session UUID.")
+        return cd
 
     def save(self, commit=True):
         self.instance.caused_id = self.cleaned_data['caused_id']
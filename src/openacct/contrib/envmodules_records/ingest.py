@@ -0,0 +1,177 @@
+"""
+    openacct.contrib.envmodules_records.ingest
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Helpers for inserting envmodules commands together with their events
+    using one ``bulk_create`` per model.
+"""
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from openacct.contrib.records import intern_fields
+from openacct.models import Job
+
+from .cache import command_rank, remember_commands, resolve_command
+from .forms import EnvmodulesCommandRecordForm, EnvmodulesEventForm
+from .models import EnvmodulesCommandRecord, EnvmodulesEventRecord
+from .rollups import record_usage
+
+
+def _validated(form):
+    if not form.is_valid():
+        raise ValidationError(form.errors.as_json())
+    return form
+
+
+def ingest_compound(commands, events=(), rollups=True):
+    """Insert a list of commands, each of which may carry its own
+    ``events`` list, plus any standalone ``events`` identified by session
+    UUID, using one ``bulk_create`` per model. All records are validated
+    with the app's forms first, and a ValidationError is raised without
+    saving anything if any of them are invalid.
+
+    Commands are identified by their digest, so a command which is already
+    stored isn't inserted again. Events are identified by their command and
+    contents: only those their command doesn't already have are inserted,
+    so replaying a payload is harmless but delivers any events missing from
+    an earlier attempt, even when an event was sent apart from its command.
+    New commands run within a job are linked to it if it's already
+    recorded.
+
+    Standalone events are attached to the command with their UUID and
+    ``seq``, the number of the command within its session, or failing that
+    to the latest command with their UUID, looking first at the commands in
+    this payload, then at the cache. The daily usage rollups are updated in
+    the same transaction, unless ``rollups`` is False. Returns a dict with
+    the number of commands and events created.
+    """
+    command_objs, nested, event_forms = {}, {}, []
+    for data in commands:
+        command = _validated(EnvmodulesCommandRecordForm(data)).instance
+        command.digest = command.compute_digest()
+        command_objs.setdefault(command.digest, command)
+        forms = [_validated(EnvmodulesEventForm(e)) for e in data.get("events", [])]
+        nested.setdefault(command.digest, []).extend(form.instance for form in forms)
+        event_forms.extend(forms)
+    standalone = []
+    for data in events:
+        form = _validated(EnvmodulesEventForm(data))
+        standalone.append(
+            (data.get("uuid", ""), form.cleaned_data["seq"], form.instance)
+        )
+        event_forms.append(form)
+
+    # Interned strings are created outside the transaction, since they stay
+    # cached even if it's rolled back.
+    intern_fields(
+        [form.instance for form in event_forms],
+        [form.cleaned_data for form in event_forms],
+        EnvmodulesEventRecord.dimensions,
+    )
+
+    with transaction.atomic():
+        existing = set(
+            EnvmodulesCommandRecord.objects.filter(
+                digest__in=command_objs.keys()
+            ).values_list("digest", flat=True)
+        )
+        new_commands = [c for d, c in command_objs.items() if d not in existing]
+        jobids = {c.jobid for c in new_commands if c.jobid}
+        if jobids:
+            jobs = dict(
+                Job.objects.filter(jobid__in=jobids).values_list("jobid", "pk")
+            )
+            for command in new_commands:
+                command.job_id = jobs.get(command.jobid)
+        EnvmodulesCommandRecord.objects.bulk_create(new_commands, ignore_conflicts=True)
+
+        # Conflict-ignoring inserts don't report primary keys, so fetch them
+        # back by digest in one query.
+        pks = dict(
+            EnvmodulesCommandRecord.objects.filter(
+                digest__in=command_objs.keys()
+            ).values_list("digest", "pk")
+        )
+        for command in command_objs.values():
+            command.pk = pks.get(command.digest)
+        remember_commands(list(command_objs.values()))
+
+        latest, numbered = {}, {}
+        for command in sorted(command_objs.values(), key=command_rank):
+            latest[command.uuid] = command.pk
+            if command.seq is not None:
+                numbered[(command.uuid, command.seq)] = command.pk
+        wanted = {
+            (uuid, seq) for uuid, seq, _ in standalone if seq is not None
+        } - numbered.keys()
+        if wanted:
+            q = Q()
+            for uuid, seq in wanted:
+                q |= Q(uuid=uuid, seq=seq)
+            # The latest command wins where a number was reused
+            numbered.update(
+                ((uuid, seq), pk)
+                for uuid, seq, pk in EnvmodulesCommandRecord.objects.filter(q)
+                .order_by("when", "pk")
+                .values_list("uuid", "seq", "pk")
+            )
+        attached = []
+        for digest, command in command_objs.items():
+            attached.extend((command.pk, event) for event in nested[digest])
+        for uuid, seq, event in standalone:
+            caused = (seq is not None and numbered.get((uuid, seq))) or (
+                latest.get(uuid) or resolve_command(uuid)
+            )
+            if caused is None:
+                raise ValidationError("No match for the given Session UUID.")
+            attached.append((caused, event))
+
+        # Events already stored for the commands, to be left out. Commands
+        # new in this payload have none.
+        known = {caused for caused, _ in attached} - {c.pk for c in new_commands}
+        stored = Counter(
+            EnvmodulesEventRecord.objects.filter(caused__in=known).values_list(
+                "caused", "mode", "auto", "module", "modfile"
+            )
+            if known
+            else ()
+        )
+        event_objs = []
+        for caused, event in attached:
+            event.caused_id = caused
+            key = (caused, event.mode, event.auto, event.module_id, event.modfile_id)
+            if stored[key]:
+                stored[key] -= 1
+                continue
+            event_objs.append(event)
+        EnvmodulesEventRecord.objects.bulk_create(event_objs)
+        if rollups:
+            record_usage(event_objs, {c.pk: c for c in command_objs.values()})
+
+    return {"commands": len(new_commands), "events": len(event_objs)}
+
+
+def group_records(records):
+    """Convert a list of ``record_batch/`` records, each with a ``type`` of
+    ``cmd`` or ``event``, into the ``(commands, events)`` arguments of
+    ``ingest_compound``. Each event is nested under the latest preceding
+    command with its session UUID, and ``seq`` if it has one, or left
+    standalone if there isn't one.
+    """
+    commands, events, latest = [], [], {}
+    for record in records:
+        if record["type"] == "cmd":
+            command = dict(record, events=[])
+            commands.append(command)
+            latest[record.get("uuid", "")] = command
+        elif record["type"] == "event":
+            command = latest.get(record.get("uuid", ""))
+            if command and record.get("seq") not in (None, command.get("seq")):
+                command = None
+            (command["events"] if command else events).append(record)
+        else:
+            raise ValidationError("Unknown record type: {}".format(record["type"]))
+    return commands, events
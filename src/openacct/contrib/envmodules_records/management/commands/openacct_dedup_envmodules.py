@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from openacct.contrib.envmodules_records.models import EnvmodulesCommandRecord
+from openacct.contrib.records import collapse_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign digests to EnvmodulesCommandRecords stored before deduplication "
+        "existed, collapsing duplicates. Of each set of copies, the one with the "
+        "most events is kept, and the others are deleted along with their events"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", required=False, default=1000, type=int,
+            help="Number of records to process per transaction"
+        )
+
+    def handle(self, *args, **kwargs):
+        assigned, deleted = collapse_duplicates(
+            EnvmodulesCommandRecord.objects.annotate(
+                num_events=Count("envmoduleseventrecord")
+            ),
+            rank=lambda row: (row.num_events, -row.pk),
+            chunk_size=kwargs["chunk_size"],
+        )
+        self.stdout.write(f"Kept {assigned} commands, deleted {deleted} duplicates")
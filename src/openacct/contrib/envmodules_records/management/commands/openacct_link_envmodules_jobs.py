@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min, OuterRef, Subquery
+
+from openacct.contrib.envmodules_records.models import EnvmodulesCommandRecord
+from openacct.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        "Link EnvmodulesCommandRecords to the Jobs they were run within, for "
+        "commands stored before the link existed or whose Job was bulk loaded"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", required=False, default=10000, type=int,
+            help="Range of command primary keys to update per statement"
+        )
+
+    def handle(self, *args, **kwargs):
+        unlinked = EnvmodulesCommandRecord.objects.filter(
+            job__isnull=True, jobid__in=Job.objects.values("jobid")
+        )
+        bounds = unlinked.aggregate(lo=Min("pk"), hi=Max("pk"))
+        if bounds["lo"] is None:
+            self.stdout.write("Linked 0 commands")
+            return
+
+        job = Job.objects.filter(jobid=OuterRef("jobid")).values("pk")[:1]
+        linked = 0
+        chunk_size = kwargs["chunk_size"]
+        for lo in range(bounds["lo"], bounds["hi"] + 1, chunk_size):
+            linked += unlinked.filter(pk__gte=lo, pk__lt=lo + chunk_size).update(
+                job=Subquery(job)
+            )
+        self.stdout.write(f"Linked {linked} commands")
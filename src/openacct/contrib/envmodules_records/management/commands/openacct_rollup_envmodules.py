@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.contrib.envmodules_records.rollups import rebuild_usage
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily module usage rollups for a range of days"
+
+    def add_arguments(self, parser):
+        fmt = "(Required) ISO-formatted date, {} day of the range to rebuild"
+        parser.add_argument(
+            "--start", required=True, type=datetime.date.fromisoformat,
+            help=fmt.format("first")
+        )
+        parser.add_argument(
+            "--end", required=True, type=datetime.date.fromisoformat,
+            help=fmt.format("last")
+        )
+        parser.add_argument(
+            "--chunk-size", required=False, default=2000, type=int,
+            help="Number of rollup rows to insert per query"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["start"] > kwargs["end"]:
+            raise CommandError("Start must be before End")
+
+        usage, users = rebuild_usage(
+            kwargs["start"], kwargs["end"], chunk_size=kwargs["chunk_size"]
+        )
+        self.stdout.write(f"Rebuilt {usage} usage rows and {users} user rows")
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('envmodules_records', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='envmodulescommandrecord',
+            name='digest',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('envmodules_records', '0002_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvmodulesDailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('module', models.CharField(max_length=256)),
+                ('cluster', models.CharField(blank=True, default='', max_length=32)),
+                ('host', models.CharField(max_length=64)),
+                ('loads', models.IntegerField(default=0)),
+                ('auto_loads', models.IntegerField(default=0)),
+                ('users', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'envmodules_daily_usage',
+                'indexes': [models.Index(fields=['module', 'day'], name='envmodules__module_8f6fe3_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'module', 'cluster', 'host'), name='envmodules_daily_usage_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EnvmodulesDailyUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('module', models.CharField(max_length=256)),
+                ('cluster', models.CharField(blank=True, default='', max_length=32)),
+                ('host', models.CharField(max_length=64)),
+                ('user', models.CharField(max_length=32)),
+            ],
+            options={
+                'db_table': 'envmodules_daily_user',
+                'indexes': [models.Index(fields=['module', 'day'], name='envmodules__module_02fd01_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'module', 'cluster', 'host', 'user'), name='envmodules_daily_user_key')],
+            },
+        ),
+    ]
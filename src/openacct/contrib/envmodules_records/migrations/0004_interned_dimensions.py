@@ -0,0 +1,104 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+DIMENSIONS = {
+    'module': 'EnvmodulesModule',
+    'modfile': 'EnvmodulesModfile',
+}
+
+
+def intern_strings(apps, schema_editor):
+    EnvmodulesEventRecord = apps.get_model('envmodules_records', 'EnvmodulesEventRecord')
+    for field, model_name in DIMENSIONS.items():
+        model = apps.get_model('envmodules_records', model_name)
+        values = EnvmodulesEventRecord.objects.values_list(field, flat=True)
+        model.objects.bulk_create(
+            [model(value=v) for v in values.order_by().distinct().iterator()],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        EnvmodulesEventRecord.objects.update(**{
+            field + '_ref': Subquery(
+                model.objects.filter(value=OuterRef(field)).values('pk')[:1]
+            )
+        })
+
+
+def restore_strings(apps, schema_editor):
+    EnvmodulesEventRecord = apps.get_model('envmodules_records', 'EnvmodulesEventRecord')
+    for field, model_name in DIMENSIONS.items():
+        model = apps.get_model('envmodules_records', model_name)
+        EnvmodulesEventRecord.objects.update(**{
+            field: Subquery(
+                model.objects.filter(pk=OuterRef(field + '_ref')).values('value')[:1]
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('envmodules_records', '0003_daily_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvmodulesModfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=1024, unique=True)),
+            ],
+            options={
+                'db_table': 'envmodules_modfile',
+            },
+        ),
+        migrations.CreateModel(
+            name='EnvmodulesModule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=256, unique=True)),
+            ],
+            options={
+                'db_table': 'envmodules_module',
+            },
+        ),
+        migrations.AddField(
+            model_name='envmoduleseventrecord',
+            name='module_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='envmodules_records.envmodulesmodule'),
+        ),
+        migrations.AddField(
+            model_name='envmoduleseventrecord',
+            name='modfile_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='envmodules_records.envmodulesmodfile'),
+        ),
+        # Relax the old columns first, so that reversing can re-add them
+        # empty before restoring their values.
+        migrations.AlterField(
+            model_name='envmoduleseventrecord',
+            name='module',
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.AlterField(
+            model_name='envmoduleseventrecord',
+            name='modfile',
+            field=models.CharField(max_length=1024, null=True),
+        ),
+        migrations.RunPython(intern_strings, restore_strings),
+        migrations.RemoveField(model_name='envmoduleseventrecord', name='module'),
+        migrations.RemoveField(model_name='envmoduleseventrecord', name='modfile'),
+        migrations.RenameField(model_name='envmoduleseventrecord', old_name='module_ref', new_name='module'),
+        migrations.RenameField(model_name='envmoduleseventrecord', old_name='modfile_ref', new_name='modfile'),
+        migrations.AlterField(
+            model_name='envmoduleseventrecord',
+            name='module',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='events', to='envmodules_records.envmodulesmodule'),
+        ),
+        migrations.AlterField(
+            model_name='envmoduleseventrecord',
+            name='modfile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='events', to='envmodules_records.envmodulesmodfile'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('envmodules_records', '0004_interned_dimensions'),
+        ('openacct', '0008_balancesheet_invoice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='envmodulescommandrecord',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='envmodules_commands', to='openacct.job'),
+        ),
+        migrations.AlterField(
+            model_name='envmodulescommandrecord',
+            name='jobid',
+            field=models.CharField(blank=True, db_index=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('envmodules_records', '0005_job_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='envmodulescommandrecord',
+            name='seq',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
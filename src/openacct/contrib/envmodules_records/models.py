@@ -1,17 +1,44 @@
 from django.db import models
+from django.db.models.signals import post_save
 
+from openacct.contrib.records import DigestRecord, InternedString
+from openacct.models import Job
+
+
+class EnvmodulesCommandRecord(DigestRecord):
+    digest_fields = (
+        "when", "host", "user", "uuid", "command", "jobid", "account", "cluster"
+    )
+    optional_digest_fields = ("seq",)
+    # Columns and filters of exports, see openacct.export
+    export_fields = (
+        "id", "when", "host", "user", "uuid", "seq", "command", "jobid", "account",
+        "cluster",
+    )
+    export_date_field = "when"
+    export_filters = {"systems": "cluster", "accounts": "account"}
 
-class EnvmodulesCommandRecord(models.Model):
     when = models.DateTimeField(db_index=True)
     host = models.CharField(max_length=64)
     user = models.CharField(max_length=32)
     uuid = models.CharField(max_length=128, db_index=True)
+    # The command's number within its session, which tells apart identical
+    # commands run in the same second. Older siteconfig.tcl doesn't send it.
+    seq = models.PositiveIntegerField(blank=True, null=True)
     command = models.CharField(max_length=1024)
 
     # Additional information if in the context of a running job
-    jobid = models.CharField(max_length=32, blank=True, null=True)
+    jobid = models.CharField(max_length=32, blank=True, null=True, db_index=True)
     account = models.CharField(max_length=64, blank=True, null=True)
     cluster = models.CharField(max_length=32, blank=True, null=True)
+    # The Job with the same jobid, linked at ingest or when the Job is saved
+    job = models.ForeignKey(
+        Job,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="envmodules_commands",
+    )
  
     def __str__(self):
         return f"{self.user} - {self.command}"
@@ -20,15 +47,207 @@ class EnvmodulesCommandRecord(models.Model):
         db_table = "envmodules_command_record"
 
 
+class EnvmodulesModule(InternedString):
+    class Meta:
+        db_table = "envmodules_module"
+
+
+class EnvmodulesModfile(InternedString):
+    value = models.CharField(max_length=1024, unique=True)
+
+    class Meta:
+        db_table = "envmodules_modfile"
+
+
+class EnvmodulesEventQuerySet(models.QuerySet):
+    def modules_for_job(self, jobid):
+        """The modules loaded by a job, in the order first loaded"""
+        return (
+            self.filter(caused__job__jobid=jobid, mode="load")
+            .values(name=models.F("module__value"))
+            .annotate(
+                loads=models.Count("pk"),
+                first_loaded=models.Min("caused__when"),
+            )
+            .order_by("first_loaded", "name")
+        )
+
+    def jobs_for_module(self, module):
+        """The jobs which loaded a module, most recent first"""
+        return (
+            self.filter(module__value=module, mode="load", caused__job__isnull=False)
+            .values(
+                jobid=models.F("caused__job__jobid"),
+                cluster=models.F("caused__job__cluster"),
+                account=models.F("caused__job__account"),
+                submitter=models.F("caused__job__submitter"),
+            )
+            .annotate(
+                loads=models.Count("pk"),
+                first_loaded=models.Min("caused__when"),
+            )
+            .order_by("-first_loaded", "jobid")
+        )
+
+
 class EnvmodulesEventRecord(models.Model):
+    # Fields holding interned strings, and the table each is interned in
+    dimensions = {"module": EnvmodulesModule, "modfile": EnvmodulesModfile}
+    # Columns and filters of exports, see openacct.export
+    export_fields = (
+        "id",
+        "caused_id",
+        "caused__when",
+        "caused__host",
+        "caused__user",
+        "caused__jobid",
+        "mode",
+        "auto",
+        "module__value",
+        "modfile__value",
+    )
+    export_date_field = "caused__when"
+    export_filters = {"systems": "caused__cluster", "accounts": "caused__account"}
+
     caused = models.ForeignKey(EnvmodulesCommandRecord, on_delete=models.CASCADE)
     mode = models.CharField(max_length=8, choices=(("load","Load"),("unload","Unload")))
     auto = models.BooleanField(blank=True, default=False)
-    module = models.CharField(max_length=256)
-    modfile = models.CharField(max_length=1024)
+    module = models.ForeignKey(
+        EnvmodulesModule, on_delete=models.PROTECT, related_name="events"
+    )
+    modfile = models.ForeignKey(
+        EnvmodulesModfile, on_delete=models.PROTECT, related_name="events"
+    )
+
+    objects = EnvmodulesEventQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.mode} - {self.module}"
 
     class Meta:
         db_table = "envmodules_event_record"
+
+
+class EnvmodulesUsageQuerySet(models.QuerySet):
+    def window(self, start=None, end=None, cluster=None, host=None, module=None):
+        """Filter rollups to the days in [start, end], and optionally to a
+        cluster, host, or modules whose name starts with ``module``.
+        """
+        filters = {}
+        if start is not None:
+            filters["day__gte"] = start
+        if end is not None:
+            filters["day__lte"] = end
+        if cluster is not None:
+            filters["cluster"] = cluster
+        if host is not None:
+            filters["host"] = host
+        if module is not None:
+            filters["module__startswith"] = module
+        return self.filter(**filters)
+
+
+class EnvmodulesDailyUsageQuerySet(EnvmodulesUsageQuerySet):
+    def popularity(self):
+        """Per-module totals, most loaded first"""
+        return (
+            self.values("module")
+            .annotate(
+                loads=models.Sum("loads"),
+                auto_loads=models.Sum("auto_loads"),
+                days_used=models.Count("day", distinct=True),
+                last_used=models.Max("day"),
+            )
+            .order_by("-loads", "module")
+        )
+
+    def unused_since(self, day):
+        """Modules which appear in the rollups, but not on or after ``day``.
+        Useful for finding candidates for deprecation.
+        """
+        return (
+            self.values("module")
+            .annotate(last_used=models.Max("day"))
+            .filter(last_used__lt=day)
+            .order_by("last_used", "module")
+        )
+
+
+class EnvmodulesDailyUserQuerySet(EnvmodulesUsageQuerySet):
+    def distinct_users(self):
+        """Per-module number of distinct users, most users first"""
+        return (
+            self.values("module")
+            .annotate(users=models.Count("user", distinct=True))
+            .order_by("-users", "module")
+        )
+
+
+class EnvmodulesDailyUsage(models.Model):
+    """Per-day rollup of module loads for each module, cluster and host.
+    ``loads`` counts every load event, ``auto_loads`` the subset which were
+    loaded automatically as dependencies, and ``users`` the distinct users.
+    Maintained at ingest, and rebuilt by ``openacct_rollup_envmodules``.
+    """
+    day = models.DateField()
+    module = models.CharField(max_length=256)
+    cluster = models.CharField(max_length=32, blank=True, default="")
+    host = models.CharField(max_length=64)
+    loads = models.IntegerField(default=0)
+    auto_loads = models.IntegerField(default=0)
+    users = models.IntegerField(default=0)
+
+    objects = EnvmodulesDailyUsageQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.day} - {self.module} - {self.loads}"
+
+    class Meta:
+        db_table = "envmodules_daily_usage"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "module", "cluster", "host"],
+                name="envmodules_daily_usage_key",
+            ),
+        ]
+        indexes = [models.Index(fields=["module", "day"])]
+
+
+class EnvmodulesDailyUser(models.Model):
+    """The distinct users behind each EnvmodulesDailyUsage row, so that
+    distinct users can be counted over arbitrary date ranges.
+    """
+    day = models.DateField()
+    module = models.CharField(max_length=256)
+    cluster = models.CharField(max_length=32, blank=True, default="")
+    host = models.CharField(max_length=64)
+    user = models.CharField(max_length=32)
+
+    objects = EnvmodulesDailyUserQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.day} - {self.module} - {self.user}"
+
+    class Meta:
+        db_table = "envmodules_daily_user"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "module", "cluster", "host", "user"],
+                name="envmodules_daily_user_key",
+            ),
+        ]
+        indexes = [models.Index(fields=["module", "day"])]
+
+
+def link_job_commands(sender, instance, created, raw=False, **kwargs):
+    """Jobs are usually recorded after the commands run within them, so
+    link any commands carrying a newly saved job's jobid to it.
+    """
+    if raw:
+        return
+    EnvmodulesCommandRecord.objects.filter(
+        jobid=instance.jobid, job__isnull=True
+    ).update(job=instance)
+
+
+post_save.connect(link_job_commands, sender=Job)
@@ -0,0 +1,64 @@
+"""
+    openacct.contrib.envmodules_records.retention
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Retention policy for envmodules records, see ``openacct.retention``.
+    Commands are archived with their events nested, in the same format
+    accepted by ``ingest_compound``. The daily usage rollups are kept, so
+    they continue to cover archived days.
+"""
+from django.db.models import Prefetch
+
+from openacct.retention import RetentionPolicy
+
+from .ingest import ingest_compound
+from .models import EnvmodulesCommandRecord, EnvmodulesEventRecord
+
+
+class EnvmodulesPolicy(RetentionPolicy):
+    """Archives EnvmodulesCommandRecords along with their events"""
+
+    name = "envmodules_records"
+    model = EnvmodulesCommandRecord
+    fields = (
+        "when", "host", "user", "uuid", "seq", "command", "jobid", "account",
+        "cluster", "events",
+    )
+    nested_fields = ("events",)
+
+    def queryset(self):
+        return EnvmodulesCommandRecord.objects.prefetch_related(
+            Prefetch(
+                "envmoduleseventrecord_set",
+                queryset=EnvmodulesEventRecord.objects.select_related(
+                    "module", "modfile"
+                ).order_by("pk"),
+            )
+        )
+
+    def serialize(self, obj):
+        return {
+            "when": obj.when.isoformat(),
+            "host": obj.host,
+            "user": obj.user,
+            "uuid": obj.uuid,
+            "seq": obj.seq,
+            "command": obj.command,
+            "jobid": obj.jobid,
+            "account": obj.account,
+            "cluster": obj.cluster,
+            "events": [
+                {
+                    "mode": event.mode,
+                    "auto": event.auto,
+                    "module": event.module.value,
+                    "modfile": event.modfile.value,
+                }
+                for event in obj.envmoduleseventrecord_set.all()
+            ],
+        }
+
+    def restore(self, rows):
+        # Restored events are already counted in the rollups
+        ingest_compound(rows, rollups=False)
+        return len(rows)
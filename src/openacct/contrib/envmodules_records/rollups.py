@@ -0,0 +1,191 @@
+"""
+    openacct.contrib.envmodules_records.rollups
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Maintenance of the per-day module usage rollups. ``record_usage`` folds
+    newly ingested events into the rollups incrementally, and
+    ``rebuild_usage`` recomputes a range of days from the event records.
+"""
+import datetime
+import itertools
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import (
+    EnvmodulesCommandRecord,
+    EnvmodulesDailyUsage,
+    EnvmodulesDailyUser,
+    EnvmodulesEventRecord,
+    EnvmodulesModule,
+)
+
+
+def usage_day(when):
+    """The rollup day for a command timestamp, in the current time zone"""
+    return timezone.localtime(when).date() if timezone.is_aware(when) else when.date()
+
+
+def record_usage(events, commands=None):
+    """Add the load ``events`` to the rollups. ``commands`` maps primary keys
+    to the commands which caused the events, and any missing commands are
+    fetched in a single query. The events' interned module names should
+    already be loaded, as they are at ingest.
+
+    Missing usage rows are inserted empty, ignoring conflicts with any a
+    concurrent ingest inserts, and then locked, so that only one ingest at a
+    time works out which users are new to a row. Counts are added with
+    ``F()`` expressions rather than written back.
+    """
+    commands = dict(commands) if commands else {}
+    missing = {e.caused_id for e in events if e.caused_id not in commands}
+    if missing:
+        commands.update(EnvmodulesCommandRecord.objects.in_bulk(missing))
+
+    usage, users = defaultdict(lambda: [0, 0]), set()
+    for event in events:
+        if event.mode != "load":
+            continue
+        command = commands[event.caused_id]
+        key = (usage_day(command.when), event.module.value, command.cluster or "", command.host)
+        usage[key][0] += 1
+        usage[key][1] += bool(event.auto)
+        users.add(key + (command.user,))
+    if not usage:
+        return
+
+    days = {key[0] for key in usage}
+    modules = {key[1] for key in usage}
+    with transaction.atomic():
+        EnvmodulesDailyUsage.objects.bulk_create(
+            [
+                EnvmodulesDailyUsage(day=day, module=module, cluster=cluster, host=host)
+                for day, module, cluster, host in usage
+            ],
+            ignore_conflicts=True,
+        )
+        locked = EnvmodulesDailyUsage.objects.select_for_update().filter(
+            day__in=days, module__in=modules
+        )
+        rows = {
+            (day, module, cluster, host): pk
+            for pk, day, module, cluster, host in locked.values_list(
+                "pk", "day", "module", "cluster", "host"
+            )
+        }
+
+        known_users = set(
+            EnvmodulesDailyUser.objects.filter(
+                day__in=days, module__in=modules
+            ).values_list("day", "module", "cluster", "host", "user")
+        )
+        new_users = users - known_users
+        EnvmodulesDailyUser.objects.bulk_create(
+            [
+                EnvmodulesDailyUser(
+                    day=day, module=module, cluster=cluster, host=host, user=user
+                )
+                for day, module, cluster, host, user in new_users
+            ]
+        )
+        user_counts = Counter(key[:4] for key in new_users)
+
+        EnvmodulesDailyUsage.objects.bulk_update(
+            [
+                EnvmodulesDailyUsage(
+                    pk=rows[key],
+                    loads=F("loads") + loads,
+                    auto_loads=F("auto_loads") + auto_loads,
+                    users=F("users") + user_counts[key],
+                )
+                for key, (loads, auto_loads) in usage.items()
+            ],
+            ["loads", "auto_loads", "users"],
+        )
+
+
+def day_start(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def _insert_chunked(model, objs, chunk_size):
+    objs = iter(objs)
+    while True:
+        chunk = list(itertools.islice(objs, chunk_size))
+        if not chunk:
+            return
+        model.objects.bulk_create(chunk)
+
+
+def _module_names(rows, chunk_size):
+    """Replace the interned module ids of aggregated ``rows`` with names"""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        names = dict(
+            EnvmodulesModule.objects.filter(
+                pk__in={row["module"] for row in chunk}
+            ).values_list("pk", "value")
+        )
+        for row in chunk:
+            row["module"] = names[row["module"]]
+            yield row
+
+
+def rebuild_usage(start, end, chunk_size=2000):
+    """Discard and recompute the rollups for the days in [start, end] with
+    aggregate queries over the event records. Returns a tuple of the number
+    of usage and user rows created.
+    """
+    events = (
+        EnvmodulesEventRecord.objects.filter(
+            mode="load",
+            caused__when__gte=day_start(start),
+            caused__when__lt=day_start(end + datetime.timedelta(days=1)),
+        )
+        .annotate(
+            day=TruncDate("caused__when"),
+            cluster=Coalesce("caused__cluster", Value("")),
+            host=F("caused__host"),
+            user=F("caused__user"),
+        )
+        .order_by()
+    )
+    usage = events.values("day", "module", "cluster", "host").annotate(
+        loads=Count("pk"),
+        auto_loads=Count("pk", filter=Q(auto=True)),
+        users=Count("user", distinct=True),
+    )
+    users = events.values("day", "module", "cluster", "host", "user").distinct()
+
+    with transaction.atomic():
+        EnvmodulesDailyUsage.objects.filter(day__gte=start, day__lte=end).delete()
+        EnvmodulesDailyUser.objects.filter(day__gte=start, day__lte=end).delete()
+        _insert_chunked(
+            EnvmodulesDailyUsage,
+            (
+                EnvmodulesDailyUsage(**row)
+                for row in _module_names(usage.iterator(), chunk_size)
+            ),
+            chunk_size,
+        )
+        _insert_chunked(
+            EnvmodulesDailyUser,
+            (
+                EnvmodulesDailyUser(**row)
+                for row in _module_names(users.iterator(), chunk_size)
+            ),
+            chunk_size,
+        )
+    return (
+        EnvmodulesDailyUsage.objects.filter(day__gte=start, day__lte=end).count(),
+        EnvmodulesDailyUser.objects.filter(day__gte=start, day__lte=end).count(),
+    )
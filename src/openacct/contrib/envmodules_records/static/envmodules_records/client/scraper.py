@@ -5,21 +5,17 @@ import configparser
 import datetime
 import json
 import os
-import re
+import time
 
 import requests
 
+from follow import LogFollower
+from logparse import LogParser, expand_paths, parse_archive, parse_archives
 
-PATTERNS = {
-    "cmd": (
-        r"(?P<when>\w{3}\s+\d+ \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
-        + r"(?P<service>\S+)\[\d+\]: (?P<type>module-cmd) (?P<data>{.*})$"
-    ),
-    "event": (
-        r"(?P<when>\w{3}\s+\d+ \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
-        + r"(?P<service>\S+)\[\d+\]: (?P<type>module-event) (?P<data>{.*})$"
-    ),
-}
+
+SOURCES = ["envmodules"]
+
+RECORD_TYPES = {"module-cmd": "cmd", "module-event": "event"}
 
 
 class ApiClient:
@@ -29,9 +25,12 @@ class ApiClient:
         self.url_prefix = config["ApiServer"]["url_prefix"]
         self.token = config["ApiServer"]["token"]
 
+    def url(self, endpoint: str):
+        return self.url_prefix.rstrip("/") + "/" + endpoint.lstrip("/")
+
     def send(self, endpoint: str, payload: dict):
         resp = requests.post(
-            os.path.join(self.url_prefix, endpoint),
+            self.url(endpoint),
             data=payload,
             headers={"Authorization": "Token " + self.token},
         )
@@ -39,48 +38,394 @@ class ApiClient:
         if resp.status_code != 200:
             raise RuntimeError(f"Server responded: {resp.status_code}")
 
+    def send_json(self, endpoint: str, payload: dict):
+        resp = requests.post(
+            self.url(endpoint),
+            json=payload,
+            headers={"Authorization": "Token " + self.token},
+        )
+        resp.raise_for_status()
+        if resp.status_code != 200:
+            raise RuntimeError(f"Server responded: {resp.status_code}")
+
+
+def build_payload(fields):
+    """Returns the record payload for a parsed line, or None if the JSON
+    object logged by siteconfig.tcl can't be decoded.
+    """
+    payload = {
+        "when": fields["when"],
+        "host": fields["host"],
+    }
+
+    data_str = fields["data"]
+    try:
+        data = json.loads(data_str)
+    except json.JSONDecodeError as e:
+        print(f"Skipping bad JSON object: {data_str}")
+        return None
+
+    payload.update(data)
+    return payload
+
+
+# Responses worth retrying an upload after. Any other error status means
+# the server refused the records, and would refuse them again.
+RETRY_STATUSES = {429} | set(range(500, 600))
+
+
+def retry_after(resp, interval):
+    """Seconds to wait before retrying, from a Retry-After header if any"""
+    try:
+        return max(float(resp.headers["Retry-After"]), interval)
+    except (KeyError, ValueError):
+        return interval
+
+
+def reject(records, path):
+    """Append records the server refused to the NDJSON file ``path``, from
+    where they can be corrected and uploaded again with --upload-spool.
+    """
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    print(f"Wrote {len(records)} rejected records to {path}")
+
+
+def send_with_retry(client, endpoint, payload, interval):
+    """Upload a payload, retrying through connection errors, timeouts,
+    server errors and rate limiting, so the checkpoint never moves past
+    records that weren't delivered. Returns False if the server refused
+    the payload, which retrying wouldn't change.
+    """
+    while True:
+        try:
+            client.send_json(endpoint, payload)
+            return True
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error, delay = e, interval
+        except requests.HTTPError as e:
+            if e.response.status_code not in RETRY_STATUSES:
+                print(f"Upload rejected: {e}")
+                return False
+            error, delay = e, retry_after(e.response, interval)
+        print(f"Upload failed, retrying in {delay}s: {error}")
+        time.sleep(delay)
+
+
+def compound_payload(records):
+    """Nest each event in a batch under the latest preceding command with
+    its session UUID, and ``seq`` if it has one, for the ``record_compound/``
+    endpoint. Events whose command was sent in an earlier batch are left at
+    the top level for the server to resolve by UUID and ``seq``.
+    """
+    commands, events, latest = [], [], {}
+    for record in records:
+        if record["type"] == "cmd":
+            command = dict(record, events=[])
+            commands.append(command)
+            latest[record.get("uuid")] = command
+        else:
+            command = latest.get(record.get("uuid"))
+            if command and record.get("seq") not in (None, command.get("seq")):
+                command = None
+            (command["events"] if command else events).append(record)
+    return {"commands": commands, "events": events}
+
+
+def upload_batch(client, batch, args):
+    """Upload a batch of records, writing it to ``args.reject_file`` if the
+    server refuses it so that one bad record can't stall uploads.
+    """
+    if args.compound:
+        endpoint, payload = "/record_compound/", compound_payload(batch)
+    else:
+        endpoint, payload = "/record_batch/", {"records": batch}
+    if not send_with_retry(client, endpoint, payload, args.poll_interval):
+        reject(batch, args.reject_file)
+
+
+def to_record(fields):
+    """Build the ``record_batch/`` form of a parsed line, or None"""
+    payload = build_payload(fields)
+    if payload is not None:
+        payload["when"] = payload["when"].isoformat()
+        payload["type"] = RECORD_TYPES[fields["type"]]
+    return payload
+
+
+def follow_file(client, args):
+    """Tail ``args.paths[0]`` forever, uploading batches of at most
+    ``args.batch_size`` records no later than ``args.max_latency`` seconds
+    after the first record in the batch was read. Commands and events are
+    kept in log order within a batch so events always follow the command
+    that caused them. The offset is only checkpointed after the server has
+    accepted a batch.
+    """
+    follower = LogFollower(args.paths[0], args.state_file, args.poll_interval)
+    parser = LogParser(SOURCES)
+    batch, deadline, today = [], None, None
+    for line in follower.lines():
+        if line is not None:
+            # Lines are being written now, so a December stamp read in
+            # early January belongs to the previous year. The bound only
+            # needs moving daily, and moving it drops the parser's memo.
+            if today != datetime.date.today():
+                today = datetime.date.today()
+                parser.set_latest(
+                    datetime.datetime.now() + datetime.timedelta(days=1)
+                )
+            result = parser.parse(line)
+            payload = to_record(result[1]) if result is not None else None
+            if payload is not None:
+                batch.append(payload)
+                if deadline is None:
+                    deadline = time.monotonic() + args.max_latency
+
+        if batch and (len(batch) >= args.batch_size or time.monotonic() >= deadline):
+            upload_batch(client, batch, args)
+            batch, deadline = [], None
+            follower.checkpoint()
+        elif not batch and line is None:
+            follower.checkpoint()
+
+
+def backfill_files(client, args):
+    """Parse every file matched by ``args.paths`` in a process pool and
+    either upload the records in batches, oldest file first, or append
+    them to the NDJSON spool file ``args.spool``.
+    """
+    paths = expand_paths(args.paths)
+    spool = open(args.spool, "a") if args.spool else None
+    batch = []
+    try:
+        parsed, count = None, 0
+        for path, results in parse_archives(paths, SOURCES, args.workers, args.year):
+            if path != parsed:
+                if parsed is not None:
+                    print(f"{parsed}: {count} records")
+                parsed, count = path, 0
+            count += len(results)
+            for _, fields in results:
+                payload = to_record(fields)
+                if payload is None:
+                    continue
+                if spool:
+                    spool.write(json.dumps(payload) + "\n")
+                    continue
+                batch.append(payload)
+                if len(batch) >= args.batch_size:
+                    upload_batch(client, batch, args)
+                    batch = []
+        if parsed is not None:
+            print(f"{parsed}: {count} records")
+        if batch:
+            upload_batch(client, batch, args)
+    finally:
+        if spool:
+            spool.close()
+
+
+def upload_spool(client, args):
+    """Upload the records in NDJSON spool files written by ``--spool``"""
+    for path in args.paths:
+        batch = []
+        with open(path) as f:
+            for line in f:
+                batch.append(json.loads(line))
+                if len(batch) >= args.batch_size:
+                    upload_batch(client, batch, args)
+                    batch = []
+        if batch:
+            upload_batch(client, batch, args)
+
+
+CLAIMED_SUFFIX = ".claimed"
+
+
+def claim_spools(directory):
+    """Atomically rename the live spool files written by siteconfig.tcl, so
+    that later modulecmd runs start new ones. Processes which opened a
+    spool before it was renamed keep appending to the claimed file.
+    """
+    for name in os.listdir(directory):
+        if name.endswith(".ndjson"):
+            path = os.path.join(directory, name)
+            os.rename(path, f"{path}.{time.time_ns()}{CLAIMED_SUFFIX}")
+
 
-def scan_file(path, patterns=["cmd", "event"]):
-    with open(path) as f:
+def claimed_at(path):
+    """Seconds since the epoch at which ``claim_spools`` claimed ``path``,
+    from the time in its name, as renaming doesn't change a file's mtime
+    """
+    stamp = path[: -len(CLAIMED_SUFFIX)].rpartition(".")[2]
+    return int(stamp) / 1e9 if stamp.isdigit() else os.stat(path).st_mtime
+
+
+def upload_claimed(client, path, args):
+    batch = []
+    with open(path, errors="replace") as f:
         for line in f:
-            for label in patterns:
-                m = re.search(PATTERNS[label], line.rstrip())
-                if m:
-                    yield m
+            try:
+                batch.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping bad JSON object: {line.strip()}")
+                continue
+            if len(batch) >= args.batch_size:
+                upload_batch(client, batch, args)
+                batch = []
+    if batch:
+        upload_batch(client, batch, args)
+
+
+def drain_pass(client, args):
+    """Upload and delete the settled claimed spools in the directories
+    ``args.paths``, then claim the live ones
+    """
+    settled = time.time() - args.spool_grace
+    for directory in args.paths:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not name.endswith(CLAIMED_SUFFIX):
+                continue
+            if max(claimed_at(path), os.stat(path).st_mtime) < settled:
+                upload_claimed(client, path, args)
+                os.unlink(path)
+        claim_spools(directory)
+
+
+def drain_spools(client, args):
+    """Consume the spool directories ``args.paths`` written by siteconfig.tcl
+    in spool mode. Each pass uploads and deletes the files claimed at least
+    ``args.spool_grace`` seconds ago and not written to since, when their
+    writers have exited, then claims the live ones. Claimed files left by an
+    interrupted run are uploaded again, which the server ignores for
+    records already stored.
+    """
+    while True:
+        if args.once:
+            for directory in args.paths:
+                claim_spools(directory)
+            time.sleep(args.spool_grace)
+
+        drain_pass(client, args)
+        if args.once:
+            return
+        time.sleep(args.poll_interval)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("path", help="")
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Log files, globs with --backfill, or spool directories with --drain-spool",
+    )
     parser.add_argument(
         "--year",
         required=False,
-        default=datetime.date.today().year,
-        help="Set for the year the log was generated. Defaults to the current year",
+        type=int,
+        default=None,
+        help="Set for the year the log was generated. Inferred from each file's mtime by default",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Tail the file, following rotations, and upload new records as they appear",
+    )
+    parser.add_argument(
+        "--state-file",
+        default="scraper.state",
+        help="Where --follow records the offset of the last uploaded line",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Parse rotated and compressed (.gz, .xz, .bz2) archives in parallel",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of parser processes for --backfill. Defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--spool",
+        default=None,
+        help="With --backfill, append records to this NDJSON file instead of uploading",
+    )
+    parser.add_argument(
+        "--upload-spool",
+        action="store_true",
+        help="Upload the records from NDJSON files written by --spool",
+    )
+    parser.add_argument(
+        "--drain-spool",
+        action="store_true",
+        help="Upload and remove the spool files written by siteconfig.tcl's spool mode",
+    )
+    parser.add_argument(
+        "--spool-grace",
+        type=float,
+        default=30.0,
+        help="Seconds to wait after claiming a spool file before uploading it",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="With --drain-spool, drain the spools once and exit instead of polling",
+    )
+    parser.add_argument(
+        "--compound",
+        action="store_true",
+        help="Upload each command together with its events in batched modes",
+    )
+    parser.add_argument(
+        "--reject-file",
+        default="scraper.rejects.ndjson",
+        help="Where batched modes write records the server refuses",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Maximum number of records per upload in batched modes",
+    )
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        default=5.0,
+        help="Maximum seconds a record is held before upload in --follow mode",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="Seconds to wait for new data in --follow mode, or between upload retries",
     )
 
     args = parser.parse_args()
-    client = ApiClient()
-    for m in scan_file(args.path):
-        payload = {
-            "when": datetime.datetime.strptime(
-                " ".join([str(args.year), m.group("when")]),
-                "%Y %b %d %H:%M:%S",
-            ),
-            "host": m.group("host"),
-        }
-
-        data_str = m.group("data")
-        try:
-            data = json.loads(data_str)
-        except json.JSONDecodeError as e:
-            print(f"Skipping bad JSON object: {data_str}")
-            continue
-
-        payload.update(data)
-        if m.group("type") == "module-cmd":
-            client.send("/record_command/", payload)
-        elif m.group("type") == "module-event":
-            client.send("/record_event/", payload)
-        else:
-            print("Unexpected regex match with log type: " + m.group("type"))
+    if args.follow and len(args.paths) != 1:
+        parser.error("--follow takes exactly one path")
+
+    client = None if args.backfill and args.spool else ApiClient()
+    if args.follow:
+        follow_file(client, args)
+    elif args.backfill:
+        backfill_files(client, args)
+    elif args.upload_spool:
+        upload_spool(client, args)
+    elif args.drain_spool:
+        drain_spools(client, args)
+    else:
+        for path in args.paths:
+            for _, fields in parse_archive(path, SOURCES, args.year):
+                payload = build_payload(fields)
+                if payload is None:
+                    continue
+                if fields["type"] == "module-cmd":
+                    client.send("/record_command/", payload)
+                elif fields["type"] == "module-event":
+                    client.send("/record_event/", payload)
+                else:
+                    print("Unexpected regex match with log type: " + fields["type"])
@@ -11,9 +11,52 @@
 #   installation. Refer to the "Modulecmd startup" section in the
 #   module(1) man page to get this location.
 
+# Set to a node-local directory, writable by all users with the sticky bit
+#   set (mode 1777), to append records as JSON lines to a per-user spool file
+#   in it instead of forking logger for each one. Spools are consumed by
+#   `scraper.py --drain-spool`. If a spool can't be opened, syslog is used.
+set ::spoolDir {}
+
+# A session ID unique to this host, process and time, made without forking
+proc sessionId {} {
+   return [format %x-%x-%s [clock microseconds] [pid] [info hostname]]
+}
+
 # Set a UUID for the session at startup
 if {[info exists ::env(MODULE_SESSION_UUID)] == 0} {
-   set ::env(MODULE_SESSION_UUID) [exec uuidgen -t]
+   if {$::spoolDir ne {}} {
+      set ::env(MODULE_SESSION_UUID) [sessionId]
+   } else {
+      set ::env(MODULE_SESSION_UUID) [exec uuidgen -t]
+   }
+}
+
+proc jsonString {str} {
+   return "\"[string map {\\ \\\\ \" \\\" \n \\n \r \\r \t \\t} $str]\""
+}
+
+# Append a record to the spool in the form accepted by the record_batch/
+#   endpoint. fields is a list of keys and JSON-encoded values. The channel
+#   is opened once and fully buffered, so it's written when modulecmd exits.
+#   Returns 0 if the spool can't be opened.
+proc spoolRecord {type fields} {
+   if {![info exists ::spoolChan]} {
+      set path [file join $::spoolDir $::tcl_platform(user).ndjson]
+      if {[catch {open $path {WRONLY APPEND CREAT} 0600} chan]} {
+         return 0
+      }
+      fconfigure $chan -buffering full -buffersize 65536 -translation lf\
+         -encoding utf-8
+      set ::spoolChan $chan
+   }
+   set when [clock format [clock seconds] -format %Y-%m-%dT%H:%M:%SZ -gmt 1]
+   set host [lindex [split [info hostname] .] 0]
+   set line "\{\"type\": \"$type\", \"when\": \"$when\", \"host\": [jsonString $host]"
+   foreach {key value} $fields {
+      append line ", \"$key\": $value"
+   }
+   puts $::spoolChan "$line\}"
+   return 1
 }
 
 proc execLogger {tag msg} {
@@ -45,11 +88,31 @@ proc logModfileInterp {cmdstring op} {
       # add info on load mode to know if module is auto-loaded or not
       if {$mode eq {load} && $caller eq {cmdModuleLoad}} {
          upvar 1 uasked uasked
-         set extra ", \"auto\": [expr {$uasked ? {false} : {true}}]"
+         set auto [expr {$uasked ? {false} : {true}}]
+         set extra ", \"auto\": $auto"
       } else {
          set extra {}
       }
+      # tag the event with the number of the command which caused it, so it
+      #   can be attached to that command even when sent apart from it
+      if {[info exists ::env(MODULE_SESSION_SEQ)]} {
+         set seq $::env(MODULE_SESSION_SEQ)
+         append extra ", \"seq\": $seq"
+      }
       set uuid $::env(MODULE_SESSION_UUID)
+      if {$::spoolDir ne {}} {
+         set fields [list uuid [jsonString $uuid] mode [jsonString $mode]\
+            module [jsonString $modname] modfile [jsonString $modfile]]
+         if {[info exists auto]} {
+            lappend fields auto $auto
+         }
+         if {[info exists seq]} {
+            lappend fields seq $seq
+         }
+         if {[spoolRecord event $fields]} {
+            return
+         }
+      }
       set msg "{ \"uuid\": \"$uuid\", \"mode\": \"$mode\", \"module\": \"$modname\", \"modfile\": \"$modfile\"${extra} }"
       execLogger module-event $msg
    }
@@ -75,7 +138,28 @@ proc logModuleCmd {cmdstring op} {
    # skip duplicate log entry when ml command calls module
    if {[info exists ::env(MODULE_COMMAND_LOGGED)] == 0} {
       set ::env(MODULE_COMMAND_LOGGED) true
-      set msg "{ \"uuid\": \"$uuid\", \"user\": \"$user\", \"command\": \"$cmdstring\"${extra} }"
+
+      # number the commands of the session, so identical commands run within
+      #   the same second are told apart
+      if {[info exists ::env(MODULE_SESSION_SEQ)]} {
+         set seq [expr {$::env(MODULE_SESSION_SEQ) + 1}]
+      } else {
+         set seq 1
+      }
+      set ::env(MODULE_SESSION_SEQ) $seq
+
+      if {$::spoolDir ne {}} {
+         set fields [list uuid [jsonString $uuid] seq $seq user [jsonString $user]\
+            command [jsonString $cmdstring]]
+         if {$extra ne {}} {
+            lappend fields jobid [jsonString $jobid] account [jsonString $account]\
+               cluster [jsonString $cluster]
+         }
+         if {[spoolRecord cmd $fields]} {
+            return
+         }
+      }
+      set msg "{ \"uuid\": \"$uuid\", \"seq\": $seq, \"user\": \"$user\", \"command\": \"$cmdstring\"${extra} }"
       execLogger module-cmd $msg
    }
 }
@@ -1,3 +1,645 @@
-from django.test import TestCase
+import argparse
+import datetime
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import io
+import time
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.exceptions import PermissionDenied
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from openacct.contrib.records import clear_intern_caches
+from openacct.contrib.token_auth.models import AuthToken
+from openacct.models import Job
+
+from .cache import command_cache, resolve_command
+from .ingest import group_records, ingest_compound
+from .models import (
+    EnvmodulesCommandRecord,
+    EnvmodulesDailyUsage,
+    EnvmodulesDailyUser,
+    EnvmodulesEventRecord,
+)
+from .rollups import rebuild_usage
+from .views import (
+    EnvmodulesCompoundRecordView,
+    EnvmodulesJobModulesView,
+    EnvmodulesModuleJobsView,
+    EnvmodulesUnusedView,
+    EnvmodulesUsageView,
+)
+
+WHEN = datetime.datetime(2024, 1, 5, 10, 0, 1, tzinfo=datetime.timezone.utc)
+
+
+def load_client_module(name):
+    """Import a module of the scraper client, which isn't a package.
+    Modules are registered under their own names, as the scraper imports
+    its neighbours that way.
+    """
+    path = os.path.join(
+        os.path.dirname(__file__), "static", "envmodules_records", "client",
+        name + ".py",
+    )
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+load_client_module("follow")
+load_client_module("logparse")
+scraper = load_client_module("scraper")
+
+
+def command(seq=None, when=WHEN, events=(), **kwargs):
+    data = {
+        "when": when.isoformat(),
+        "host": "node01",
+        "user": "bob",
+        "uuid": "session-1",
+        "command": "module load gcc",
+        "events": list(events),
+    }
+    if seq is not None:
+        data["seq"] = seq
+    data.update(kwargs)
+    return data
+
+
+def event(module="gcc/12", mode="load", auto=False):
+    return {
+        "mode": mode,
+        "auto": auto,
+        "module": module,
+        "modfile": "/sw/modules/" + module,
+    }
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        command_cache.clear()
+        clear_intern_caches()
+
+
+class CompoundIngestTests(IngestTestCase):
+    def test_identical_commands_told_apart_by_seq(self):
+        ingest_compound([command(seq=1, events=[event()])])
+        ingest_compound([command(seq=2, events=[event()])])
+        self.assertEqual(EnvmodulesCommandRecord.objects.count(), 2)
+        self.assertEqual(EnvmodulesEventRecord.objects.count(), 2)
+
+    def test_digest_without_seq_unchanged(self):
+        ingest_compound([command()])
+        stored = EnvmodulesCommandRecord.objects.get()
+        values = [
+            WHEN.isoformat(), "node01", "bob", "session-1", "module load gcc",
+            None, None, None,
+        ]
+        expected = hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()
+        self.assertEqual(stored.digest, expected)
+
+    def test_replay_is_harmless(self):
+        payload = [command(seq=1, events=[event("gcc/12"), event("gcc/12")])]
+        self.assertEqual(
+            ingest_compound(payload), {"commands": 1, "events": 2}
+        )
+        self.assertEqual(
+            ingest_compound(payload), {"commands": 0, "events": 0}
+        )
+        self.assertEqual(EnvmodulesEventRecord.objects.count(), 2)
+
+    def test_replay_delivers_missing_events(self):
+        ingest_compound([command(seq=1, events=[event("gcc/12")])])
+        created = ingest_compound(
+            [command(seq=1, events=[event("gcc/12"), event("mpi/4")])]
+        )
+        self.assertEqual(created, {"commands": 0, "events": 1})
+        stored = EnvmodulesCommandRecord.objects.get()
+        self.assertEqual(
+            sorted(
+                stored.envmoduleseventrecord_set.values_list(
+                    "module__value", flat=True
+                )
+            ),
+            ["gcc/12", "mpi/4"],
+        )
+
+    def test_standalone_event_attaches_to_latest_command(self):
+        ingest_compound([command(seq=1), command(seq=2, command="module load mpi")])
+        ingest_compound([], [dict(event(), uuid="session-1")])
+        self.assertEqual(
+            EnvmodulesEventRecord.objects.get().caused.command, "module load mpi"
+        )
+
+
+class SplitBatchReplayTests(IngestTestCase):
+    """A crashed scraper resends batches from its checkpoint, which may fall
+    between a command and its events
+    """
+
+    def batches(self):
+        first = [dict(command(seq=1), type="cmd")]
+        second = [
+            dict(event("gcc/12"), type="event", uuid="session-1", seq=1),
+            dict(command(seq=2, command="module load mpi"), type="cmd"),
+            dict(event("mpi/4"), type="event", uuid="session-1", seq=2),
+        ]
+        return [group_records(first), group_records(second)]
+
+    def loads(self):
+        return dict(EnvmodulesDailyUsage.objects.values_list("module", "loads"))
+
+    def test_replay(self):
+        for commands, events in self.batches():
+            ingest_compound(commands, events)
+        for commands, events in self.batches():
+            self.assertEqual(
+                ingest_compound(commands, events), {"commands": 0, "events": 0}
+            )
+        self.assertEqual(
+            dict(
+                EnvmodulesEventRecord.objects.values_list(
+                    "module__value", "caused__seq"
+                )
+            ),
+            {"gcc/12": 1, "mpi/4": 2},
+        )
+        self.assertEqual(self.loads(), {"gcc/12": 1, "mpi/4": 1})
+
+    def test_replay_after_partial_delivery(self):
+        (first, _), (commands, events) = self.batches()
+        ingest_compound(first)
+        ingest_compound([dict(commands[0], events=[])])
+        # The event of the first command now arrives after a later command
+        # is stored, and still finds its own
+        self.assertEqual(
+            ingest_compound(commands, events), {"commands": 0, "events": 2}
+        )
+        self.assertEqual(
+            EnvmodulesEventRecord.objects.get(module__value="gcc/12").caused.seq, 1
+        )
+
+    def test_replay_without_seq(self):
+        ingest_compound([command(seq=1)])
+        standalone = [dict(event(), uuid="session-1")]
+        self.assertEqual(ingest_compound([], standalone)["events"], 1)
+        self.assertEqual(ingest_compound([], standalone)["events"], 0)
+        self.assertEqual(self.loads(), {"gcc/12": 1})
+
+
+class CompoundRecordViewTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = AuthToken.objects.create(
+            name="modules", expires=timezone.now() + datetime.timedelta(days=1)
+        )
+
+    def post(self, body, token=None):
+        request = RequestFactory().post(
+            "/", body, content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token or self.token.token}",
+        )
+        return EnvmodulesCompoundRecordView.as_view()(request)
+
+    def test_post(self):
+        body = json.dumps({"commands": [command(seq=1, events=[event()])]})
+        response = self.post(body)
+        self.assertEqual(json.loads(response.content), {"commands": 1, "events": 1})
+        self.assertEqual(
+            json.loads(self.post(body).content), {"commands": 0, "events": 0}
+        )
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post("not json").status_code, 400)
+        self.assertEqual(self.post(json.dumps([1])).status_code, 400)
+        bad = json.dumps({"commands": [dict(command(), when="yesterday")]})
+        self.assertEqual(self.post(bad).status_code, 400)
+        self.assertFalse(EnvmodulesCommandRecord.objects.exists())
+        with self.assertRaises(PermissionDenied):
+            self.post("{}", token="missing")
+
+
+class CommandCacheTests(IngestTestCase):
+    def test_replayed_command_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_compound([command(seq=1)])
+        latest = resolve_command("session-1")
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_compound([command(seq=2, command="module load mpi")])
+        newer = resolve_command("session-1")
+        self.assertNotEqual(newer, latest)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_compound([command(seq=1)])
+        self.assertEqual(command_cache.get("session-1"), newer)
+
+    def test_late_command_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_compound([command(seq=2)])
+        latest = resolve_command("session-1")
+        earlier = WHEN - datetime.timedelta(seconds=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_compound([command(seq=1, when=earlier, command="module list")])
+        self.assertEqual(command_cache.get("session-1"), latest)
+
+
+class RollupTests(IngestTestCase):
+    def usage(self):
+        return list(
+            EnvmodulesDailyUsage.objects.order_by("module").values_list(
+                "day", "module", "host", "loads", "auto_loads", "users"
+            )
+        )
+
+    def test_record_usage(self):
+        ingest_compound([command(seq=1, events=[event(), event("mpi/4", auto=True)])])
+        ingest_compound([command(seq=2, events=[event(), event("gcc/12", "unload")])])
+        ingest_compound([command(seq=3, user="alice", events=[event()])])
+        day = WHEN.date()
+        self.assertEqual(
+            self.usage(),
+            [
+                (day, "gcc/12", "node01", 3, 0, 2),
+                (day, "mpi/4", "node01", 1, 1, 1),
+            ],
+        )
+        self.assertEqual(EnvmodulesDailyUser.objects.count(), 3)
+
+    def test_existing_rows_incremented(self):
+        EnvmodulesDailyUsage.objects.create(
+            day=WHEN.date(), module="gcc/12", host="node01", loads=5, users=1
+        )
+        EnvmodulesDailyUser.objects.create(
+            day=WHEN.date(), module="gcc/12", host="node01", user="bob"
+        )
+        ingest_compound([command(seq=1, events=[event()])])
+        ingest_compound([command(seq=2, user="alice", events=[event()])])
+        self.assertEqual(
+            self.usage(), [(WHEN.date(), "gcc/12", "node01", 7, 0, 2)]
+        )
+
+    def test_rebuild_matches_incremental(self):
+        ingest_compound([command(seq=1, events=[event(), event("mpi/4", auto=True)])])
+        ingest_compound([command(seq=2, user="alice", events=[event()])])
+        incremental = self.usage()
+        rebuild_usage(WHEN.date(), WHEN.date())
+        self.assertEqual(self.usage(), incremental)
+
+
+class RecordingClient:
+    def __init__(self):
+        self.sent = []
+
+    def send_json(self, endpoint, payload):
+        self.sent.append((endpoint, payload))
+
+
+class SpoolDrainTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        self.client = RecordingClient()
+        self.args = argparse.Namespace(
+            paths=[self.root], once=False, spool_grace=60, poll_interval=0,
+            batch_size=100, compound=False,
+            reject_file=os.path.join(self.root, "rejected"),
+        )
+
+    def spool(self, name, *uuids, age=0):
+        """Write a spool file of commands, last modified ``age`` seconds ago"""
+        path = os.path.join(self.root, name)
+        with open(path, "a") as f:
+            for uuid in uuids:
+                f.write(json.dumps({"type": "cmd", "uuid": uuid}) + "\n")
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def claimed(self, name, *uuids, age=0):
+        """A spool claimed ``age`` seconds ago"""
+        claimed_ns = time.time_ns() - age * 10 ** 9
+        return self.spool(
+            f"{name}.{claimed_ns}{scraper.CLAIMED_SUFFIX}", *uuids, age=age
+        )
+
+    def uploaded(self):
+        return [
+            record["uuid"] for _, payload in self.client.sent
+            for record in payload["records"]
+        ]
+
+    def test_claimed_then_uploaded(self):
+        self.spool("bob.ndjson", "a", "b", age=3600)
+        scraper.drain_pass(self.client, self.args)
+        (name,) = os.listdir(self.root)
+        self.assertTrue(name.startswith("bob.ndjson."))
+        self.assertTrue(name.endswith(scraper.CLAIMED_SUFFIX))
+        self.assertEqual(self.uploaded(), [])
+
+        # The rename kept the old mtime, but the file was only just claimed
+        scraper.drain_pass(self.client, self.args)
+        self.assertEqual(os.listdir(self.root), [name])
+        self.assertEqual(self.uploaded(), [])
+
+    def test_settled_uploaded_and_unlinked(self):
+        self.claimed("bob.ndjson", "a", "b", age=120)
+        self.spool("alice.ndjson", "c")
+        scraper.drain_pass(self.client, self.args)
+        self.assertEqual(self.uploaded(), ["a", "b"])
+        self.assertEqual(self.client.sent[0][0], "/record_batch/")
+        (name,) = os.listdir(self.root)
+        self.assertTrue(name.startswith("alice.ndjson."))
+
+    def test_written_since_claim_kept(self):
+        path = self.claimed("bob.ndjson", "a", age=120)
+        self.spool(os.path.basename(path), "b")
+        scraper.drain_pass(self.client, self.args)
+        self.assertEqual(self.uploaded(), [])
+        self.assertTrue(os.path.exists(path))
+
+    def test_once(self):
+        self.spool("bob.ndjson", "a")
+        self.args.once, self.args.spool_grace = True, 0.01
+        scraper.drain_spools(self.client, self.args)
+        self.assertEqual(self.uploaded(), ["a"])
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class UsageViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username="staff", is_staff=True)
+        day = WHEN.date()
+        rows = [
+            # day offset, module, cluster, host, loads, auto_loads, users
+            (0, "gcc/12", "alpha", "node01", 3, 1, ["bob", "alice"]),
+            (1, "gcc/12", "alpha", "node02", 2, 0, ["bob"]),
+            (1, "gcc/11", "beta", "node01", 1, 0, ["carol"]),
+            (5, "mpi/4", "alpha", "node01", 4, 4, ["bob"]),
+        ]
+        for offset, module, cluster, host, loads, auto_loads, users in rows:
+            row_day = day + datetime.timedelta(days=offset)
+            EnvmodulesDailyUsage.objects.create(
+                day=row_day, module=module, cluster=cluster, host=host,
+                loads=loads, auto_loads=auto_loads, users=len(users),
+            )
+            EnvmodulesDailyUser.objects.bulk_create(
+                EnvmodulesDailyUser(
+                    day=row_day, module=module, cluster=cluster, host=host, user=user
+                )
+                for user in users
+            )
+
+    def get(self, view, user=None, **params):
+        request = RequestFactory().get("/", params)
+        request.user = user or self.staff
+        response = view.as_view()(request)
+        if response.status_code != 200:
+            return response.status_code
+        return json.loads(response.content)["modules"]
+
+    def test_usage(self):
+        day = WHEN.date()
+        self.assertEqual(
+            self.get(EnvmodulesUsageView),
+            [
+                {
+                    "module": "gcc/12", "loads": 5, "auto_loads": 1, "users": 2,
+                    "days_used": 2,
+                    "last_used": str(day + datetime.timedelta(days=1)),
+                },
+                {
+                    "module": "mpi/4", "loads": 4, "auto_loads": 4, "users": 1,
+                    "days_used": 1,
+                    "last_used": str(day + datetime.timedelta(days=5)),
+                },
+                {
+                    "module": "gcc/11", "loads": 1, "auto_loads": 0, "users": 1,
+                    "days_used": 1,
+                    "last_used": str(day + datetime.timedelta(days=1)),
+                },
+            ],
+        )
+
+    def test_usage_filters(self):
+        day = WHEN.date()
+
+        def loads(**params):
+            return {
+                row["module"]: (row["loads"], row["users"])
+                for row in self.get(EnvmodulesUsageView, **params)
+            }
+
+        self.assertEqual(
+            loads(
+                start=str(day + datetime.timedelta(days=1)),
+                end=str(day + datetime.timedelta(days=4)),
+            ),
+            {"gcc/12": (2, 1), "gcc/11": (1, 1)},
+        )
+        self.assertEqual(loads(end=str(day)), {"gcc/12": (3, 2)})
+        self.assertEqual(loads(cluster="beta"), {"gcc/11": (1, 1)})
+        self.assertEqual(loads(host="node02"), {"gcc/12": (2, 1)})
+        self.assertEqual(
+            loads(module="gcc"), {"gcc/12": (5, 2), "gcc/11": (1, 1)}
+        )
+        self.assertEqual(self.get(EnvmodulesUsageView, start="yesterday"), 400)
+
+    def test_unused(self):
+        day = WHEN.date()
+        since = str(day + datetime.timedelta(days=2))
+        last_used = str(day + datetime.timedelta(days=1))
+        self.assertEqual(
+            self.get(EnvmodulesUnusedView, since=since),
+            [
+                {"module": "gcc/11", "last_used": last_used},
+                {"module": "gcc/12", "last_used": last_used},
+            ],
+        )
+        self.assertEqual(
+            [row["module"] for row in self.get(
+                EnvmodulesUnusedView, since=since, cluster="alpha"
+            )],
+            ["gcc/12"],
+        )
+        self.assertEqual(self.get(EnvmodulesUnusedView), 400)
+
+    def test_staff_only(self):
+        user = User.objects.create(username="bob")
+        with self.assertRaises(PermissionDenied):
+            self.get(EnvmodulesUsageView, user=user)
+
+
+def job(jobid, **kwargs):
+    fields = {
+        "jobid": jobid, "queued": WHEN, "wall_requested": 3600, "cluster": "alpha",
+        "account": "proj", "submitter": "bob",
+    }
+    fields.update(kwargs)
+    return Job.objects.create(**fields)
+
+
+def job_command(jobid, modules=("gcc/12",), when=WHEN, **kwargs):
+    return command(
+        when=when, uuid="session-" + jobid, jobid=jobid,
+        events=[event(module) for module in modules], **kwargs
+    )
+
+
+class JobLinkTests(IngestTestCase):
+    def linked(self):
+        return dict(
+            EnvmodulesCommandRecord.objects.values_list("jobid", "job__jobid")
+        )
+
+    def test_linked_at_ingest(self):
+        job("100")
+        ingest_compound([job_command("100"), job_command("200"), command()])
+        self.assertEqual(self.linked(), {"100": "100", "200": None, None: None})
+
+    def test_linked_when_job_saved(self):
+        ingest_compound([job_command("100"), job_command("200")])
+        self.assertEqual(self.linked(), {"100": None, "200": None})
+        job("100")
+        self.assertEqual(self.linked(), {"100": "100", "200": None})
+
+    def test_link_command(self):
+        ingest_compound(
+            [job_command(str(jobid)) for jobid in range(100, 105)]
+            + [job_command("999"), command()]
+        )
+        # Bulk loaded jobs don't send post_save, which the command catches up on
+        Job.objects.bulk_create(
+            Job(jobid=str(jobid), queued=WHEN, wall_requested=3600)
+            for jobid in range(100, 105)
+        )
+        self.assertFalse(
+            EnvmodulesCommandRecord.objects.filter(job__isnull=False).exists()
+        )
+
+        out = io.StringIO()
+        call_command("openacct_link_envmodules_jobs", "--chunk-size=2", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Linked 5 commands")
+        expected = {str(jobid): str(jobid) for jobid in range(100, 105)}
+        self.assertEqual(self.linked(), expected | {"999": None, None: None})
+
+        out = io.StringIO()
+        call_command("openacct_link_envmodules_jobs", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Linked 0 commands")
+
+
+class JobViewTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create(username="staff", is_staff=True)
+
+    def get(self, view, user=None, **params):
+        request = RequestFactory().get("/", params)
+        request.user = user or self.staff
+        response = view.as_view()(request)
+        if response.status_code != 200:
+            return response.status_code
+        return json.loads(response.content)
+
+    def test_job_modules(self):
+        job("100")
+        ingest_compound([
+            job_command("100", ["gcc/12", "mpi/4"]),
+            job_command(
+                "100", ["gcc/12"], when=WHEN + datetime.timedelta(minutes=1)
+            ),
+        ])
+        self.assertEqual(
+            self.get(EnvmodulesJobModulesView, jobid="100"),
+            {
+                "jobid": "100",
+                "modules": [
+                    {
+                        "name": "gcc/12", "loads": 2,
+                        "first_loaded": WHEN.isoformat().replace("+00:00", "Z"),
+                    },
+                    {
+                        "name": "mpi/4", "loads": 1,
+                        "first_loaded": WHEN.isoformat().replace("+00:00", "Z"),
+                    },
+                ],
+            },
+        )
+        self.assertEqual(self.get(EnvmodulesJobModulesView, jobid="200")["modules"], [])
+        self.assertEqual(self.get(EnvmodulesJobModulesView), 400)
+
+    def test_job_modules_queries(self):
+        job("100")
+        job("200")
+        ingest_compound([
+            job_command("100", ["gcc/12"]),
+            job_command("200", [f"tool/{n}" for n in range(20)]),
+        ])
+        for jobid, count in [("100", 1), ("200", 20)]:
+            with self.assertNumQueries(1):
+                modules = self.get(EnvmodulesJobModulesView, jobid=jobid)["modules"]
+            self.assertEqual(len(modules), count)
+
+    def test_module_jobs(self):
+        job("100", account="chem")
+        job("200", cluster="beta")
+        later = WHEN + datetime.timedelta(days=2)
+        ingest_compound([
+            job_command("100", ["gcc/12", "gcc/12"]),
+            job_command("200", ["gcc/12"], when=later, host="node02"),
+            job_command("300", ["gcc/12"]),
+        ])
+        jobs = self.get(EnvmodulesModuleJobsView, module="gcc/12")["jobs"]
+        self.assertEqual(
+            [(row["jobid"], row["cluster"], row["account"], row["loads"])
+             for row in jobs],
+            [("200", "beta", "proj", 1), ("100", "alpha", "chem", 2)],
+        )
+
+        def jobids(**params):
+            return [
+                row["jobid"] for row in
+                self.get(EnvmodulesModuleJobsView, module="gcc/12", **params)["jobs"]
+            ]
+
+        self.assertEqual(jobids(start=str(later.date())), ["200"])
+        self.assertEqual(jobids(end=str(WHEN.date())), ["100"])
+        self.assertEqual(jobids(host="node02"), ["200"])
+        self.assertEqual(jobids(cluster="alpha"), [])
+        self.assertEqual(jobids(limit="1"), ["200"])
+        self.assertEqual(self.get(EnvmodulesModuleJobsView), 400)
+        self.assertEqual(
+            self.get(EnvmodulesModuleJobsView, module="gcc/12", limit="many"), 400
+        )
+        self.assertEqual(
+            self.get(EnvmodulesModuleJobsView, module="gcc/12", start="yesterday"),
+            400,
+        )
+
+    def test_module_jobs_queries(self):
+        jobids = [str(jobid) for jobid in range(100, 120)]
+        for jobid in jobids:
+            job(jobid)
+        ingest_compound(
+            [job_command(jobids[0], ["mpi/4"])]
+            + [job_command(jobid, ["gcc/12"]) for jobid in jobids]
+        )
+        for module, count in [("mpi/4", 1), ("gcc/12", 20)]:
+            with self.assertNumQueries(1):
+                jobs = self.get(EnvmodulesModuleJobsView, module=module)["jobs"]
+            self.assertEqual(len(jobs), count)
+
+    def test_staff_only(self):
+        user = User.objects.create(username="bob")
+        for view in [EnvmodulesJobModulesView, EnvmodulesModuleJobsView]:
+            with self.assertRaises(PermissionDenied):
+                self.get(view, user=user, jobid="100", module="gcc/12")
@@ -1,8 +1,23 @@
 from django.urls import path
 
-from .views import EnvmodulesCommandRecordView, EnvmodulesEventRecordView
+from .views import (
+    EnvmodulesBatchRecordView,
+    EnvmodulesCommandRecordView,
+    EnvmodulesCompoundRecordView,
+    EnvmodulesEventRecordView,
+    EnvmodulesJobModulesView,
+    EnvmodulesModuleJobsView,
+    EnvmodulesUnusedView,
+    EnvmodulesUsageView,
+)
 
 urlpatterns = [
     path("record_command/", EnvmodulesCommandRecordView.as_view(), name="record-command"),
     path("record_event/", EnvmodulesEventRecordView.as_view(), name="record-event"),
+    path("record_batch/", EnvmodulesBatchRecordView.as_view(), name="record-batch"),
+    path("record_compound/", EnvmodulesCompoundRecordView.as_view(), name="record-compound"),
+    path("module_usage/", EnvmodulesUsageView.as_view(), name="module-usage"),
+    path("module_unused/", EnvmodulesUnusedView.as_view(), name="module-unused"),
+    path("job_modules/", EnvmodulesJobModulesView.as_view(), name="job-modules"),
+    path("module_jobs/", EnvmodulesModuleJobsView.as_view(), name="module-jobs"),
 ]
@@ -1,26 +1,213 @@
-from django.http import HttpResponse, HttpResponseBadRequest
+import datetime
+import json
+
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.views import View
 
 from openacct.contrib.token_auth.mixins import TokenAuthMixin
 
-from .forms import EnvmodulesCommandRecordForm, EnvmodulesEventRecordForm
+from .ingest import group_records, ingest_compound
+from .models import EnvmodulesDailyUsage, EnvmodulesDailyUser, EnvmodulesEventRecord
+from .rollups import day_start
 
 
-class BaseRecordView(TokenAuthMixin, View):
+class EnvmodulesCommandRecordView(TokenAuthMixin, View):
+    def post(self, request):
+        limited = self.limit_records(1)
+        if limited:
+            return limited
+        try:
+            ingest_compound([request.POST.dict()])
+        except ValidationError:
+            return HttpResponseBadRequest()
+        return HttpResponse()
 
-    record_form = None
 
+class EnvmodulesEventRecordView(TokenAuthMixin, View):
     def post(self, request):
-        form = self.record_form(request.POST)
-        if not form.is_valid():
+        limited = self.limit_records(1)
+        if limited:
+            return limited
+        try:
+            ingest_compound([], [request.POST.dict()])
+        except ValidationError:
             return HttpResponseBadRequest()
-        form.save()
         return HttpResponse()
 
 
-class EnvmodulesCommandRecordView(BaseRecordView):
-    record_form = EnvmodulesCommandRecordForm
+class EnvmodulesBatchRecordView(TokenAuthMixin, View):
+    """Accepts a JSON body of the form ``{"records": [...]}`` where each
+    record carries a ``type`` of either ``cmd`` or ``event``, in log order.
+    Events are attached to the latest preceding command with their session
+    UUID, so an event may refer to a command earlier in the same batch. The
+    batch is rejected as a whole if any record is invalid.
+    """
+
+    def post(self, request):
+        try:
+            records = json.loads(request.body)["records"]
+            commands, events = group_records(records)
+        except (ValueError, KeyError, TypeError, AttributeError, ValidationError):
+            return HttpResponseBadRequest()
+        limited = self.limit_records(len(records))
+        if limited:
+            return limited
+        try:
+            created = ingest_compound(commands, events)
+        except (ValueError, KeyError, TypeError, AttributeError, ValidationError):
+            return HttpResponseBadRequest()
+        return JsonResponse({"created": created["commands"] + created["events"]})
+
+
+class EnvmodulesCompoundRecordView(TokenAuthMixin, View):
+    """Accepts a JSON body of the form ``{"commands": [...], "events": [...]}``
+    where each command may carry the ``events`` it caused, and the top-level
+    ``events`` are identified by session UUID. See ``ingest_compound``.
+    """
+
+    def post(self, request):
+        try:
+            payload = json.loads(request.body)
+            commands = payload.get("commands", [])
+            events = payload.get("events", [])
+            records = len(commands) + len(events)
+            records += sum(len(command.get("events", [])) for command in commands)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return HttpResponseBadRequest()
+        limited = self.limit_records(records)
+        if limited:
+            return limited
+        try:
+            created = ingest_compound(commands, events)
+        except (ValueError, KeyError, TypeError, AttributeError, ValidationError):
+            return HttpResponseBadRequest()
+        return JsonResponse(created)
+
+
+#######################################################################
+#
+#   Usage Reports
+#
+#######################################################################
+
+
+class BaseUsageView(LoginRequiredMixin, UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
 
+    def window(self):
+        """Returns the rollup filters given as GET parameters"""
+        filters = {}
+        for field in ["start", "end"]:
+            if self.request.GET.get(field, False):
+                filters[field] = datetime.date.fromisoformat(self.request.GET[field])
+        for field in ["cluster", "host", "module"]:
+            if self.request.GET.get(field, False):
+                filters[field] = self.request.GET[field]
+        return filters
+
+
+class EnvmodulesUsageView(BaseUsageView):
+    """Returns per-module load counts and distinct users, most loaded first.
+    Supports ``start``, ``end``, ``cluster``, ``host`` and ``module`` (a
+    name prefix) GET parameters.
+    """
+
+    def get(self, request):
+        try:
+            window = self.window()
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        users = {
+            row["module"]: row["users"]
+            for row in EnvmodulesDailyUser.objects.window(**window).distinct_users()
+        }
+        payload = {"modules": []}
+        for row in EnvmodulesDailyUsage.objects.window(**window).popularity():
+            payload["modules"].append(
+                {
+                    "module": row["module"],
+                    "loads": row["loads"],
+                    "auto_loads": row["auto_loads"],
+                    "users": users.get(row["module"], 0),
+                    "days_used": row["days_used"],
+                    "last_used": row["last_used"],
+                }
+            )
+        return JsonResponse(payload)
+
+
+class EnvmodulesUnusedView(BaseUsageView):
+    """Returns modules which haven't been loaded on or after the ``since``
+    GET parameter, for finding deprecation candidates. Supports the same
+    filters as EnvmodulesUsageView.
+    """
+
+    def get(self, request):
+        try:
+            window = self.window()
+            since = datetime.date.fromisoformat(self.request.GET["since"])
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
+
+        return JsonResponse(
+            {
+                "modules": list(
+                    EnvmodulesDailyUsage.objects.window(**window).unused_since(since)
+                )
+            }
+        )
+
+
+class EnvmodulesJobModulesView(BaseUsageView):
+    """Returns the modules loaded by the job given by the ``jobid`` GET
+    parameter, in the order they were first loaded.
+    """
+
+    def get(self, request):
+        if not self.request.GET.get("jobid", False):
+            return HttpResponseBadRequest()
+        jobid = self.request.GET["jobid"]
+        return JsonResponse(
+            {
+                "jobid": jobid,
+                "modules": list(EnvmodulesEventRecord.objects.modules_for_job(jobid)),
+            }
+        )
+
+
+class EnvmodulesModuleJobsView(BaseUsageView):
+    """Returns the jobs which loaded the module given by the ``module`` GET
+    parameter, most recent first. Supports ``start``, ``end``, ``cluster``
+    and ``host`` filters, and a ``limit`` on the number of jobs, 1000 by
+    default.
+    """
+
+    def get(self, request):
+        try:
+            module = self.request.GET["module"]
+            window = self.window()
+            limit = int(self.request.GET.get("limit", 1000))
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
 
-class EnvmodulesEventRecordView(BaseRecordView):
-    record_form = EnvmodulesEventRecordForm
+        filters = {}
+        if "start" in window:
+            filters["caused__when__gte"] = day_start(window["start"])
+        if "end" in window:
+            filters["caused__when__lt"] = day_start(
+                window["end"] + datetime.timedelta(days=1)
+            )
+        for field in ["cluster", "host"]:
+            if field in window:
+                filters["caused__" + field] = window[field]
+        events = EnvmodulesEventRecord.objects.filter(**filters)
+        return JsonResponse(
+            {
+                "module": module,
+                "jobs": list(events.jobs_for_module(module)[:limit]),
+            }
+        )
@@ -1,6 +1,16 @@
 from django.contrib import admin
 
-from .models import Location, LoginLocation, LoginRecord
+from openacct.export import ExportAdminMixin
+
+from .models import (
+    Location,
+    LoginHost,
+    LoginLocation,
+    LoginMethod,
+    LoginRecord,
+    LoginService,
+    LoginUser,
+)
 
 
 class LoginLocationInline(admin.TabularInline):
@@ -10,10 +20,20 @@ class LoginLocationInline(admin.TabularInline):
     verbose_name_plural = "Location Information"
 
 @admin.register(LoginRecord)
-class LoginRecordAdmin(admin.ModelAdmin):
+class LoginRecordAdmin(ExportAdminMixin, admin.ModelAdmin):
     list_display = ("when", "user", "host", "service", "method", "fromhost", "result")
     list_filter = ("when", "service", "result")
-    search_fields = ("service", "method", "host", "user", "fromhost")
+    list_select_related = ("host", "service", "method", "user", "fromhost")
+    search_fields = (
+        "service__value", "method__value", "host__value", "user__value",
+        "fromhost__value",
+    )
+    raw_id_fields = ("host", "service", "method", "user", "fromhost")
     inlines = [LoginLocationInline]
 
+@admin.register(LoginHost, LoginService, LoginMethod, LoginUser)
+class InternedStringAdmin(admin.ModelAdmin):
+    list_display = ("value",)
+    search_fields = ("value",)
+
 
@@ -1,9 +1,26 @@
 from django import forms
 
+from openacct.contrib.records import intern_fields
+
 from .models import LoginRecord
 
 
 class LoginRecordForm(forms.ModelForm):
+    """The interned fields are accepted as plain strings. ``save`` interns
+    them one record at a time; batch ingestion uses ``intern_fields`` on
+    many forms' ``instance`` and ``cleaned_data`` at once instead.
+    """
+
+    host = forms.CharField(max_length=256)
+    service = forms.CharField(max_length=256)
+    method = forms.CharField(max_length=256, required=False)
+    user = forms.CharField(max_length=32)
+    fromhost = forms.CharField(max_length=256)
+
     class Meta:
         model = LoginRecord
-        fields = ["when", "host", "service", "method", "user", "fromhost"]
+        fields = ["when"]
+
+    def save(self, commit=True):
+        intern_fields([self.instance], [self.cleaned_data], LoginRecord.dimensions)
+        return super().save(commit=commit)
@@ -0,0 +1,194 @@
+"""
+    openacct.contrib.login_records.geoip
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Enrichment of login records with the location of the host they came
+    from, resolved against a local database so that no request leaves the
+    server. ``LOGIN_RECORDS_GEOIP_DATABASE`` names either a MaxMind-format
+    ``.mmdb`` file, which requires the ``maxminddb`` package, or a CSV table
+    of ``network,country,state,city`` rows. Only source hosts given as IP
+    addresses are resolved.
+"""
+import csv
+import functools
+import ipaddress
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import Location, LoginLocation, LoginRecord
+
+
+# LoginLocation.role of the location a login came from
+SOURCE_ROLE = "source"
+
+
+class CidrTableResolver:
+    """Longest-prefix lookups in a CSV table of networks. The networks are
+    kept in one dict per prefix length, so a lookup costs one dict probe
+    per distinct prefix length in the table.
+    """
+
+    def __init__(self, path):
+        self.prefixes = {4: {}, 6: {}}
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith("#"):
+                    continue
+                try:
+                    network = ipaddress.ip_network(row[0].strip(), strict=False)
+                except ValueError:
+                    continue
+                location = tuple(col.strip() for col in (row[1:] + ["", "", ""])[:3])
+                self.prefixes[network.version].setdefault(network.prefixlen, {})[
+                    int(network.network_address)
+                ] = location
+        self.lengths = {
+            version: sorted(tables, reverse=True)
+            for version, tables in self.prefixes.items()
+        }
+
+    def lookup(self, address):
+        tables = self.prefixes[address.version]
+        bits = address.max_prefixlen
+        value = int(address)
+        for length in self.lengths[address.version]:
+            location = tables[length].get(value >> (bits - length) << (bits - length))
+            if location is not None:
+                return location
+        return None
+
+
+class MaxMindResolver:
+    """Lookups in a MaxMind-format City or Country database"""
+
+    def __init__(self, path):
+        try:
+            import maxminddb
+        except ImportError:
+            raise ImproperlyConfigured(
+                "The maxminddb package is required to read {}".format(path)
+            )
+        self.reader = maxminddb.open_database(path)
+
+    @staticmethod
+    def _name(entry):
+        return (entry or {}).get("names", {}).get("en", "")
+
+    def lookup(self, address):
+        record = self.reader.get(address)
+        if not record or "country" not in record:
+            return None
+        subdivisions = record.get("subdivisions") or [{}]
+        return (
+            self._name(record["country"]),
+            self._name(subdivisions[0]),
+            self._name(record.get("city")),
+        )
+
+
+class LocationMap:
+    """An in-memory map of ``(country, state, city)`` tuples to the primary
+    keys of their Location rows, so that each is fetched or created once.
+    """
+
+    def __init__(self):
+        self.locations = {}
+
+    def ids(self, keys):
+        """Returns a dict mapping each of ``keys`` to a Location primary key,
+        creating any Locations which are missing.
+        """
+        missing = set(keys) - self.locations.keys()
+        if missing:
+            countries = {key[0] for key in missing}
+            for loc in Location.objects.filter(country__in=countries):
+                self.locations[(loc.country, loc.state, loc.city)] = loc.pk
+            created = missing - self.locations.keys()
+            if created:
+                Location.objects.bulk_create(
+                    [Location(country=c, state=s, city=t) for c, s, t in created],
+                    ignore_conflicts=True,
+                )
+                for loc in Location.objects.filter(
+                    country__in={key[0] for key in created}
+                ):
+                    self.locations[(loc.country, loc.state, loc.city)] = loc.pk
+        return {key: self.locations[key] for key in keys}
+
+
+class LocationEnricher:
+    """Attaches source LoginLocations to LoginRecords. Address lookups go
+    through an LRU cache of ``cache_size`` entries.
+    """
+
+    def __init__(self, resolver, cache_size=65536):
+        self.resolver = resolver
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self._resolve)
+        self.locations = LocationMap()
+
+    def _resolve(self, host):
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return None
+        return self.resolver.lookup(address)
+
+    def enrich(self, records):
+        """Attach locations to saved ``records``, whose ``fromhost`` should
+        already be loaded. Records which already have a source location are
+        left alone. Returns the number of records given a location.
+        """
+        resolved = {}
+        for record in records:
+            key = self.resolve(record.fromhost.value)
+            if key is not None:
+                resolved[record.pk] = key
+        located = LoginLocation.objects.filter(
+            login__in=resolved, role=SOURCE_ROLE
+        ).values_list("login", flat=True)
+        for pk in located:
+            del resolved[pk]
+        if not resolved:
+            return 0
+        ids = self.locations.ids(set(resolved.values()))
+        objs = [
+            LoginLocation(login_id=pk, location_id=ids[key], role=SOURCE_ROLE)
+            for pk, key in resolved.items()
+        ]
+        # A concurrent enrichment may still get in first
+        LoginLocation.objects.bulk_create(objs, ignore_conflicts=True)
+        return len(objs)
+
+
+def open_resolver(path):
+    """Open a MaxMind database or CIDR table, depending on the extension"""
+    if path.endswith(".mmdb"):
+        return MaxMindResolver(path)
+    return CidrTableResolver(path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_enricher():
+    """The process-wide LocationEnricher for the configured database, or
+    None if ``LOGIN_RECORDS_GEOIP_DATABASE`` isn't set.
+    """
+    path = getattr(settings, "LOGIN_RECORDS_GEOIP_DATABASE", None)
+    if not path:
+        return None
+    return LocationEnricher(
+        open_resolver(path),
+        cache_size=getattr(settings, "LOGIN_RECORDS_GEOIP_CACHE_SIZE", 65536),
+    )
+
+
+def enrich_inline(digests):
+    """Enrich the records with the given digests at ingest, unless no
+    database is configured or ``LOGIN_RECORDS_GEOIP_INLINE`` is False.
+    """
+    enricher = get_enricher()
+    if enricher is None or not getattr(settings, "LOGIN_RECORDS_GEOIP_INLINE", True):
+        return 0
+    return enricher.enrich(
+        LoginRecord.objects.filter(digest__in=digests).select_related("fromhost")
+    )
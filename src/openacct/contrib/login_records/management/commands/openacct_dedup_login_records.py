@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+from django.core.management.base import BaseCommand
+
+from openacct.contrib.login_records.models import LoginRecord
+from openacct.contrib.records import collapse_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign digests to LoginRecords stored before deduplication existed, "
+        "keeping the earliest copy of each duplicate and deleting the rest"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", required=False, default=1000, type=int,
+            help="Number of records to process per transaction"
+        )
+
+    def handle(self, *args, **kwargs):
+        assigned, deleted = collapse_duplicates(
+            LoginRecord.objects.select_related(*LoginRecord.dimensions),
+            chunk_size=kwargs["chunk_size"]
+        )
+        self.stdout.write(f"Kept {assigned} records, deleted {deleted} duplicates")
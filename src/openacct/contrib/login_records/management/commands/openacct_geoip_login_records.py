@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.contrib.login_records.geoip import (
+    SOURCE_ROLE,
+    LocationEnricher,
+    get_enricher,
+    open_resolver,
+)
+from openacct.contrib.login_records.models import LoginRecord
+
+
+class Command(BaseCommand):
+    help = (
+        "Attach source locations to LoginRecords which don't have one yet, "
+        "resolving their source hosts against a local GeoIP database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", required=False, default=None,
+            help="MaxMind .mmdb file or network,country,state,city CSV table. "
+            "Defaults to LOGIN_RECORDS_GEOIP_DATABASE"
+        )
+        parser.add_argument(
+            "--chunk-size", required=False, default=1000, type=int,
+            help="Number of records to process per batch"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["database"]:
+            enricher = LocationEnricher(open_resolver(kwargs["database"]))
+        else:
+            enricher = get_enricher()
+        if enricher is None:
+            raise CommandError("No GeoIP database given or configured")
+
+        records = (
+            LoginRecord.objects.exclude(loginlocation__role=SOURCE_ROLE)
+            .select_related("fromhost")
+            .order_by("pk")
+        )
+        last, scanned, resolved = 0, 0, 0
+        while True:
+            chunk = list(records.filter(pk__gt=last)[:kwargs["chunk_size"]])
+            if not chunk:
+                break
+            resolved += enricher.enrich(chunk)
+            scanned += len(chunk)
+            last = chunk[-1].pk
+        self.stdout.write(f"Resolved {resolved} of {scanned} records")
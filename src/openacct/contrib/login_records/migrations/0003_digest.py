@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login_records', '0002_locations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loginrecord',
+            name='digest',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
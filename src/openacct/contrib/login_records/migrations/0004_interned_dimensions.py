@@ -0,0 +1,149 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+DIMENSIONS = {
+    'host': 'LoginHost',
+    'service': 'LoginService',
+    'method': 'LoginMethod',
+    'user': 'LoginUser',
+    'fromhost': 'LoginHost',
+}
+
+
+def intern_strings(apps, schema_editor):
+    LoginRecord = apps.get_model('login_records', 'LoginRecord')
+    for field, model_name in DIMENSIONS.items():
+        model = apps.get_model('login_records', model_name)
+        # Empty strings become NULL, as they do in intern_fields
+        values = LoginRecord.objects.exclude(**{field: None}).exclude(
+            **{field: ''}
+        ).values_list(field, flat=True)
+        model.objects.bulk_create(
+            [model(value=v) for v in values.order_by().distinct().iterator()],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        LoginRecord.objects.update(**{
+            field + '_ref': Subquery(
+                model.objects.filter(value=OuterRef(field)).values('pk')[:1]
+            )
+        })
+
+
+def restore_strings(apps, schema_editor):
+    LoginRecord = apps.get_model('login_records', 'LoginRecord')
+    for field, model_name in DIMENSIONS.items():
+        model = apps.get_model('login_records', model_name)
+        LoginRecord.objects.update(**{
+            field: Subquery(
+                model.objects.filter(pk=OuterRef(field + '_ref')).values('value')[:1]
+            )
+        })
+
+
+def lookup_table():
+    return [
+        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('value', models.CharField(max_length=256, unique=True)),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login_records', '0003_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(name='LoginHost', fields=lookup_table(), options={'abstract': False}),
+        migrations.CreateModel(name='LoginMethod', fields=lookup_table(), options={'abstract': False}),
+        migrations.CreateModel(name='LoginService', fields=lookup_table(), options={'abstract': False}),
+        migrations.CreateModel(
+            name='LoginUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=32, unique=True)),
+            ],
+            options={'abstract': False},
+        ),
+        migrations.AddField(
+            model_name='loginrecord',
+            name='host_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginhost'),
+        ),
+        migrations.AddField(
+            model_name='loginrecord',
+            name='service_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginservice'),
+        ),
+        migrations.AddField(
+            model_name='loginrecord',
+            name='method_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginmethod'),
+        ),
+        migrations.AddField(
+            model_name='loginrecord',
+            name='user_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginuser'),
+        ),
+        migrations.AddField(
+            model_name='loginrecord',
+            name='fromhost_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginhost'),
+        ),
+        # Relax the old columns first, so that reversing can re-add them
+        # empty before restoring their values.
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='host',
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='service',
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='user',
+            field=models.CharField(max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='fromhost',
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.RunPython(intern_strings, restore_strings),
+        migrations.RemoveField(model_name='loginrecord', name='host'),
+        migrations.RemoveField(model_name='loginrecord', name='service'),
+        migrations.RemoveField(model_name='loginrecord', name='method'),
+        migrations.RemoveField(model_name='loginrecord', name='user'),
+        migrations.RemoveField(model_name='loginrecord', name='fromhost'),
+        migrations.RenameField(model_name='loginrecord', old_name='host_ref', new_name='host'),
+        migrations.RenameField(model_name='loginrecord', old_name='service_ref', new_name='service'),
+        migrations.RenameField(model_name='loginrecord', old_name='method_ref', new_name='method'),
+        migrations.RenameField(model_name='loginrecord', old_name='user_ref', new_name='user'),
+        migrations.RenameField(model_name='loginrecord', old_name='fromhost_ref', new_name='fromhost'),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='host',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginhost'),
+        ),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='service',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginservice'),
+        ),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginuser'),
+        ),
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='fromhost',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='login_records.loginhost'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def deduplicate(apps, schema_editor):
+    Location = apps.get_model('login_records', 'Location')
+    LoginLocation = apps.get_model('login_records', 'LoginLocation')
+    duplicates = (
+        Location.objects.values('country', 'state', 'city')
+        .annotate(keep=Min('pk'), count=Count('pk'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        others = Location.objects.filter(
+            country=row['country'], state=row['state'], city=row['city']
+        ).exclude(pk=row['keep'])
+        LoginLocation.objects.filter(location__in=others).update(location_id=row['keep'])
+        others.delete()
+
+    duplicates = (
+        LoginLocation.objects.values('login', 'role')
+        .annotate(keep=Min('pk'), count=Count('pk'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        LoginLocation.objects.filter(
+            login_id=row['login'], role=row['role']
+        ).exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login_records', '0004_interned_dimensions'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='location',
+            constraint=models.UniqueConstraint(fields=('country', 'state', 'city'), name='login_records_location_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='loginlocation',
+            constraint=models.UniqueConstraint(fields=('login', 'role'), name='login_records_loginlocation_key'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login_records', '0005_location_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loginrecord',
+            name='when',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -1,13 +1,56 @@
 from django.db import models
 
+from openacct.contrib.records import DigestRecord, InternedString
 
-class LoginRecord(models.Model):
-    when = models.DateTimeField()
-    host = models.CharField(max_length=256)
-    service = models.CharField(max_length=256)
-    method = models.CharField(max_length=256, blank=True, null=True)
-    user = models.CharField(max_length=32)
-    fromhost = models.CharField(max_length=256)
+
+class LoginHost(InternedString):
+    pass
+
+class LoginService(InternedString):
+    pass
+
+class LoginMethod(InternedString):
+    pass
+
+class LoginUser(InternedString):
+    value = models.CharField(max_length=32, unique=True)
+
+
+class LoginRecord(DigestRecord):
+    digest_fields = (
+        "when", "host", "service", "method", "user", "fromhost", "result", "reason"
+    )
+    # Fields holding interned strings, and the table each is interned in
+    dimensions = {
+        "host": LoginHost,
+        "service": LoginService,
+        "method": LoginMethod,
+        "user": LoginUser,
+        "fromhost": LoginHost,
+    }
+    # Columns and filters of exports, see openacct.export
+    export_fields = (
+        "id",
+        "when",
+        "host__value",
+        "service__value",
+        "method__value",
+        "user__value",
+        "fromhost__value",
+        "result",
+        "reason",
+    )
+    export_date_field = "when"
+    export_filters = {"systems": "host__value"}
+
+    when = models.DateTimeField(db_index=True)
+    host = models.ForeignKey(LoginHost, on_delete=models.PROTECT, related_name="+")
+    service = models.ForeignKey(LoginService, on_delete=models.PROTECT, related_name="+")
+    method = models.ForeignKey(
+        LoginMethod, on_delete=models.PROTECT, related_name="+", blank=True, null=True
+    )
+    user = models.ForeignKey(LoginUser, on_delete=models.PROTECT, related_name="+")
+    fromhost = models.ForeignKey(LoginHost, on_delete=models.PROTECT, related_name="+")
     result = models.CharField(max_length=64, blank=True, default='success')
     reason = models.CharField(max_length=256, blank=True, null=True)
     locations = models.ManyToManyField("Location", through="LoginLocation")
@@ -23,7 +66,21 @@ class Location(models.Model):
     def __str__(self):
         return f"{self.country} - {self.state} - {self.city}"
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["country", "state", "city"], name="login_records_location_key"
+            ),
+        ]
+
 class LoginLocation(models.Model):
     role = models.CharField(max_length=32)
     login = models.ForeignKey(LoginRecord, on_delete=models.CASCADE)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["login", "role"], name="login_records_loginlocation_key"
+            ),
+        ]
@@ -0,0 +1,93 @@
+"""
+    openacct.contrib.login_records.retention
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Retention policy for LoginRecords, see ``openacct.retention``.
+"""
+from django.core.exceptions import ValidationError
+
+from openacct.contrib.records import intern_fields
+from openacct.retention import RetentionPolicy
+
+from .forms import LoginRecordForm
+from .geoip import LocationMap
+from .models import LoginLocation, LoginRecord
+
+
+class LoginRecordPolicy(RetentionPolicy):
+    """Archives LoginRecords along with their locations"""
+
+    name = "login_records"
+    model = LoginRecord
+    fields = (
+        "when", "host", "service", "method", "user", "fromhost", "result",
+        "reason", "locations",
+    )
+    # reason is kept as JSON in CSV archives, where None and "" would
+    # otherwise read back the same and change the record's digest
+    nested_fields = ("reason", "locations")
+
+    def queryset(self):
+        return LoginRecord.objects.select_related(
+            *LoginRecord.dimensions
+        ).prefetch_related("loginlocation_set__location")
+
+    def serialize(self, obj):
+        return {
+            "when": obj.when.isoformat(),
+            "host": obj.host.value,
+            "service": obj.service.value,
+            "method": obj.method.value if obj.method else None,
+            "user": obj.user.value,
+            "fromhost": obj.fromhost.value,
+            "result": obj.result,
+            "reason": obj.reason,
+            "locations": [
+                {
+                    "role": ll.role,
+                    "country": ll.location.country,
+                    "state": ll.location.state,
+                    "city": ll.location.city,
+                }
+                for ll in obj.loginlocation_set.all()
+            ],
+        }
+
+    def restore(self, rows):
+        forms = [LoginRecordForm(row) for row in rows]
+        instances, locations = [], []
+        for form, row in zip(forms, rows):
+            if not form.is_valid():
+                raise ValidationError(form.errors.as_json())
+            for name in ("result", "reason"):
+                field = LoginRecord._meta.get_field(name)
+                setattr(form.instance, name, field.clean(row[name], form.instance))
+            instances.append(form.instance)
+            locations.append([
+                (loc["role"], (loc["country"], loc["state"], loc["city"]))
+                for loc in row["locations"]
+            ])
+        intern_fields(
+            instances, [form.cleaned_data for form in forms], LoginRecord.dimensions
+        )
+        for instance in instances:
+            instance.digest = instance.compute_digest()
+        LoginRecord.objects.bulk_create(instances, ignore_conflicts=True)
+
+        pks = dict(
+            LoginRecord.objects.filter(
+                digest__in=[i.digest for i in instances]
+            ).values_list("digest", "pk")
+        )
+        ids = LocationMap().ids({key for locs in locations for _, key in locs})
+        LoginLocation.objects.bulk_create(
+            [
+                LoginLocation(
+                    login_id=pks[instance.digest], location_id=ids[key], role=role
+                )
+                for instance, locs in zip(instances, locations)
+                for role, key in locs
+            ],
+            ignore_conflicts=True,
+        )
+        return len(rows)
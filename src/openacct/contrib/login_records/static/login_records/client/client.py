@@ -3,19 +3,17 @@
 import argparse
 import configparser
 import datetime
+import json
 import os
-import re
+import time
 
 import requests
 
+from follow import LogFollower
+from logparse import LogParser, expand_paths, parse_archive, parse_archives
 
-PATTERNS = {
-    "ssh": (
-        r"(?P<when>\w{3}\s+\d+ \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
-        + r"(?P<service>\S+)\[\d+\]: Accepted (?P<method>.+) for (?P<user>.+) "
-        + r"from (?P<from>.+) port \d+ (?P<rem>.*)$"
-    ),
-}
+
+SOURCES = ["sshd"]
 
 
 class ApiClient:
@@ -25,9 +23,12 @@ class ApiClient:
         self.url_prefix = config["ApiServer"]["url_prefix"]
         self.token = config["ApiServer"]["token"]
 
+    def url(self, endpoint: str):
+        return self.url_prefix.rstrip("/") + "/" + endpoint.lstrip("/")
+
     def send(self, endpoint: str, payload: dict):
         resp = requests.post(
-            os.path.join(self.url_prefix, endpoint),
+            self.url(endpoint),
             data=payload,
             headers={"Authorization": "Token " + self.token},
         )
@@ -35,39 +36,244 @@ class ApiClient:
         if resp.status_code != 200:
             raise RuntimeError(f"Server responded: {resp.status_code}")
 
+    def send_json(self, endpoint: str, payload: dict):
+        resp = requests.post(
+            self.url(endpoint),
+            json=payload,
+            headers={"Authorization": "Token " + self.token},
+        )
+        resp.raise_for_status()
+        if resp.status_code != 200:
+            raise RuntimeError(f"Server responded: {resp.status_code}")
+
+
+def build_payload(fields):
+    payload = {
+        "when": fields["when"],
+        "host": fields["host"],
+        "service": fields["service"],
+        "user": fields["user"],
+        "fromhost": fields["from"],
+    }
+    if fields["method"]:
+        payload["method"] = fields["method"]
+    return payload
+
+
+# Responses worth retrying an upload after. Any other error status means
+# the server refused the records, and would refuse them again.
+RETRY_STATUSES = {429} | set(range(500, 600))
+
+
+def retry_after(resp, interval):
+    """Seconds to wait before retrying, from a Retry-After header if any"""
+    try:
+        return max(float(resp.headers["Retry-After"]), interval)
+    except (KeyError, ValueError):
+        return interval
+
+
+def reject(records, path):
+    """Append records the server refused to the NDJSON file ``path``, from
+    where they can be corrected and uploaded again with --upload-spool.
+    """
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    print(f"Wrote {len(records)} rejected records to {path}")
+
+
+def send_with_retry(client, endpoint, payload, interval):
+    """Upload a payload, retrying through connection errors, timeouts,
+    server errors and rate limiting, so the checkpoint never moves past
+    records that weren't delivered. Returns False if the server refused
+    the payload, which retrying wouldn't change.
+    """
+    while True:
+        try:
+            client.send_json(endpoint, payload)
+            return True
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error, delay = e, interval
+        except requests.HTTPError as e:
+            if e.response.status_code not in RETRY_STATUSES:
+                print(f"Upload rejected: {e}")
+                return False
+            error, delay = e, retry_after(e.response, interval)
+        print(f"Upload failed, retrying in {delay}s: {error}")
+        time.sleep(delay)
+
+
+def upload_batch(client, batch, args):
+    """Upload a batch of records, writing it to ``args.reject_file`` if the
+    server refuses it so that one bad record can't stall uploads.
+    """
+    payload = {"records": batch}
+    if not send_with_retry(client, "/record_batch/", payload, args.poll_interval):
+        reject(batch, args.reject_file)
+
+
+def follow_file(client, args):
+    """Tail ``args.paths[0]`` forever, uploading batches of at most
+    ``args.batch_size`` records no later than ``args.max_latency`` seconds
+    after the first record in the batch was read. The offset is only
+    checkpointed after the server has accepted a batch.
+    """
+    follower = LogFollower(args.paths[0], args.state_file, args.poll_interval)
+    parser = LogParser(SOURCES)
+    batch, deadline, today = [], None, None
+    for line in follower.lines():
+        if line is not None:
+            # Lines are being written now, so a December stamp read in
+            # early January belongs to the previous year. The bound only
+            # needs moving daily, and moving it drops the parser's memo.
+            if today != datetime.date.today():
+                today = datetime.date.today()
+                parser.set_latest(
+                    datetime.datetime.now() + datetime.timedelta(days=1)
+                )
+            result = parser.parse(line)
+            if result is not None:
+                payload = build_payload(result[1])
+                payload["when"] = payload["when"].isoformat()
+                batch.append(payload)
+                if deadline is None:
+                    deadline = time.monotonic() + args.max_latency
+
+        if batch and (len(batch) >= args.batch_size or time.monotonic() >= deadline):
+            upload_batch(client, batch, args)
+            batch, deadline = [], None
+            follower.checkpoint()
+        elif not batch and line is None:
+            follower.checkpoint()
+
 
-def scan_file(path, patterns=["ssh"]):
-    with open(path) as f:
-        for line in f:
-            for label in patterns:
-                m = re.search(PATTERNS[label], line.rstrip())
-                if m:
-                    yield m
+def backfill_files(client, args):
+    """Parse every file matched by ``args.paths`` in a process pool and
+    either upload the records in batches, oldest file first, or append
+    them to the NDJSON spool file ``args.spool``.
+    """
+    paths = expand_paths(args.paths)
+    spool = open(args.spool, "a") if args.spool else None
+    batch = []
+    try:
+        parsed, count = None, 0
+        for path, results in parse_archives(paths, SOURCES, args.workers, args.year):
+            if path != parsed:
+                if parsed is not None:
+                    print(f"{parsed}: {count} records")
+                parsed, count = path, 0
+            count += len(results)
+            for _, fields in results:
+                payload = build_payload(fields)
+                payload["when"] = payload["when"].isoformat()
+                if spool:
+                    spool.write(json.dumps(payload) + "\n")
+                    continue
+                batch.append(payload)
+                if len(batch) >= args.batch_size:
+                    upload_batch(client, batch, args)
+                    batch = []
+        if parsed is not None:
+            print(f"{parsed}: {count} records")
+        if batch:
+            upload_batch(client, batch, args)
+    finally:
+        if spool:
+            spool.close()
+
+
+def upload_spool(client, args):
+    """Upload the records in NDJSON spool files written by ``--spool``"""
+    for path in args.paths:
+        batch = []
+        with open(path) as f:
+            for line in f:
+                batch.append(json.loads(line))
+                if len(batch) >= args.batch_size:
+                    upload_batch(client, batch, args)
+                    batch = []
+        if batch:
+            upload_batch(client, batch, args)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("path", help="")
+    parser.add_argument("paths", nargs="+", help="Log files, or globs with --backfill")
     parser.add_argument(
         "--year",
         required=False,
-        default=datetime.date.today().year,
-        help="",
+        type=int,
+        default=None,
+        help="Year the log was generated. Inferred from each file's mtime by default",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Tail the file, following rotations, and upload new records as they appear",
+    )
+    parser.add_argument(
+        "--state-file",
+        default="client.state",
+        help="Where --follow records the offset of the last uploaded line",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Parse rotated and compressed (.gz, .xz, .bz2) archives in parallel",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of parser processes for --backfill. Defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--spool",
+        default=None,
+        help="With --backfill, append records to this NDJSON file instead of uploading",
+    )
+    parser.add_argument(
+        "--upload-spool",
+        action="store_true",
+        help="Upload the records from NDJSON files written by --spool",
+    )
+    parser.add_argument(
+        "--reject-file",
+        default="client.rejects.ndjson",
+        help="Where batched modes write records the server refuses",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Maximum number of records per upload in batched modes",
+    )
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        default=5.0,
+        help="Maximum seconds a record is held before upload in --follow mode",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="Seconds to wait for new data in --follow mode, or between upload retries",
     )
 
     args = parser.parse_args()
-    client = ApiClient()
-    for m in scan_file(args.path):
-        payload = {
-            "when": datetime.datetime.strptime(
-                " ".join([str(args.year), m.group("when")]),
-                "%Y %b %d %H:%M:%S",
-            ),
-            "host": m.group("host"),
-            "service": m.group("service"),
-            "user": m.group("user"),
-            "fromhost": m.group("from"),
-        }
-        if m.group("method"):
-            payload["method"] = m.group("method")
-        client.send("/record/", payload)
+    if args.follow and len(args.paths) != 1:
+        parser.error("--follow takes exactly one path")
+
+    client = None if args.backfill and args.spool else ApiClient()
+    if args.follow:
+        follow_file(client, args)
+    elif args.backfill:
+        backfill_files(client, args)
+    elif args.upload_spool:
+        upload_spool(client, args)
+    else:
+        for path in args.paths:
+            for _, fields in parse_archive(path, SOURCES, args.year):
+                client.send("/record/", build_payload(fields))
@@ -0,0 +1,145 @@
+"""
+    follow
+    ~~~~~~
+
+    Tails a syslog file across rotations and truncations. The byte offset
+    of the last line handed to the caller is persisted to a small JSON
+    state file by ``checkpoint``, so a restarted scraper resumes exactly
+    where the previous run stopped instead of re-sending the whole file.
+"""
+import json
+import os
+import time
+
+
+class LogFollower:
+    """Follow ``path`` like ``tail -F``, remembering progress in
+    ``state_path``. Rotation is detected by a change of inode at ``path``
+    and truncation by the file shrinking below the current offset.
+    """
+
+    def __init__(self, path, state_path, poll_interval=1.0):
+        self.path = path
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.inode, self.position = self._load_state()
+        self._saved = (self.inode, self.position)
+        self._file = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            return state.get("inode"), int(state.get("offset", 0))
+        except (OSError, ValueError):
+            return None, 0
+
+    def checkpoint(self):
+        """Atomically persist the inode and offset of the last line
+        returned by ``lines``. Callers should only checkpoint once every
+        record parsed from those lines has been delivered.
+        """
+        if (self.inode, self.position) == self._saved:
+            return
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"path": self.path, "inode": self.inode, "offset": self.position}, f
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+        self._saved = (self.inode, self.position)
+
+    def _find_rotated(self):
+        """Look for the file we were reading before a restart, in case it
+        was rotated away from ``path`` (e.g. ``messages.1`` or
+        ``messages-20230101``) while the scraper wasn't running.
+        """
+        dirname = os.path.dirname(self.path) or "."
+        basename = os.path.basename(self.path)
+        for name in os.listdir(dirname):
+            if not name.startswith(basename) or name == basename:
+                continue
+            candidate = os.path.join(dirname, name)
+            try:
+                if os.stat(candidate).st_ino == self.inode:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def _open(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        path = self.path
+        if self.inode is not None and st.st_ino != self.inode:
+            path = self._find_rotated()
+            if path is None:
+                self.inode, self.position = st.st_ino, 0
+                path = self.path
+
+        f = open(path, "rb")
+        st = os.fstat(f.fileno())
+        if st.st_ino != self.inode or st.st_size < self.position:
+            self.inode, self.position = st.st_ino, 0
+        f.seek(self.position)
+        return f
+
+    def _rotated(self):
+        """Returns True if ``path`` now names a different file than the
+        one currently open. Resets the offset in place on truncation.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if st.st_ino != self.inode:
+            return True
+        if st.st_size < self.position:
+            self._file.seek(0)
+            self.position = 0
+        return False
+
+    def lines(self):
+        """Generator yielding each complete line appended to the file,
+        without its trailing newline. Yields ``None`` whenever no new data
+        is available, so the caller can flush on a latency bound between
+        polls. Partial lines are left unread until they are completed.
+        """
+        while True:
+            if self._file is None:
+                self._file = self._open()
+                if self._file is None:
+                    yield None
+                    time.sleep(self.poll_interval)
+                    continue
+
+            raw = self._file.readline()
+            if raw.endswith(b"\n"):
+                self.position += len(raw)
+                yield raw[:-1].decode("utf-8", "replace")
+                continue
+
+            if self._rotated():
+                # The old file is fully drained, so anything left without a
+                # newline is a final line that will never be completed.
+                if raw:
+                    self.position += len(raw)
+                    yield raw.decode("utf-8", "replace")
+                self._file.close()
+                self._file = None
+                self.inode, self.position = None, 0
+                continue
+
+            self._file.seek(self.position)
+            yield None
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,248 @@
+"""
+    logparse
+    ~~~~~~~~
+
+    Single-pass syslog parser shared by the OpenAcct log scrapers. Each
+    source registers a cheap substring marker and a message pattern which
+    is compiled once together with the syslog header. Lines which don't
+    contain any marker are rejected before a regex is ever run, and the
+    syslog timestamp is decoded without ``strptime``. The header may follow
+    a prefix, such as a ``<13>`` priority or a relay's own header.
+
+    New sources can be added with ``register_source``. Rotated archives,
+    compressed or not, can be parsed concurrently with ``parse_archives``.
+"""
+import bz2
+import datetime
+import functools
+import glob
+import gzip
+import lzma
+import multiprocessing
+import os
+import re
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+
+# Matches the BSD syslog header, ``Mmm dd hh:mm:ss host tag[pid]: ``, with
+# the day space or zero padded, or not padded at all
+HEADER = (
+    r"(?P<when>\w{3}\s+\d{1,2} \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
+    + r"(?P<service>[^\s\[:]+)(?:\[\d+\])?: "
+)
+
+
+class Source:
+    """A kind of log message to extract. ``marker`` must be a substring
+    present in every line the ``pattern`` can match; it is used to discard
+    unrelated lines without running the regex.
+    """
+
+    def __init__(self, name, marker, pattern):
+        self.name = name
+        self.marker = marker
+        self.regex = re.compile(HEADER + pattern)
+
+    def __repr__(self):
+        return f"Source({self.name!r})"
+
+
+SOURCES = {}
+
+
+def register_source(name, marker, pattern):
+    """Add a source to the registry so it can be selected by name when
+    building a ``LogParser``. Returns the new ``Source``.
+    """
+    SOURCES[name] = Source(name, marker, pattern)
+    return SOURCES[name]
+
+
+register_source(
+    "sshd",
+    ": Accepted ",
+    r"Accepted (?P<method>\S+) for (?P<user>\S+) from (?P<from>\S+) port \d+",
+)
+register_source(
+    "envmodules",
+    ": module-",
+    r"(?P<type>module-cmd|module-event) (?P<data>\{.*\})$",
+)
+register_source(
+    "sudo",
+    " sudo: ",
+    r"\s*(?P<user>\S+) : (?:TTY=(?P<tty>\S+) ; )?PWD=(?P<pwd>\S+) ; "
+    + r"USER=(?P<runas>\S+) ; COMMAND=(?P<command>.*)$",
+)
+
+
+class LogParser:
+    """Parses lines for the selected ``sources``. Syslog timestamps carry
+    no year, so ``year`` is used to complete them. Alternatively ``latest``
+    gives the newest time a line could have been written, such as a file's
+    mtime, in which case the year is taken from it and any line stamped
+    after it is assumed to be from the previous year.
+    """
+
+    def __init__(self, sources, year=None, latest=None):
+        self.sources = [SOURCES[name] for name in sources]
+        self.year = year if year else datetime.date.today().year
+        self.latest = None
+        self._last_stamp = None
+        self._last_when = None
+        if latest is not None:
+            self.set_latest(latest)
+
+    def set_latest(self, latest):
+        self.year = latest.year
+        self.latest = latest
+        self._last_stamp = None
+
+    def timestamp(self, stamp):
+        """Convert a ``Mmm dd hh:mm:ss`` string into a datetime. Log lines
+        arrive in bursts sharing the same second, so the previous result is
+        reused when the stamp repeats.
+        """
+        if stamp != self._last_stamp:
+            month, day, clock = stamp.split()
+            when = datetime.datetime(
+                self.year,
+                MONTHS[month],
+                int(day),
+                int(clock[0:2]),
+                int(clock[3:5]),
+                int(clock[6:8]),
+            )
+            if self.latest is not None and when > self.latest:
+                when = when.replace(year=self.year - 1)
+            self._last_when = when
+            self._last_stamp = stamp
+        return self._last_when
+
+    def parse(self, line):
+        """Returns a ``(source_name, fields)`` tuple for the first source
+        matching the line, or None. ``fields`` holds the named groups of
+        the match with ``when`` converted to a datetime.
+        """
+        for source in self.sources:
+            if source.marker not in line:
+                continue
+            m = source.regex.search(line)
+            if m is None:
+                continue
+            fields = m.groupdict()
+            try:
+                fields["when"] = self.timestamp(fields["when"])
+            except (KeyError, ValueError):
+                return None
+            return source.name, fields
+        return None
+
+    def parse_lines(self, lines):
+        for line in lines:
+            result = self.parse(line.rstrip("\n"))
+            if result is not None:
+                yield result
+
+    def parse_file(self, path):
+        with open_log(path) as f:
+            yield from self.parse_lines(f)
+
+
+OPENERS = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}
+
+
+def open_log(path):
+    """Open a log for streaming text reads, decompressing on the fly if
+    the file name ends in ``.gz``, ``.xz`` or ``.bz2``.
+    """
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, "rt", errors="replace")
+
+
+def file_mtime(path):
+    return datetime.datetime.fromtimestamp(os.stat(path).st_mtime)
+
+
+def expand_paths(patterns):
+    """Expand a list of file names and globs, returning each matching file
+    once, oldest first by mtime so records come out in log order.
+    """
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in glob.glob(pattern) if os.path.isfile(p))
+    return sorted(paths, key=os.path.getmtime)
+
+
+def parse_archive(path, sources, year=None):
+    """Parse a whole file, yielding ``(source_name, fields)`` tuples. The
+    year is inferred from the file's mtime unless given.
+    """
+    if year:
+        parser = LogParser(sources, year=year)
+    else:
+        parser = LogParser(sources, latest=file_mtime(path))
+    return parser.parse_file(path)
+
+
+def _parse_into(queue, path, sources, year, chunk_size):
+    """Worker half of ``parse_archives``: put the records of ``path`` on
+    ``queue`` in lists of ``chunk_size``, then None, or the error raised.
+    """
+    try:
+        chunk, sent = [], False
+        for result in parse_archive(path, sources, year):
+            chunk.append(result)
+            if len(chunk) >= chunk_size:
+                queue.put(chunk)
+                chunk, sent = [], True
+        if chunk or not sent:
+            queue.put(chunk)
+    except Exception as e:
+        queue.put(e)
+    else:
+        queue.put(None)
+
+
+def parse_archives(paths, sources, workers=None, year=None, chunk_size=1000, backlog=4):
+    """Parse ``paths`` in a pool of ``workers`` processes, yielding
+    ``(path, results)`` tuples, where ``results`` is a list of at most
+    ``chunk_size`` records, in the order the paths were given. Every file
+    yields at least one list, which is empty if it holds no records.
+
+    Workers stream each file back through a queue holding at most
+    ``backlog`` chunks, and only as many files as there are workers are in
+    progress at once, so a worker which gets ahead of the file being
+    consumed waits rather than holding its whole file in memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    paths = iter(paths)
+    pending = deque()
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(workers) as pool:
+        while True:
+            for path in paths:
+                queue = manager.Queue(backlog)
+                future = pool.submit(
+                    _parse_into, queue, path, sources, year, chunk_size
+                )
+                pending.append((path, queue, future))
+                if len(pending) >= workers:
+                    break
+            if not pending:
+                return
+            path, queue, future = pending.popleft()
+            while True:
+                chunk = queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield path, chunk
+            future.result()
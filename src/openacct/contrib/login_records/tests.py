@@ -1,3 +1,438 @@
-from django.test import TestCase
+import datetime
+import gzip
+import importlib.util
+import json
+import os
+import sys
+import tempfile
 
-# Create your tests here.
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from openacct.contrib.records import clear_intern_caches, collapse_duplicates
+from openacct.contrib.token_auth.models import AuthToken
+from openacct.contrib.token_auth.throttle import _local_store
+from openacct.retention import archive, find_archives, restore
+
+from .forms import LoginRecordForm
+from .geoip import SOURCE_ROLE, LocationEnricher, LocationMap
+from .models import LoginHost, LoginLocation, LoginRecord
+from .retention import LoginRecordPolicy
+from .views import LoginRecordBatchView
+
+
+def load_client_module(name):
+    """Import a module of the log scraper client, which isn't a package"""
+    path = os.path.join(
+        os.path.dirname(__file__), "static", "login_records", "client", name + ".py"
+    )
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that functions sent to worker processes can be pickled
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+follow = load_client_module("follow")
+logparse = load_client_module("logparse")
+
+ACCEPTED = "sshd[123]: Accepted publickey for bob from 10.0.0.1 port 5022 ssh2"
+
+
+class LogParseTests(SimpleTestCase):
+    def setUp(self):
+        self.parser = logparse.LogParser(["sshd"], year=2024)
+
+    def assertParses(self, line, when=datetime.datetime(2024, 1, 5, 10, 0, 1)):
+        result = self.parser.parse(line)
+        self.assertIsNotNone(result, line)
+        name, fields = result
+        self.assertEqual(name, "sshd")
+        self.assertEqual(fields["when"], when)
+        self.assertEqual(fields["host"], "node01")
+        self.assertEqual(fields["user"], "bob")
+        self.assertEqual(fields["from"], "10.0.0.1")
+
+    def test_day_padding(self):
+        for stamp in ("Jan  5 10:00:01", "Jan 05 10:00:01", "Jan 5 10:00:01"):
+            self.assertParses(f"{stamp} node01 {ACCEPTED}")
+        self.assertParses(
+            f"Jan 15 10:00:01 node01 {ACCEPTED}",
+            datetime.datetime(2024, 1, 15, 10, 0, 1),
+        )
+
+    def test_prefixed_lines(self):
+        self.assertParses(f"<13>Jan  5 10:00:01 node01 {ACCEPTED}")
+        self.assertParses(
+            f"2024-01-05T10:00:00+00:00 relay01 Jan  5 10:00:01 node01 {ACCEPTED}"
+        )
+
+    def test_unrelated_lines(self):
+        self.assertIsNone(self.parser.parse("Jan  5 10:00:01 node01 CROND[1]: CMD"))
+        self.assertIsNone(self.parser.parse("garbage: Accepted nothing"))
+
+    def test_previous_year(self):
+        parser = logparse.LogParser(
+            ["sshd"], latest=datetime.datetime(2024, 1, 2)
+        )
+        _, fields = parser.parse(f"Dec 31 23:59:59 node01 {ACCEPTED}")
+        self.assertEqual(fields["when"], datetime.datetime(2023, 12, 31, 23, 59, 59))
+
+
+class ArchiveTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+
+    def write(self, name, users, mtime, opener=open):
+        path = os.path.join(self.root, name)
+        with opener(path, "wt") as f:
+            for user in users:
+                f.write(
+                    f"Jan  5 10:00:01 node01 sshd[1]: Accepted publickey for "
+                    f"{user} from 10.0.0.1 port 22 ssh2\n"
+                )
+            f.write("Jan  5 10:00:02 node01 CROND[2]: (root) CMD (true)\n")
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_expand_paths(self):
+        newer = self.write("secure", [], 2000)
+        older = self.write("secure-20240101.gz", [], 1000, gzip.open)
+        os.mkdir(os.path.join(self.root, "secure.d"))
+        pattern = os.path.join(self.root, "secure*")
+        self.assertEqual(
+            logparse.expand_paths([pattern, newer]), [older, newer]
+        )
+
+    def test_gzip_archive(self):
+        path = self.write("secure.1.gz", ["bob", "alice"], 1000, gzip.open)
+        self.assertEqual(
+            [fields["user"] for _, fields in logparse.parse_archive(path, ["sshd"])],
+            ["bob", "alice"],
+        )
+
+    def test_parse_archives_in_order(self):
+        users = [f"user{i}" for i in range(5)]
+        paths = [
+            self.write("secure.3.gz", users, 1000, gzip.open),
+            self.write("secure.2", [], 2000),
+            self.write("secure.1", ["carol"], 3000),
+        ]
+        results = list(
+            logparse.parse_archives(paths, ["sshd"], workers=2, year=2024, chunk_size=2)
+        )
+        users_read = [
+            (path, [fields["user"] for _, fields in chunk]) for path, chunk in results
+        ]
+        self.assertEqual(
+            users_read,
+            [
+                (paths[0], users[:2]), (paths[0], users[2:4]), (paths[0], users[4:]),
+                (paths[1], []),
+                (paths[2], ["carol"]),
+            ],
+        )
+        self.assertEqual(results[0][1][0][1]["when"].year, 2024)
+
+    def test_parse_archives_error(self):
+        with self.assertRaises(OSError):
+            list(logparse.parse_archives(
+                [os.path.join(self.root, "missing")], ["sshd"], workers=1
+            ))
+
+
+class LogFollowerTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.path = os.path.join(root.name, "messages")
+        self.state_path = os.path.join(root.name, "state.json")
+
+    def write(self, *lines, path=None, mode="a"):
+        with open(path or self.path, mode) as f:
+            f.writelines(line + "\n" for line in lines)
+
+    def follower(self):
+        follower = follow.LogFollower(self.path, self.state_path, poll_interval=0)
+        self.addCleanup(follower.close)
+        return follower
+
+    def read(self, lines):
+        """The lines available until the follower has nothing new for two
+        polls in a row
+        """
+        read, idle = [], 0
+        for line in lines:
+            if line is None:
+                idle += 1
+                if idle == 2:
+                    return read
+            else:
+                read.append(line)
+                idle = 0
+
+    def test_rotation(self):
+        self.write("one", "two")
+        lines = self.follower().lines()
+        self.assertEqual(self.read(lines), ["one", "two"])
+        # Written before the rotation, so still in the renamed file
+        self.write("three")
+        os.rename(self.path, self.path + ".1")
+        self.write("four", mode="w")
+        self.assertEqual(self.read(lines), ["three", "four"])
+
+    def test_truncation(self):
+        self.write("a long first line", "a long second line")
+        lines = self.follower().lines()
+        self.assertEqual(len(self.read(lines)), 2)
+        self.write("short", mode="w")
+        self.assertEqual(self.read(lines), ["short"])
+
+    def test_resume_after_restart(self):
+        self.write("one", "two")
+        follower = self.follower()
+        self.assertEqual(self.read(follower.lines()), ["one", "two"])
+        follower.checkpoint()
+        follower.close()
+
+        self.write("three")
+        self.assertEqual(self.read(self.follower().lines()), ["three"])
+
+    def test_resume_in_file_rotated_while_stopped(self):
+        self.write("one")
+        follower = self.follower()
+        self.read(follower.lines())
+        follower.checkpoint()
+        follower.close()
+
+        self.write("two")
+        os.rename(self.path, self.path + "-20240105")
+        self.write("three", mode="w")
+        self.assertEqual(self.read(self.follower().lines()), ["two", "three"])
+
+    def test_unchecked_lines_read_again(self):
+        self.write("one")
+        follower = self.follower()
+        self.read(follower.lines())
+        follower.close()
+        self.assertEqual(self.read(self.follower().lines()), ["one"])
+
+
+class FixedResolver:
+    def lookup(self, address):
+        return ("US", "Colorado", "Boulder")
+
+
+def login_record(fromhost, result="success", reason=None, **kwargs):
+    data = {
+        "when": "2024-01-05T10:00:01+00:00",
+        "host": "node01",
+        "service": "sshd",
+        "user": "bob",
+        "fromhost": fromhost,
+    }
+    data.update(kwargs)
+    form = LoginRecordForm(data)
+    form.is_valid()
+    record = form.save(commit=False)
+    record.result, record.reason = result, reason
+    record.save()
+    return record
+
+
+class EnrichTests(TestCase):
+    def setUp(self):
+        clear_intern_caches()
+
+    def test_located_records_left_alone(self):
+        located = login_record("10.0.0.1")
+        unlocated = login_record("10.0.0.2")
+        login_record("login.example.com")
+        (elsewhere,) = LocationMap().ids([("US", "Utah", "Logan")]).values()
+        LoginLocation.objects.create(
+            login=located, location_id=elsewhere, role=SOURCE_ROLE
+        )
+
+        enricher = LocationEnricher(FixedResolver())
+        records = LoginRecord.objects.select_related("fromhost")
+        self.assertEqual(enricher.enrich(records), 1)
+        self.assertEqual(enricher.enrich(records), 0)
+        self.assertEqual(
+            dict(LoginLocation.objects.values_list("login", "location__city")),
+            {located.pk: "Logan", unlocated.pk: "Boulder"},
+        )
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        clear_intern_caches()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def round_trip(self, format):
+        policy = LoginRecordPolicy(days=0, format=format)
+        records = [
+            login_record("10.0.0.1", reason=None),
+            login_record("10.0.0.2", result="failure", reason=""),
+            login_record("10.0.0.3", result="failure", reason="bad key"),
+        ]
+        (location,) = LocationMap().ids([("US", "Utah", "Logan")]).values()
+        LoginLocation.objects.create(
+            login=records[0], location_id=location, role=SOURCE_ROLE
+        )
+        digests = {r.digest for r in records}
+        cutoff = datetime.date(2024, 2, 1)
+        self.assertEqual(archive(policy, self.root.name, cutoff), (3, 3))
+
+        restored, skipped = restore(policy, find_archives(self.root.name, policy))
+        self.assertEqual((restored, skipped), (3, []))
+        self.assertEqual(
+            set(LoginRecord.objects.values_list("digest", flat=True)), digests
+        )
+        self.assertEqual(
+            list(
+                LoginLocation.objects.values_list("login__digest", "location__city")
+            ),
+            [(records[0].digest, "Logan")],
+        )
+
+    def test_round_trip_ndjson(self):
+        self.round_trip("ndjson")
+
+    def test_round_trip_csv(self):
+        self.round_trip("csv")
+
+    def test_bad_rows_skipped(self):
+        policy = LoginRecordPolicy(days=0, chunk_size=10)
+        good = {
+            "when": "2024-01-05T10:00:01+00:00", "host": "node01",
+            "service": "sshd", "method": None, "user": "bob",
+            "fromhost": "10.0.0.1", "result": "success", "reason": None,
+            "locations": [],
+        }
+        rows = [
+            good,
+            dict(good, when="yesterday"),
+            dict(good, fromhost="10.0.0.2", result="x" * 100),
+            {"when": "2024-01-05T10:00:01+00:00"},
+            dict(good, fromhost="10.0.0.3"),
+        ]
+        path = os.path.join(self.root.name, "login_records-2024-01-05.ndjson.gz")
+        with gzip.open(path, "wt") as f:
+            f.writelines(json.dumps(row) + "\n" for row in rows)
+
+        restored, skipped = restore(policy, [path])
+        self.assertEqual(restored, 2)
+        self.assertEqual([row for _, row, _ in skipped], rows[1:4])
+        self.assertEqual(
+            sorted(LoginRecord.objects.values_list("fromhost__value", flat=True)),
+            ["10.0.0.1", "10.0.0.3"],
+        )
+
+
+class InternTests(TestCase):
+    def setUp(self):
+        clear_intern_caches()
+
+    def test_intern(self):
+        with self.assertNumQueries(3):
+            hosts = LoginHost.objects.intern(["node01", "node02"])
+        self.assertEqual(
+            {value: host.value for value, host in hosts.items()},
+            {"node01": "node01", "node02": "node02"},
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(LoginHost.objects.intern(["node01"]), {
+                "node01": hosts["node01"]
+            })
+        clear_intern_caches()
+        with self.assertNumQueries(1):
+            self.assertEqual(LoginHost.objects.intern(["node02"]), {
+                "node02": hosts["node02"]
+            })
+        self.assertEqual(LoginHost.objects.count(), 2)
+
+
+class CollapseDuplicatesTests(TestCase):
+    def setUp(self):
+        clear_intern_caches()
+
+    def test_collapse(self):
+        first = login_record("10.0.0.1")
+        other = login_record("10.0.0.2")
+        copies = [
+            LoginRecord(
+                when=first.when, host=first.host, service=first.service,
+                user=first.user, fromhost=first.fromhost, result=first.result,
+            )
+            for _ in range(2)
+        ]
+        # Rows stored before digests existed
+        LoginRecord.objects.bulk_create(copies)
+        LoginRecord.objects.filter(pk=first.pk).update(digest=None)
+
+        self.assertEqual(
+            collapse_duplicates(LoginRecord.objects.all(), chunk_size=2), (1, 2)
+        )
+        self.assertEqual(
+            dict(LoginRecord.objects.values_list("pk", "digest")),
+            {first.pk: first.digest, other.pk: other.digest},
+        )
+
+    def test_rank(self):
+        first = login_record("10.0.0.1")
+        copy = LoginRecord.objects.get(pk=first.pk)
+        copy.pk = None
+        copy.digest = None
+        LoginRecord.objects.bulk_create([copy])
+        LoginRecord.objects.update(digest=None)
+        collapse_duplicates(LoginRecord.objects.all(), rank=lambda row: row.pk)
+        self.assertEqual(
+            list(LoginRecord.objects.values_list("pk", flat=True)), [copy.pk]
+        )
+
+
+class LoginRecordBatchViewTests(TestCase):
+    def setUp(self):
+        clear_intern_caches()
+        _local_store.clear()
+        self.token = AuthToken.objects.create(
+            name="scraper",
+            expires=timezone.now() + datetime.timedelta(days=1),
+            record_limit=60,
+        )
+
+    def post(self, records):
+        request = RequestFactory().post(
+            "/", json.dumps({"records": records}), content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token.token}",
+        )
+        return LoginRecordBatchView.as_view()(request)
+
+    def record(self, fromhost):
+        return {
+            "when": "2024-01-05T10:00:01+00:00", "host": "node01",
+            "service": "sshd", "user": "bob", "fromhost": fromhost,
+        }
+
+    def test_replay(self):
+        records = [self.record("10.0.0.1"), self.record("10.0.0.2")]
+        self.assertEqual(json.loads(self.post(records).content), {"accepted": 2})
+        self.assertEqual(self.post(records).status_code, 200)
+        self.assertEqual(LoginRecord.objects.count(), 2)
+
+    def test_invalid_batch_rejected(self):
+        response = self.post([self.record("10.0.0.1"), {"when": "yesterday"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LoginRecord.objects.exists())
+
+    def test_record_limit(self):
+        records = [self.record(f"10.0.0.{i}") for i in range(60)]
+        self.assertEqual(self.post(records).status_code, 200)
+        response = self.post([self.record("10.0.1.1")])
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(LoginRecord.objects.count(), 60)
@@ -1,7 +1,8 @@
 from django.urls import path
 
-from .views import LoginRecordView
+from .views import LoginRecordBatchView, LoginRecordView
 
 urlpatterns = [
     path("record/", LoginRecordView.as_view(), name="record-login"),
+    path("record_batch/", LoginRecordBatchView.as_view(), name="record-login-batch"),
 ]
@@ -1,9 +1,30 @@
-from django.http import HttpResponse, HttpResponseBadRequest
+import json
+
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.views import View
 
+from openacct.contrib.records import intern_fields
 from openacct.contrib.token_auth.mixins import TokenAuthMixin
 
 from .forms import LoginRecordForm
+from .geoip import enrich_inline
+from .models import LoginRecord
+
+
+def insert_records(forms):
+    """Insert the records from valid LoginRecordForms, interning their
+    strings in bulk and silently skipping any records that are already
+    stored, so a client can replay a log without creating duplicates. The
+    records are then enriched with locations if GeoIP is configured.
+    """
+    instances = [form.instance for form in forms]
+    intern_fields(
+        instances, [form.cleaned_data for form in forms], LoginRecord.dimensions
+    )
+    for instance in instances:
+        instance.digest = instance.compute_digest()
+    LoginRecord.objects.bulk_create(instances, ignore_conflicts=True)
+    enrich_inline([instance.digest for instance in instances])
 
 
 class LoginRecordView(TokenAuthMixin, View):
@@ -11,5 +32,39 @@ class LoginRecordView(TokenAuthMixin, View):
         form = LoginRecordForm(request.POST)
         if not form.is_valid():
             return HttpResponseBadRequest()
-        form.save()
+        limited = self.limit_records(1)
+        if limited:
+            return limited
+        insert_records([form])
         return HttpResponse()
+
+
+class LoginRecordBatchView(TokenAuthMixin, View):
+    """Accepts a JSON body of the form ``{"records": [...]}``, validating
+    each record with ``LoginRecordForm`` and inserting them with a single
+    conflict-ignoring ``bulk_create``. The batch is rejected as a whole if
+    any record is invalid, and records which were already stored are
+    skipped, so clients can safely retry or replay it.
+    """
+
+    def post(self, request):
+        try:
+            records = json.loads(request.body)["records"]
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest()
+        if not isinstance(records, list):
+            return HttpResponseBadRequest()
+        limited = self.limit_records(len(records))
+        if limited:
+            return limited
+
+        forms = []
+        for record in records:
+            if not isinstance(record, dict):
+                return HttpResponseBadRequest()
+            form = LoginRecordForm(record)
+            if not form.is_valid():
+                return HttpResponseBadRequest()
+            forms.append(form)
+        insert_records(forms)
+        return JsonResponse({"accepted": len(forms)})
@@ -0,0 +1,179 @@
+"""
+    openacct.contrib.records
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Shared pieces for the contrib apps which ingest telemetry records
+    scraped from logs. Records carry a content digest with a unique
+    constraint so that replaying a log inserts nothing new when combined
+    with conflict-ignoring bulk inserts. Strings which repeat across many
+    records, like host and module names, are interned into lookup tables.
+"""
+import datetime
+import hashlib
+import json
+
+from collections import defaultdict
+
+from django.db import models, transaction
+
+
+def _canonical(value):
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+class DigestRecord(models.Model):
+    """Abstract base for records identified by a SHA-256 digest of the
+    fields named in ``digest_fields``, plus those in
+    ``optional_digest_fields`` which aren't None. Fields added to a digest
+    later belong in the latter, so that rows stored without them keep their
+    digests. The digest is recomputed on every ``save``; code using
+    ``bulk_create`` must call ``compute_digest`` itself. Rows stored before
+    the digest existed have a NULL digest until ``collapse_duplicates`` is
+    run over them.
+    """
+
+    digest_fields = ()
+    optional_digest_fields = ()
+
+    digest = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False
+    )
+
+    def compute_digest(self):
+        values = [_canonical(getattr(self, name)) for name in self.digest_fields]
+        for name in self.optional_digest_fields:
+            value = getattr(self, name)
+            if value is not None:
+                values.append([name, _canonical(value)])
+        return hashlib.sha256(
+            json.dumps(values, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.digest = self.compute_digest()
+        super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+def collapse_duplicates(queryset, rank=None, chunk_size=1000):
+    """Assign digests to the rows of a DigestRecord ``queryset`` which don't
+    have one yet, deleting all but one copy of each duplicate. ``rank`` is
+    an optional key function, and the copy ranking highest is kept; by
+    default the earliest row is kept. Returns a tuple of the number of rows
+    assigned a digest and the number deleted.
+    """
+    rank = rank if rank else (lambda row: -row.pk)
+    model = queryset.model
+    pending = queryset.filter(digest__isnull=True).order_by("pk")
+    assigned = deleted = 0
+    while True:
+        rows = list(pending[:chunk_size])
+        if not rows:
+            break
+        for row in rows:
+            row.digest = row.compute_digest()
+
+        keepers = {
+            row.digest: row
+            for row in queryset.filter(digest__in=[r.digest for r in rows])
+        }
+        doomed = []
+        for row in rows:
+            best = keepers.get(row.digest)
+            if best is None or rank(row) > rank(best):
+                if best is not None:
+                    doomed.append(best)
+                keepers[row.digest] = row
+            else:
+                doomed.append(row)
+        kept = [row for row in rows if keepers[row.digest] is row]
+
+        with transaction.atomic():
+            # Remove the losers first so the surviving copy can take over a
+            # digest that an existing row held.
+            model.objects.filter(pk__in=[row.pk for row in doomed]).delete()
+            model.objects.bulk_update(kept, ["digest"])
+        assigned += len(kept)
+        deleted += len(doomed)
+    return assigned, deleted
+
+
+_intern_caches = defaultdict(dict)
+
+
+def clear_intern_caches():
+    """Forget every cached interned string, such as after rolling back a
+    transaction in which some were created.
+    """
+    _intern_caches.clear()
+
+
+class InternedStringManager(models.Manager):
+    """Maps strings to rows of an InternedString model, creating rows as
+    needed. Rows are never modified once created, so they're cached
+    in-process for the life of the worker, up to ``cache_size`` entries.
+    """
+
+    cache_size = 100000
+
+    def intern(self, values):
+        """Returns a dict mapping each of ``values`` to its row, using at
+        most three queries for any values which aren't already cached.
+        Avoid calling this inside a transaction which may be rolled back,
+        as rows created by it would remain cached.
+        """
+        cache = _intern_caches[self.model._meta.label]
+        values = set(values)
+        found = {v: cache[v] for v in values if v in cache}
+        missing = values - found.keys()
+        if missing:
+            fetched = {obj.value: obj for obj in self.filter(value__in=missing)}
+            created = missing - fetched.keys()
+            if created:
+                self.bulk_create(
+                    [self.model(value=v) for v in created], ignore_conflicts=True
+                )
+                fetched.update(
+                    {obj.value: obj for obj in self.filter(value__in=created)}
+                )
+            if len(cache) + len(fetched) > self.cache_size:
+                cache.clear()
+            cache.update(fetched)
+            found.update(fetched)
+        return found
+
+
+class InternedString(models.Model):
+    """Abstract base for lookup tables of strings which would otherwise be
+    repeated on millions of records. Subclasses may redefine ``value`` to
+    change its length.
+    """
+
+    value = models.CharField(max_length=256, unique=True)
+
+    objects = InternedStringManager()
+
+    def __str__(self):
+        return self.value
+
+    class Meta:
+        abstract = True
+
+
+def intern_fields(instances, rows, dimensions):
+    """Set the foreign keys of unsaved ``instances`` to interned strings.
+    ``rows`` is a parallel list of dicts, such as forms' ``cleaned_data``,
+    holding the raw strings, and ``dimensions`` maps each field name to the
+    InternedString model it refers to. Empty strings become NULL.
+    """
+    for field, model in dimensions.items():
+        values = [row.get(field) for row in rows]
+        interned = model.objects.intern(v for v in values if v)
+        for instance, value in zip(instances, values):
+            setattr(instance, field, interned[value] if value else None)
@@ -4,7 +4,14 @@ from .models import AuthToken
 
 
 class AuthTokenAdmin(admin.ModelAdmin):
-    pass
+    list_display = (
+        "name",
+        "created",
+        "last_used",
+        "expires",
+        "rate_limit",
+        "record_limit",
+    )
 
 
 admin.site.register(AuthToken, AuthTokenAdmin)
@@ -0,0 +1,156 @@
+"""
+    openacct.contrib.token_auth.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Ingest clients authenticate every request with the same few tokens, so
+    valid tokens are kept in a short-lived in-process cache instead of being
+    looked up each time, and writes to ``AuthToken.last_used`` are coalesced
+    into at most one ``update`` per token per interval.
+
+    Saving or deleting a token, or updating tokens through a queryset,
+    evicts them from this process's cache. Other processes only notice
+    within ``TOKEN_AUTH_CACHE_TTL`` seconds, unless
+    ``TOKEN_AUTH_REVOCATION_CACHE`` names a cache in ``CACHES`` shared by
+    every process, such as memcached or redis. Changes to tokens then bump a
+    revocation generation kept in it, which is read on each lookup, and any
+    process seeing a new generation drops its cached tokens.
+"""
+import time
+
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.timezone import now
+
+from .models import AuthToken
+
+
+# Key of the revocation generation in the shared cache
+REVOCATION_KEY = "token_auth:revocations"
+
+# The fields of a valid AuthToken needed to handle a request
+ValidToken = namedtuple("ValidToken", ["pk", "expires", "rate_limit", "record_limit"])
+
+
+class TokenCache:
+    """A bounded mapping of token strings to the ValidToken they match.
+    Entries are dropped after ``ttl`` seconds. ``last_used`` is written back
+    at most every ``write_interval`` seconds per token.
+    """
+
+    def __init__(self, ttl=60, max_size=1000, write_interval=60):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.write_interval = write_interval
+        self._entries = OrderedDict()
+        self._written = {}
+        # The shared revocation generation the entries were cached under
+        self.generation = None
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        valid, cached_until = entry
+        if cached_until < time.monotonic():
+            del self._entries[token]
+            return None
+        return valid
+
+    def set(self, token, valid):
+        self._entries.pop(token, None)
+        self._entries[token] = (valid, time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def evict(self, pk):
+        """Drop any entry for the token with primary key ``pk``"""
+        for token in [t for t, entry in self._entries.items() if entry[0].pk == pk]:
+            del self._entries[token]
+        self._written.pop(pk, None)
+
+    def should_write(self, pk):
+        """True if ``last_used`` of token ``pk`` is due to be written, in
+        which case the write is assumed to happen now.
+        """
+        current = time.monotonic()
+        written = self._written.get(pk)
+        if written is not None and current - written < self.write_interval:
+            return False
+        self._written[pk] = current
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self._written.clear()
+
+
+token_cache = TokenCache(
+    ttl=getattr(settings, "TOKEN_AUTH_CACHE_TTL", 60),
+    max_size=getattr(settings, "TOKEN_AUTH_CACHE_SIZE", 1000),
+    write_interval=getattr(settings, "TOKEN_AUTH_LAST_USED_INTERVAL", 60),
+)
+
+
+def get_revocations():
+    alias = getattr(settings, "TOKEN_AUTH_REVOCATION_CACHE", None)
+    return caches[alias] if alias else None
+
+
+def revoke_tokens():
+    """Drop every cached token from this process and, if a shared
+    revocation cache is configured, from every other process.
+    """
+    token_cache.clear()
+    store = get_revocations()
+    if store is not None and not store.add(REVOCATION_KEY, 1, timeout=None):
+        try:
+            store.incr(REVOCATION_KEY)
+        except ValueError:
+            # Evicted between the add and the incr
+            store.set(REVOCATION_KEY, 1, timeout=None)
+
+
+def check_token(token):
+    """Returns a ValidToken for the unexpired AuthToken matching ``token``,
+    or None if there isn't one, updating its ``last_used`` if it's due.
+    """
+    if not token:
+        return None
+    store = get_revocations()
+    if store is not None:
+        generation = store.get(REVOCATION_KEY, 0)
+        if generation != token_cache.generation:
+            token_cache.clear()
+            token_cache.generation = generation
+    nt = now()
+    valid = token_cache.get(token)
+    if valid is None:
+        row = (
+            AuthToken.objects.filter(token=token, expires__gt=nt)
+            .values_list(*ValidToken._fields)
+            .first()
+        )
+        if row is None:
+            return None
+        valid = ValidToken(*row)
+        token_cache.set(token, valid)
+
+    if valid.expires <= nt:
+        token_cache.evict(valid.pk)
+        return None
+    if token_cache.should_write(valid.pk):
+        AuthToken.objects.filter(pk=valid.pk).update(last_used=nt)
+    return valid
+
+
+def evict_token(sender, instance, **kwargs):
+    token_cache.evict(instance.pk)
+    transaction.on_commit(revoke_tokens)
+
+
+post_save.connect(evict_token, sender=AuthToken)
+post_delete.connect(evict_token, sender=AuthToken)
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("token_auth", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="authtoken",
+            name="rate_limit",
+            field=models.FloatField(
+                blank=True, help_text="Maximum requests per second", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="authtoken",
+            name="record_limit",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Maximum records submitted per minute", null=True
+            ),
+        ),
+    ]
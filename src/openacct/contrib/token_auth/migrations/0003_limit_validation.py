@@ -0,0 +1,31 @@
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("token_auth", "0002_rate_limits"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="authtoken",
+            name="rate_limit",
+            field=models.FloatField(
+                blank=True,
+                help_text="Maximum requests per second, 0 to refuse all requests",
+                null=True,
+                validators=[django.core.validators.MinValueValidator(0)],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="authtoken",
+            name="record_limit",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Maximum records submitted per minute, 0 to refuse all records",
+                null=True,
+            ),
+        ),
+    ]
@@ -1,12 +1,13 @@
+import math
 import re
 
 from django.contrib.auth.mixins import AccessMixin
-from django.db import models
+from django.http import HttpResponse
 from django.utils.decorators import method_decorator
-from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 
-from .models import AuthToken
+from .cache import check_token
+from .throttle import throttle_records, throttle_requests
 
 
 @method_decorator(csrf_exempt, name="dispatch")
@@ -17,6 +18,11 @@ class TokenAuthMixin(AccessMixin):
     failing that as a ``token`` key in either the GET or POST data of the
     request.
 
+    Requests beyond their token's ``rate_limit`` receive a ``429`` response
+    with a ``Retry-After`` header. Views which accept
+    records should call ``limit_records`` with the number submitted to
+    enforce the token's ``record_limit``.
+
     Make sure this mixin appears before any View classes in the subclass's
     inheritance list to ensure MRO chaining works appropriately for the
     ``dispatch`` method.
@@ -24,6 +30,7 @@ class TokenAuthMixin(AccessMixin):
 
     _TOKEN_KEY = "token"
     raise_exception = True
+    auth_token = None
 
     def extract_token(self, request):
         """Searches for and returns the token from a request. Returns None if
@@ -41,23 +48,38 @@ class TokenAuthMixin(AccessMixin):
 
     def validate_token(self, token):
         """Attempts to validate a token by searching for an instance matching
-        it which hasn't yet expired. If such a token is located, it will
-        automatically update the ``last_used`` field of the token. Returns True
-        if the token is found, and False otherwise.
+        it which hasn't yet expired. If such a token is located, the
+        ``last_used`` field of the token is updated, at most once per
+        ``TOKEN_AUTH_LAST_USED_INTERVAL`` seconds. Valid tokens are cached for
+        ``TOKEN_AUTH_CACHE_TTL`` seconds. Returns True if the token is found,
+        and False otherwise.
+        """
+        self.auth_token = check_token(token)
+        return self.auth_token is not None
+
+    def rate_limited(self, wait):
+        """Returns a ``429`` response asking the client to retry after
+        ``wait`` seconds.
+        """
+        response = HttpResponse("Rate limit exceeded", status=429)
+        response["Retry-After"] = str(math.ceil(wait))
+        return response
+
+    def limit_records(self, records):
+        """Charge ``records`` submitted records against the token's
+        ``record_limit``. Returns a ``429`` response if the limit is
+        exceeded, and None otherwise.
         """
-        try:
-            nt = now()
-            token = AuthToken.objects.get(token=token, expires__gt=nt)
-            token.last_used = nt
-            token.save()
-            return True
-        except models.ObjectDoesNotExist:
-            return False
+        wait = throttle_records(self.auth_token, records)
+        return self.rate_limited(wait) if wait else None
 
     def dispatch(self, request, *args, **kwargs):
         """Overloads the default ``dispatch`` method of a View to first
-        validate a token before continuing.
+        validate a token and enforce its request rate before continuing.
         """
         if not self.validate_token(self.extract_token(request)):
             return self.handle_no_permission()
+        wait = throttle_requests(self.auth_token)
+        if wait:
+            return self.rate_limited(wait)
         return super().dispatch(request, *args, **kwargs)
@@ -1,6 +1,7 @@
 import random
 
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
 
 
 def generate_token():
@@ -10,6 +11,20 @@ def generate_token():
     )
 
 
+class AuthTokenQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Queryset updates don't send the signals which evict saved tokens
+        from the cache, so they revoke every cached token instead. Updates
+        of ``last_used`` alone, which token checks make, don't.
+        """
+        rows = super().update(**kwargs)
+        if set(kwargs) != {"last_used"}:
+            from .cache import revoke_tokens
+
+            transaction.on_commit(revoke_tokens)
+        return rows
+
+
 class AuthToken(models.Model):
     """Database model for storing and representing generic authentication
     tokens. Used by the ``AuthTokenMixin`` to secure a view class.
@@ -20,6 +35,21 @@ class AuthToken(models.Model):
     expires = models.DateTimeField(null=True, blank=True)
     name = models.CharField(max_length=32)
     token = models.CharField(max_length=128, unique=True, default=generate_token)
+    # Optional limits enforced by TokenAuthMixin, unlimited when NULL. A
+    # limit of 0 refuses every request or record.
+    rate_limit = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0)],
+        help_text="Maximum requests per second, 0 to refuse all requests",
+    )
+    record_limit = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Maximum records submitted per minute, 0 to refuse all records",
+    )
+
+    objects = AuthTokenQuerySet.as_manager()
 
     def __str__(self):
         return "{} - {}".format(self.name, self.created)
@@ -1,3 +1,106 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .cache import REVOCATION_KEY, ValidToken, check_token, token_cache
+from .models import AuthToken
+from .throttle import (
+    BLOCKED_WAIT,
+    _local_store,
+    throttle_records,
+    throttle_requests,
+    token_stats,
+)
+
+
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "token_auth_tests",
+    },
+}
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        token_cache.generation = None
+        self.token = AuthToken.objects.create(
+            name="client", expires=timezone.now() + datetime.timedelta(days=1)
+        )
+
+    def expire(self):
+        AuthToken.objects.filter(pk=self.token.pk).update(
+            expires=timezone.now() - datetime.timedelta(days=1)
+        )
+
+    def test_cached(self):
+        self.assertEqual(check_token(self.token.token).pk, self.token.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(check_token(self.token.token).pk, self.token.pk)
+        self.assertIsNone(check_token("missing"))
+
+    def test_delete_evicts(self):
+        check_token(self.token.token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertIsNone(check_token(self.token.token))
+
+    def test_queryset_update_evicts(self):
+        check_token(self.token.token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.expire()
+        self.assertIsNone(check_token(self.token.token))
+
+    def test_last_used_update_keeps_cache(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            check_token(self.token.token)
+        self.assertEqual(callbacks, [])
+        self.assertIsNotNone(token_cache.get(self.token.token))
+
+    @override_settings(CACHES=SHARED_CACHES, TOKEN_AUTH_REVOCATION_CACHE="shared")
+    def test_revoked_by_other_process(self):
+        caches["shared"].clear()
+        check_token(self.token.token)
+        # Another process changes the token and bumps the shared generation,
+        # without this process's cache being told
+        with self.captureOnCommitCallbacks(execute=False):
+            self.expire()
+        self.assertIsNotNone(check_token(self.token.token))
+        caches["shared"].set(REVOCATION_KEY, 1, timeout=None)
+        self.assertIsNone(check_token(self.token.token))
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        _local_store.clear()
+
+    def valid(self, rate_limit=None, record_limit=None):
+        return ValidToken(1, None, rate_limit, record_limit)
+
+    def test_unlimited(self):
+        valid = self.valid()
+        for _ in range(100):
+            self.assertEqual(throttle_requests(valid), 0)
+        self.assertEqual(throttle_records(valid, 10 ** 6), 0)
+        self.assertEqual(token_stats([1])[1]["requests"], 100)
+
+    def test_rate_limit(self):
+        valid = self.valid(rate_limit=2)
+        self.assertEqual(throttle_requests(valid), 0)
+        self.assertEqual(throttle_requests(valid), 0)
+        self.assertGreater(throttle_requests(valid), 0)
+        self.assertEqual(token_stats([1])[1]["throttled_requests"], 1)
+
+    def test_record_limit(self):
+        valid = self.valid(record_limit=60)
+        self.assertEqual(throttle_records(valid, 100), 0)
+        self.assertGreater(throttle_records(valid, 1), 0)
+
+    def test_zero_refuses_everything(self):
+        valid = self.valid(rate_limit=0, record_limit=0)
+        self.assertEqual(throttle_requests(valid), BLOCKED_WAIT)
+        self.assertEqual(throttle_records(valid, 1), BLOCKED_WAIT)
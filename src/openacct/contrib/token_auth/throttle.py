@@ -0,0 +1,122 @@
+"""
+    openacct.contrib.token_auth.throttle
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Optional per-token rate limits, so that a misbehaving client can't
+    starve the database. An AuthToken with a ``rate_limit`` may make that
+    many requests per second, and one with a ``record_limit`` may submit
+    that many records per minute, each enforced with a token bucket which
+    holds at most one second's or one minute's allowance respectively. A
+    limit of 0 refuses everything, asking the client to retry after
+    ``BLOCKED_WAIT`` seconds; a NULL limit is unlimited.
+
+    Bucket state and the per-token counters reported by ``token_stats`` are
+    kept in a private in-process cache, so each worker process enforces the
+    limits separately. Set ``TOKEN_AUTH_RATE_LIMIT_CACHE`` to the alias of a
+    shared cache in ``CACHES``, such as memcached or redis, to enforce them
+    across processes. Updates to a bucket aren't atomic, so concurrent
+    requests with the same token may occasionally slip past a limit.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+KEY_PREFIX = "token_auth"
+
+# Counters kept per token by ``count``
+COUNTERS = ("requests", "records", "throttled_requests", "throttled_records")
+
+# Seconds a client is asked to wait when its token's limit is 0
+BLOCKED_WAIT = 60
+
+_local_store = LocMemCache("token_auth_throttle", {"OPTIONS": {"MAX_ENTRIES": 10000}})
+
+
+def get_store():
+    alias = getattr(settings, "TOKEN_AUTH_RATE_LIMIT_CACHE", None)
+    return caches[alias] if alias else _local_store
+
+
+def take(store, key, rate, capacity, amount=1):
+    """Take ``amount`` from the bucket ``key``, which refills at ``rate`` per
+    second up to ``capacity``. Returns 0 if it was taken, or the number of
+    seconds until it could be. An amount larger than the bucket's capacity
+    is allowed once the bucket is full, leaving it in debt. Nothing is ever
+    taken from a bucket with a ``rate`` of 0.
+    """
+    if rate <= 0:
+        return BLOCKED_WAIT
+    current = time.time()
+    tokens, stamp = store.get(key, (capacity, current))
+    tokens = min(capacity, tokens + (current - stamp) * rate)
+    needed = min(amount, capacity)
+    if tokens < needed:
+        return (needed - tokens) / rate
+    # Kept until the bucket would have refilled from empty
+    store.set(key, (tokens - amount, current), timeout=int(capacity / rate) + 1)
+    return 0
+
+
+def count(store, pk, counter, amount=1):
+    key = "{}:count:{}:{}".format(KEY_PREFIX, pk, counter)
+    if not store.add(key, amount, timeout=None):
+        try:
+            store.incr(key, amount)
+        except ValueError:
+            # Evicted between the add and the incr
+            store.set(key, amount, timeout=None)
+
+
+def throttle_requests(valid):
+    """Count a request made with the ValidToken ``valid``. Returns 0 if it
+    may proceed, or the seconds to wait if it exceeds the token's limit.
+    """
+    store = get_store()
+    wait = 0
+    if valid.rate_limit is not None:
+        wait = take(
+            store,
+            "{}:requests:{}".format(KEY_PREFIX, valid.pk),
+            valid.rate_limit,
+            max(valid.rate_limit, 1),
+        )
+    count(store, valid.pk, "throttled_requests" if wait else "requests")
+    return wait
+
+
+def throttle_records(valid, records):
+    """Count ``records`` submitted with the ValidToken ``valid``. Returns 0
+    if they may be stored, or the seconds to wait if they exceed the token's
+    limit.
+    """
+    store = get_store()
+    wait = 0
+    if valid.record_limit is not None:
+        wait = take(
+            store,
+            "{}:records:{}".format(KEY_PREFIX, valid.pk),
+            valid.record_limit / 60,
+            valid.record_limit,
+            records,
+        )
+    count(store, valid.pk, "throttled_records" if wait else "records", records)
+    return wait
+
+
+def token_stats(pks):
+    """Returns a dict mapping each token primary key in ``pks`` to a dict of
+    its counters, as seen by this process's store.
+    """
+    keys = {
+        "{}:count:{}:{}".format(KEY_PREFIX, pk, counter): (pk, counter)
+        for pk in pks
+        for counter in COUNTERS
+    }
+    stats = {pk: dict.fromkeys(COUNTERS, 0) for pk in pks}
+    for key, value in get_store().get_many(keys).items():
+        pk, counter = keys[key]
+        stats[pk][counter] = value
+    return stats
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .views import TokenStatsView
+
+urlpatterns = [
+    path("stats/", TokenStatsView.as_view(), name="token-stats"),
+]
@@ -0,0 +1,27 @@
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import JsonResponse
+from django.views import View
+
+from .models import AuthToken
+from .throttle import token_stats
+
+
+class TokenStatsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Returns the limits and request and record counters of every token.
+    Counters are those of the answering process unless
+    ``TOKEN_AUTH_RATE_LIMIT_CACHE`` names a shared cache.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        tokens = list(
+            AuthToken.objects.order_by("pk").values(
+                "pk", "name", "last_used", "expires", "rate_limit", "record_limit"
+            )
+        )
+        stats = token_stats([token["pk"] for token in tokens])
+        for token in tokens:
+            token.update(stats[token["pk"]])
+        return JsonResponse({"tokens": tokens})
@@ -1,12 +1,35 @@
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import EmailTemplate, Request
+from .models import EmailTemplate, OutboxMessage, Request, bulk_transition
 
 @admin.register(EmailTemplate)
 class EmailTemplateAdmin(admin.ModelAdmin):
     list_display = ("name", "subject", "default_from")
 
 
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("created", "recipients", "subject", "attempts", "sent")
+    list_filter = (
+        ("sent", admin.EmptyFieldListFilter),
+        "created",
+    )
+    search_fields = (
+        "recipients",
+        "subject",
+    )
+    actions = ("retry_messages",)
+
+    def retry_messages(self, request, queryset):
+        count = queryset.filter(sent__isnull=True).update(
+            attempts=0, next_attempt=timezone.now()
+        )
+        self.message_user(request, "{} messages queued for retry".format(count))
+
+    retry_messages.short_description = "Retry selected unsent messages"
+
+
 @admin.register(Request)
 class RequestAdmin(admin.ModelAdmin):
     list_display = (
@@ -24,3 +47,27 @@ class RequestAdmin(admin.ModelAdmin):
         "requester",
         "description",
     )
+    actions = (
+        "approve_requests",
+        "decline_requests",
+        "process_requests",
+    )
+
+    def _transition(self, request, queryset, transition):
+        count = bulk_transition(queryset, transition, request.user)
+        self.message_user(request, "{} requests {}".format(count, transition))
+
+    def approve_requests(self, request, queryset):
+        self._transition(request, queryset, "approved")
+
+    approve_requests.short_description = "Approve selected requests"
+
+    def decline_requests(self, request, queryset):
+        self._transition(request, queryset, "declined")
+
+    decline_requests.short_description = "Decline selected requests"
+
+    def process_requests(self, request, queryset):
+        self._transition(request, queryset, "processed")
+
+    process_requests.short_description = "Process selected requests"
@@ -5,3 +5,8 @@ class UrfConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'openacct.contrib.urf'
     verbose_name = 'User Request Framework'
+
+    def ready(self):
+        # Import the plugins once, so that misconfiguration fails at startup
+        from .models import get_plugins
+        get_plugins()
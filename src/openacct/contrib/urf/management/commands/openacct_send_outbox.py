@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import time
+
+from django.core.management.base import BaseCommand
+
+from openacct.contrib.urf.outbox import drain, purge
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver the notifications queued in the URF outbox, polling for new "
+        "ones unless --once is given"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Deliver the messages which are due and exit"
+        )
+        parser.add_argument(
+            "--poll-interval", required=False, default=10.0, type=float,
+            help="Seconds to wait between checks for new messages"
+        )
+        parser.add_argument(
+            "--batch-size", required=False, default=100, type=int,
+            help="Number of messages to send per connection"
+        )
+        parser.add_argument(
+            "--max-attempts", required=False, default=5, type=int,
+            help="Number of times to try sending a message before giving up"
+        )
+        parser.add_argument(
+            "--retry-delay", required=False, default=60, type=int,
+            help="Seconds to wait before the first retry, doubling each time"
+        )
+        parser.add_argument(
+            "--keep-days", required=False, default=30, type=int,
+            help="Delete sent messages after this many days"
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            sent, failed = drain(
+                kwargs["batch_size"], kwargs["max_attempts"], kwargs["retry_delay"]
+            )
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} messages, {failed} failed")
+            purge(kwargs["keep_days"])
+            if kwargs["once"]:
+                return
+            time.sleep(kwargs["poll_interval"])
@@ -1,11 +1,15 @@
+import contextlib
+import functools
 import importlib
 
 from django.conf                    import settings
 from django.contrib.auth.models     import User
-from django.core.mail               import send_mail
-from django.db                      import models
+from django.core.mail               import send_mass_mail
+from django.db                      import models, transaction
+from django.db.models               import IntegerField, Value
 from django.template                import Template, Context
 from django.urls                    import reverse
+from django.utils                   import timezone
 from django.utils.html              import mark_safe
 from django.utils.module_loading    import import_string
 
@@ -29,6 +33,10 @@ status_options = (
 )
 
 
+# Compiled templates keyed by their source, so edits take effect immediately
+compile_template = functools.lru_cache(maxsize=256)(Template)
+
+
 class EmailTemplate(models.Model):
     created         = models.DateTimeField(auto_now_add=True)
     name            = models.CharField(max_length=64)
@@ -36,14 +44,75 @@ class EmailTemplate(models.Model):
     subject         = models.CharField(max_length=64)
     body            = models.TextField()
 
-    def send(self, to, from_email=None, context={}):
-        send_mail(
-            Template(self.subject).render(Context(context)),
-            Template(self.body).render(Context(context)),
+    def message(self, to, from_email=None, context={}):
+        """Returns the rendered message as a ``send_mass_mail`` tuple"""
+        return (
+            compile_template(self.subject).render(Context(context)),
+            compile_template(self.body).render(Context(context)),
             from_email if from_email else self.default_from,
             to,
         )
 
+    def send(self, to, from_email=None, context={}):
+        """Send, or queue if ``USER_REQUESTS_OUTBOX`` is set, a message"""
+        send_messages([self.message(to, from_email, context)])
+
+
+class OutboxMessage(models.Model):
+    """A rendered email waiting to be delivered by the
+    ``openacct_send_outbox`` command.
+    """
+    created         = models.DateTimeField(auto_now_add=True)
+    subject         = models.CharField(max_length=255)
+    body            = models.TextField()
+    from_email      = models.CharField(max_length=254)
+    recipients      = models.TextField() # comma-separated
+    attempts        = models.PositiveIntegerField(default=0)
+    next_attempt    = models.DateTimeField(default=timezone.now)
+    sent            = models.DateTimeField(null=True, blank=True)
+    last_error      = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt'],
+                condition=models.Q(sent__isnull=True),
+                name='urf_outbox_pending',
+            ),
+        ]
+
+    @classmethod
+    def from_message(cls, message):
+        """Build an unsaved OutboxMessage from a ``send_mass_mail`` tuple"""
+        subject, body, from_email, to = message
+        return cls(
+            subject=subject, body=body, from_email=from_email,
+            recipients=','.join(to),
+        )
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.recipients, self.subject)
+
+
+def use_outbox():
+    """True if notifications are queued in the OutboxMessage table instead
+    of being sent, as set by ``USER_REQUESTS_OUTBOX``
+    """
+    return getattr(settings, 'USER_REQUESTS_OUTBOX', False)
+
+
+def send_messages(messages):
+    """Send a list of ``send_mass_mail`` tuples over a single connection, or
+    queue them in the outbox if ``USER_REQUESTS_OUTBOX`` is set, in which
+    case they're saved with any enclosing transaction.
+    """
+    if use_outbox():
+        OutboxMessage.objects.bulk_create(
+            [OutboxMessage.from_message(m) for m in messages]
+        )
+    else:
+        send_mass_mail(messages)
+
 
 class Request(models.Model):
     """Common information for all requests, facilitates ListView."""
@@ -78,54 +147,110 @@ class Request(models.Model):
     def get_absolute_url(self):
         return self.review_url()
     
+    # Set while a state transition is running, see ``transition``
+    _in_transition = False
+    _components = None
+
     def components(self):
-        """Returns the components attached to this request"""
-        plugin_loader = RequestPluginLoader()
-        rval = []
-        for rt in plugin_loader.request_types:
-            rval.extend(rt.objects.filter(request=self))
+        """Returns the components attached to this request, grouped by
+        request type and in each type's default ordering. Components are
+        found with a single UNION query over every request type, then
+        loaded with one query per type which has any, and are memoized on
+        this instance for the duration of a state transition.
+        """
+        if self._components is not None:
+            return self._components
+
+        request_types = get_plugins().request_types
+        if len(request_types) <= 1:
+            rval = [c for rt in request_types for c in rt.objects.filter(request=self)]
+        else:
+            # Compound statements can't have ordered subqueries
+            keys = [
+                rt.objects.filter(request=self)
+                .annotate(request_type=Value(i, output_field=IntegerField()))
+                .values_list('request_type', 'pk')
+                .order_by()
+                for i, rt in enumerate(request_types)
+            ]
+            found = {}
+            for i, pk in keys[0].union(*keys[1:], all=True):
+                found.setdefault(i, []).append(pk)
+            rval = []
+            for i in sorted(found):
+                rval.extend(request_types[i].objects.filter(pk__in=found[i]))
+
+        if self._in_transition:
+            self._components = rval
         return rval
 
+    @contextlib.contextmanager
+    def transition(self):
+        """Memoize ``components`` while a state transition, and any
+        transitions it triggers, is running.
+        """
+        if self._in_transition:
+            yield
+            return
+        self._in_transition, self._components = True, None
+        try:
+            yield
+        finally:
+            self._in_transition, self._components = False, None
+
     def on_confirmed(self):
-        for comp in self.components():
-            comp.on_confirmed()
-        self.confirmed = True
-        self.save()
+        with self.transition():
+            for comp in self.components():
+                comp.on_confirmed()
+            self.confirmed = True
+            self.save()
 
     def on_pending(self):
-        for comp in self.components():
-            comp.on_pending()
-        self.status = 'PENDING'
-        self.save()
-
-    def on_approved(self):
-        for comp in self.components():
-            comp.on_approved()
-
-        if self.autoprocess:
-            self.on_processed()
-        else:
-            self.status = 'APPROVED'
+        with self.transition():
+            for comp in self.components():
+                comp.on_pending()
+            self.status = 'PENDING'
             self.save()
 
-    def on_declined(self):
-        for comp in self.components():
-            comp.on_declined()
-        self.status = 'DECLINED'
-        self.save()
+    def on_approved(self, messages=None):
+        with self.transition():
+            for comp in self.components():
+                comp.on_approved()
 
-    def on_processed(self):
-        for comp in self.components():
-            comp.on_processed()
+            if self.autoprocess:
+                self.on_processed(messages)
+            else:
+                self.status = 'APPROVED'
+                self.save()
 
-        if self.autonotify:
-            self.notification.send(
-                [get_email(self.requester)], 
-                context={'request':self, 'components':self.components()}
-            )
+    def on_declined(self):
+        with self.transition():
+            for comp in self.components():
+                comp.on_declined()
+            self.status = 'DECLINED'
+            self.save()
 
-        self.status = 'PROCESSED'
-        self.save()
+    def on_processed(self, messages=None):
+        """Process the request, notifying the requester if ``autonotify`` is
+        set. If a ``messages`` list is given the notification is appended
+        to it for the caller to send, otherwise it's sent immediately.
+        """
+        with self.transition():
+            for comp in self.components():
+                comp.on_processed()
+
+            if self.autonotify:
+                message = self.notification.message(
+                    [get_email(self.requester)], 
+                    context={'request':self, 'components':self.components()}
+                )
+                if messages is None:
+                    send_messages([message])
+                else:
+                    messages.append(message)
+
+            self.status = 'PROCESSED'
+            self.save()
 
 
 class RequestType(models.Model):
@@ -198,13 +323,74 @@ def request_log(request, message):
     RequestLogEntry(request=request, text=message).save()
 
 
+# Transitions which can be applied in bulk, see ``bulk_transition``, and
+# the statuses each is valid from, as offered on the review page
+BULK_TRANSITIONS = {
+    'approved':  ('NEW', 'PENDING', 'FAILED'),
+    'declined':  ('NEW', 'PENDING'),
+    'processed': ('APPROVED',),
+}
+
+
+def bulk_transition(queryset, transition, user=None):
+    """Apply ``transition``, one of ``BULK_TRANSITIONS``, to the Requests in
+    ``queryset`` in a single transaction, skipping any in a status the
+    transition isn't valid from. Notifications are queued in the same
+    transaction if the outbox is enabled, otherwise they're sent over a
+    single mail connection once the outermost transaction has committed.
+    Returns the number of requests transitioned.
+    """
+    if transition not in BULK_TRANSITIONS:
+        raise ValueError('Unknown transition: {}'.format(transition))
+
+    messages = []
+    with transaction.atomic():
+        requests = list(
+            queryset.filter(status__in=BULK_TRANSITIONS[transition])
+            .select_for_update()
+            .prefetch_related('notification')
+            .order_by('pk')
+        )
+        for req in requests:
+            if transition == 'approved':
+                req.on_approved(messages)
+            elif transition == 'declined':
+                req.on_declined()
+            else:
+                req.on_processed(messages)
+        RequestLogEntry.objects.bulk_create([
+            RequestLogEntry(
+                request=req, text='{0} - {1}'.format(transition.upper(), user)
+            )
+            for req in requests
+        ])
+        if messages and use_outbox():
+            send_messages(messages)
+        elif messages:
+            transaction.on_commit(lambda: send_messages(messages))
+    return len(requests)
+
+
 class RequestPluginLoader():
+    """Imports the plugin modules named in ``USER_REQUESTS_PLUGINS`` and
+    collects their ``urlpatterns`` and ``request_types``. Use
+    ``get_plugins`` rather than building a new loader.
+    """
     def __init__(self):
         self.plugins = list([ 
-            importlib.import_module(n) for n in settings.USER_REQUESTS_PLUGINS 
+            importlib.import_module(n)
+            for n in getattr(settings, 'USER_REQUESTS_PLUGINS', [])
         ])
         self.request_types, self.urls = [], []
 
         for p in self.plugins:
             self.urls.extend(getattr(p, 'urlpatterns', []))
             self.request_types.extend(getattr(p, 'request_types', []))
+
+
+@functools.lru_cache(maxsize=None)
+def get_plugins():
+    """Returns the process-wide RequestPluginLoader, built when the app is
+    ready.
+    """
+    return RequestPluginLoader()
@@ -0,0 +1,101 @@
+"""
+    openacct.contrib.urf.outbox
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Delivery of the notifications queued in ``OutboxMessage`` when
+    ``USER_REQUESTS_OUTBOX`` is set, so that a slow mail relay never holds up
+    the request which processed a Request. Messages are leased in batches,
+    so several workers can run at once, and each batch is delivered over a
+    single connection. Failed messages are retried with exponential backoff
+    until they run out of attempts.
+"""
+import datetime
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+
+def claim_batch(batch_size, max_attempts, lease):
+    """Lease up to ``batch_size`` due messages for ``lease`` seconds, so that
+    no other worker picks them up meanwhile.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxMessage.objects.filter(
+                sent__isnull=True, attempts__lt=max_attempts, next_attempt__lte=now
+            )
+            .select_for_update(skip_locked=True)
+            .order_by("next_attempt")[:batch_size]
+        )
+        OutboxMessage.objects.filter(pk__in=[m.pk for m in batch]).update(
+            next_attempt=now + datetime.timedelta(seconds=lease)
+        )
+    return batch
+
+
+def _failed(message, error, retry_delay):
+    message.last_error = str(error)
+    message.next_attempt = timezone.now() + datetime.timedelta(
+        seconds=retry_delay * 2 ** (message.attempts - 1)
+    )
+
+
+def deliver(batch, retry_delay):
+    """Send a batch of messages over one connection. Returns a tuple of the
+    number sent and failed.
+    """
+    for message in batch:
+        message.attempts += 1
+    sent, failed = [], []
+    try:
+        with get_connection() as connection:
+            for message in batch:
+                email = EmailMessage(
+                    message.subject,
+                    message.body,
+                    message.from_email,
+                    message.recipients.split(","),
+                    connection=connection,
+                )
+                try:
+                    email.send()
+                except Exception as e:
+                    _failed(message, e, retry_delay)
+                    failed.append(message)
+                else:
+                    message.sent = timezone.now()
+                    sent.append(message)
+    except Exception as e:
+        # The connection couldn't be opened or closed
+        for message in batch:
+            if message.sent is None and message not in failed:
+                _failed(message, e, retry_delay)
+                failed.append(message)
+    OutboxMessage.objects.bulk_update(sent, ["attempts", "sent"])
+    OutboxMessage.objects.bulk_update(
+        failed, ["attempts", "last_error", "next_attempt"]
+    )
+    return len(sent), len(failed)
+
+
+def drain(batch_size=100, max_attempts=5, retry_delay=60, lease=300):
+    """Deliver every due message. Returns a tuple of the number sent and
+    failed.
+    """
+    sent = failed = 0
+    while True:
+        batch = claim_batch(batch_size, max_attempts, lease)
+        if not batch:
+            return sent, failed
+        s, f = deliver(batch, retry_delay)
+        sent, failed = sent + s, failed + f
+
+
+def purge(days):
+    """Delete messages sent more than ``days`` days ago"""
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    return OutboxMessage.objects.filter(sent__lt=cutoff).delete()[0]
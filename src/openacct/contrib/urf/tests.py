@@ -1,3 +1,249 @@
-from django.test import TestCase
+import datetime
+import io
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import (
+    EmailTemplate, OutboxMessage, Request, RequestLogEntry, RequestType,
+    bulk_transition, get_plugins,
+)
+
+
+class FirstComponent(RequestType):
+    size = models.IntegerField(default=0)
+
+    def on_approved(self):
+        pass
+
+    class Meta:
+        app_label = 'urf'
+        ordering = ['-size']
+
+
+class SecondComponent(RequestType):
+    def on_approved(self):
+        pass
+
+    class Meta:
+        app_label = 'urf'
+
+
+class FlakyBackend(EmailBackend):
+    """A test mail backend which refuses messages to fail@example.com"""
+    def send_messages(self, messages):
+        for message in messages:
+            if 'fail@example.com' in message.to:
+                raise OSError('Relay refused {}'.format(message.to))
+        return super().send_messages(messages)
+
+
+# These tests are the URF plugin providing the request types above
+request_types = [FirstComponent, SecondComponent]
+
+
+@override_settings(USER_REQUESTS_PLUGINS=[__name__])
+class URFTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Before the class-wide transaction, which SQLite's schema editor
+        # can't run inside
+        with connection.schema_editor() as editor:
+            for model in request_types:
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            for model in request_types:
+                editor.delete_model(model)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.template, _ = EmailTemplate.objects.update_or_create(pk=1, defaults={
+            'name': 'processed', 'default_from': 'root@localhost',
+            'subject': 'Request {{ request.pk }} processed',
+            'body': '{% for c in components %}{{ c.pk }} {% endfor %}',
+        })
+        User.objects.create(username='bob', email='bob@example.com')
+
+    def setUp(self):
+        get_plugins.cache_clear()
+        self.addCleanup(get_plugins.cache_clear)
+
+    def make_request(self, sizes=(), seconds=0, **kwargs):
+        req = Request.objects.create(requester='bob', **kwargs)
+        for size in sizes:
+            FirstComponent.objects.create(request=req, size=size)
+        for _ in range(seconds):
+            SecondComponent.objects.create(request=req)
+        return req
+
+
+class ComponentTests(URFTestCase):
+    def test_components_in_type_order(self):
+        req = self.make_request(sizes=[1, 3, 2], seconds=2)
+        components = req.components()
+        self.assertEqual(
+            [(type(c), getattr(c, 'size', None)) for c in components],
+            [
+                (FirstComponent, 3), (FirstComponent, 2), (FirstComponent, 1),
+                (SecondComponent, None), (SecondComponent, None),
+            ],
+        )
+
+    def test_memoized_during_transition(self):
+        req = self.make_request(sizes=[1], seconds=1)
+        with req.transition():
+            components = req.components()
+            with self.assertNumQueries(0):
+                self.assertIs(req.components(), components)
+        self.assertIsNot(req.components(), components)
+
+
+class BulkTransitionTests(URFTestCase):
+    STATUSES = (
+        'NEW', 'PENDING', 'APPROVED', 'DECLINED', 'PROCESSED', 'FAILED',
+        'CANCELLED',
+    )
+
+    def transition(self, transition):
+        """Apply ``transition`` to a request in each status, returning the
+        statuses it changed
+        """
+        reqs = {
+            status: self.make_request(sizes=[1], status=status, autonotify=False)
+            for status in self.STATUSES
+        }
+        bulk_transition(Request.objects.all(), transition, 'admin')
+        return {
+            status for status, req in reqs.items()
+            if Request.objects.get(pk=req.pk).status != status
+        }
+
+    def test_approve_valid_statuses(self):
+        self.assertEqual(
+            self.transition('approved'), {'NEW', 'PENDING', 'FAILED'}
+        )
+
+    def test_decline_valid_statuses(self):
+        self.assertEqual(self.transition('declined'), {'NEW', 'PENDING'})
+
+    def test_process_valid_statuses(self):
+        self.assertEqual(self.transition('processed'), {'APPROVED'})
+
+    def test_unknown_transition(self):
+        with self.assertRaises(ValueError):
+            bulk_transition(Request.objects.all(), 'cancelled')
+
+    def test_logged(self):
+        req = self.make_request(sizes=[1], autonotify=False)
+        bulk_transition(Request.objects.all(), 'declined', 'admin')
+        self.assertEqual(
+            list(RequestLogEntry.objects.filter(request=req).values_list(
+                'text', flat=True
+            )),
+            ['DECLINED - admin'],
+        )
+
+    def test_mail_sent_on_commit(self):
+        reqs = [self.make_request(sizes=[1]) for _ in range(3)]
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(bulk_transition(Request.objects.all(), 'approved'), 3)
+        self.assertEqual(mail.outbox, [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            sorted(m.subject for m in mail.outbox),
+            sorted('Request {} processed'.format(r.pk) for r in reqs),
+        )
+        self.assertEqual(mail.outbox[0].to, ['bob@example.com'])
+
+    def test_no_mail_on_rollback(self):
+        self.make_request(sizes=[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    bulk_transition(Request.objects.all(), 'approved')
+                    raise RuntimeError
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Request.objects.get().status, 'NEW')
+
+
+@override_settings(
+    USER_REQUESTS_OUTBOX=True,
+    EMAIL_BACKEND='openacct.contrib.urf.tests.FlakyBackend',
+)
+class OutboxTests(URFTestCase):
+    def drain(self):
+        call_command('openacct_send_outbox', '--once', '--retry-delay', '60',
+                     '--max-attempts', '2', stdout=io.StringIO())
+
+    def test_queued(self):
+        reqs = [self.make_request(sizes=[1]) for _ in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_transition(Request.objects.all(), 'approved')
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(
+            sorted(OutboxMessage.objects.values_list('subject', flat=True)),
+            sorted('Request {} processed'.format(r.pk) for r in reqs),
+        )
+        self.assertTrue(
+            OutboxMessage.objects.filter(recipients='bob@example.com').exists()
+        )
+
+    def test_nothing_queued_on_rollback(self):
+        self.make_request(sizes=[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    bulk_transition(Request.objects.all(), 'approved')
+                    raise RuntimeError
+        self.drain()
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(mail.outbox, [])
+
+    def test_drain(self):
+        self.template.send(['bob@example.com'])
+        self.template.send(['fail@example.com'])
+        self.assertEqual(mail.outbox, [])
+
+        before = timezone.now()
+        self.drain()
+        self.assertEqual([m.to for m in mail.outbox], [['bob@example.com']])
+        sent = OutboxMessage.objects.get(recipients='bob@example.com')
+        self.assertIsNotNone(sent.sent)
+        failed = OutboxMessage.objects.get(recipients='fail@example.com')
+        self.assertIsNone(failed.sent)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('Relay refused', failed.last_error)
+        self.assertGreaterEqual(
+            failed.next_attempt, before + datetime.timedelta(seconds=60)
+        )
+
+        # Not due yet
+        self.drain()
+        self.assertEqual(OutboxMessage.objects.get(pk=failed.pk).attempts, 1)
+
+        # The second attempt backs off twice as long
+        OutboxMessage.objects.filter(pk=failed.pk).update(next_attempt=before)
+        before = timezone.now()
+        self.drain()
+        failed.refresh_from_db()
+        self.assertEqual(failed.attempts, 2)
+        self.assertGreaterEqual(
+            failed.next_attempt, before + datetime.timedelta(seconds=120)
+        )
+
+        # Out of attempts
+        OutboxMessage.objects.filter(pk=failed.pk).update(next_attempt=before)
+        self.drain()
+        self.assertEqual(OutboxMessage.objects.get(pk=failed.pk).attempts, 2)
+        self.assertEqual(len(mail.outbox), 1)
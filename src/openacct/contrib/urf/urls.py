@@ -1,10 +1,10 @@
 from django.urls    import path
 
-from .models import RequestPluginLoader
+from .models import get_plugins
 from .views import RequestDetailView
 
 app_name = "urf"
 
 urlpatterns = [
     path('view/<int:pk>/', RequestDetailView.as_view(), name='review'),
-] + RequestPluginLoader().urls # Add the URLs for the plugins
+] + get_plugins().urls # Add the URLs for the plugins
@@ -13,7 +13,6 @@ from .models import (
     Request, 
     RequestLogEntry, 
     RequestType, 
-    RequestPluginLoader,
     request_log,
 )
 
@@ -34,7 +33,6 @@ class RequestDetailView(LoginRequiredMixin, View):
     after it is confirmed will be recorded and reported.
     """
     def get(self, request, pk):
-        plugin_loader = RequestPluginLoader()
         req = get_object_or_404(Request, pk=pk)
         is_admin = check_admin(request.user)
 
@@ -45,9 +43,7 @@ class RequestDetailView(LoginRequiredMixin, View):
         if is_admin:
             request_log(req, 'VIEW - {0}'.format(request.user))
 
-        widgets = []
-        for model in plugin_loader.request_types:
-            widgets.extend(model.objects.filter(request=req))
+        widgets = req.components()
         
         request.current_app = 'urf'
         return render(request, 'request_detail.html', {
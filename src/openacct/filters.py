@@ -0,0 +1,19 @@
+"""
+    openacct.filters
+    ~~~~~~~~~~~~~~~~
+
+    Helpers for selecting objects by the names given on the command line or
+    in a request, shared by the charging commands and exports.
+"""
+from django.db.models import Q
+
+
+def translate_names_to_filters(names, prefix, scheme):
+    """Given a list of names, translate them into a Q representing that set"""
+    key = prefix + {
+        "exact": "", "startswith": "__startswith", "contains": "__icontains"
+    }[scheme]
+    q = Q()
+    for name in names:
+        q |= Q(**{key: name})
+    return q
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.retention import archive, get_policies
+
+
+class Command(BaseCommand):
+    help = (
+        "Export rows older than each retention policy's cutoff to compressed, "
+        "date-partitioned archives, then delete them. Policies are configured "
+        "with the OPENACCT_RETENTION setting"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dest", required=True,
+            help="(Required) Directory under which archives are written"
+        )
+        parser.add_argument(
+            "--policy", required=False, default=None,
+            help="Only apply the policy with this name. Defaults to all policies"
+        )
+        parser.add_argument(
+            "--before", required=False, default=None,
+            type=datetime.date.fromisoformat,
+            help="ISO-formatted date overriding the policy's cutoff. Rows dated "
+            "before it are archived"
+        )
+        parser.add_argument(
+            "--no-delete", action="store_true",
+            help="If set, rows are exported but not deleted"
+        )
+
+    def handle(self, *args, **kwargs):
+        policies = get_policies()
+        if kwargs["policy"] is not None:
+            policies = [p for p in policies if p.name == kwargs["policy"]]
+            if not policies:
+                raise CommandError(f"No retention policy named {kwargs['policy']}")
+
+        for policy in policies:
+            archived, deleted = archive(
+                policy,
+                kwargs["dest"],
+                cutoff=kwargs["before"],
+                delete=not kwargs["no_delete"],
+                log=self.stdout.write,
+            )
+            self.stdout.write(
+                f"{policy.name}: archived {archived} rows, deleted {deleted}"
+            )
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from openacct.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the numeric TRES columns of Jobs, such as alloc_cpus and "
+        "req_gpus, from their tres_requested and tres_allocated strings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", required=False, default=5000, type=int,
+            help="Range of job primary keys to update per statement"
+        )
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Reparse every job, not only those whose columns are empty"
+        )
+
+    def handle(self, *args, **kwargs):
+        jobs = Job.objects.exclude(tres_requested="", tres_allocated="")
+        if not kwargs["all"]:
+            jobs = jobs.filter(req_cpus__isnull=True, alloc_cpus__isnull=True)
+        bounds = jobs.aggregate(lo=Min("pk"), hi=Max("pk"))
+        if bounds["lo"] is None:
+            self.stdout.write("Updated 0 jobs")
+            return
+
+        updated = 0
+        chunk_size = kwargs["chunk_size"]
+        for lo in range(bounds["lo"], bounds["hi"] + 1, chunk_size):
+            chunk = list(
+                jobs.filter(pk__gte=lo, pk__lt=lo + chunk_size).only(
+                    "pk", "tres_requested", "tres_allocated"
+                )
+            )
+            for job in chunk:
+                job.parse_tres_fields()
+            Job.objects.bulk_update(chunk, Job.TRES_FIELDS, batch_size=1000)
+            updated += len(chunk)
+        self.stdout.write(f"Updated {updated} jobs")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.filters import translate_names_to_filters
+from openacct.models import Service, StorageCommitment, User
+from openacct.storage import charge_commitments
+
+
+class Command(BaseCommand):
+    help = (
+        "Record DEBIT transactions for the time-weighted storage held by each "
+        "StorageCommitment during a billing window. Storage is charged once, up "
+        "to the end of the latest window, so charge windows in order"
+    )
+
+    def add_arguments(self, parser):
+        fmt = "(Required) ISO-formatted timestamp, {} of the billing window"
+        parser.add_argument(
+            "--start", required=True, type=datetime.datetime.fromisoformat,
+            help=fmt.format("start")
+        )
+        parser.add_argument(
+            "--end", required=True, type=datetime.datetime.fromisoformat,
+            help=fmt.format("end")
+        )
+        parser.add_argument(
+            "--service", required=True,
+            help="(Required) Name of the storage service to charge"
+        )
+        parser.add_argument(
+            "--user", required=True,
+            help="(Required) Name of the user recorded as creating the transactions"
+        )
+
+        fmt = "Comma separated list of {} names for selecting commitments."
+        parser.add_argument(
+            "--projects", required=False, default=None,
+            help=fmt.format("project")
+        )
+        parser.add_argument(
+            "--filesystems", required=False, default=None,
+            help=fmt.format("filesystem")
+        )
+        parser.add_argument(
+            "--match-scheme", required=False, default="exact",
+            choices=["exact", "startswith", "contains"],
+            help="Use the selected criteria when matching name filters"
+        )
+        parser.add_argument(
+            "--bytes-per-unit", required=False, default=10 ** 12, type=int,
+            help="Bytes in one unit of usage, 10^12 (TB) by default"
+        )
+        parser.add_argument(
+            "--days-per-unit", required=False, default=30.0, type=float,
+            help="Days in one unit of usage, 30 (a month) by default"
+        )
+        parser.add_argument(
+            "--auto-confirm", action="store_true",
+            help="If set, disable pauses for confirmation"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["start"] >= kwargs["end"]:
+            raise CommandError("Start must be before End")
+        if kwargs["bytes_per_unit"] <= 0 or kwargs["days_per_unit"] <= 0:
+            raise CommandError("Units must be positive")
+        try:
+            service = Service.objects.get(name=kwargs["service"])
+            user = User.objects.get(name=kwargs["user"])
+        except (Service.DoesNotExist, User.DoesNotExist) as e:
+            raise CommandError(e)
+
+        commitments = StorageCommitment.objects.all()
+        scheme = kwargs["match_scheme"]
+        if kwargs["projects"] is not None:
+            commitments = commitments.filter(translate_names_to_filters(
+                kwargs["projects"].split(","), "project__name", scheme
+            ))
+        if kwargs["filesystems"] is not None:
+            commitments = commitments.filter(translate_names_to_filters(
+                kwargs["filesystems"].split(","), "filesystem", scheme
+            ))
+
+        if not kwargs["auto_confirm"]:
+            start_fmt = kwargs["start"].isoformat()
+            end_fmt = kwargs["end"].isoformat()
+            print("Charging storage commitments with the following:\n")
+            print(f"\tBilling Window: {start_fmt} - {end_fmt}")
+            print(f"\tService: {service}")
+            print(f"\tProjects: {kwargs['projects'] or 'ANY'}")
+            print(f"\tFilesystems: {kwargs['filesystems'] or 'ANY'}")
+            print(f"\tUnit: {kwargs['bytes_per_unit']} bytes for "
+                  f"{kwargs['days_per_unit']} days")
+            input("\nHit Enter to continue...")
+
+        transactions, skipped = charge_commitments(
+            kwargs["start"],
+            kwargs["end"],
+            service,
+            user,
+            queryset=commitments,
+            bytes_per_unit=kwargs["bytes_per_unit"],
+            days_per_unit=kwargs["days_per_unit"],
+        )
+        used = sum(tx.amt_used for tx in transactions)
+        charged = sum(tx.amt_charged for tx in transactions)
+        self.stdout.write(
+            f"Recorded {len(transactions)} transactions totalling {used:g} units, "
+            f"charged {charged:g}"
+        )
+        if skipped:
+            self.stderr.write(
+                f"Skipped commitments without an active project account: "
+                f"{', '.join(map(str, skipped))}"
+            )
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import datetime
+import gzip
+import sys
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.export import FORMATS, lines, select
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the rows of an exportable model, such as openacct.Transaction, "
+        "openacct.Job, openacct.BalanceSheet or login_records.LoginRecord, to a "
+        "CSV or NDJSON file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--model", required=True,
+            help="(Required) Label of the model to export, e.g. openacct.Transaction"
+        )
+        parser.add_argument(
+            "--format", required=False, default="csv", choices=list(FORMATS),
+            help="Output format"
+        )
+        parser.add_argument(
+            "--output", required=False, default="-",
+            help="File to write, compressed if it ends in .gz. Defaults to stdout"
+        )
+        fmt = "ISO-formatted timestamp, {} of the selection window"
+        parser.add_argument(
+            "--start", required=False, default=None,
+            type=datetime.datetime.fromisoformat, help=fmt.format("start")
+        )
+        parser.add_argument(
+            "--end", required=False, default=None,
+            type=datetime.datetime.fromisoformat, help=fmt.format("end")
+        )
+
+        fmt = "Comma separated list of {} names for selecting rows."
+        for name in ("system", "service", "project", "account"):
+            parser.add_argument(
+                f"--{name}s", required=False, default=None,
+                help=fmt.format(name)
+            )
+        parser.add_argument(
+            "--match-scheme", required=False, default="exact",
+            choices=["exact", "startswith", "contains"],
+            help="Use the selected criteria when matching name filters"
+        )
+        parser.add_argument(
+            "--chunk-size", required=False, default=2000, type=int,
+            help="Number of rows fetched from the database at a time"
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            model = apps.get_model(kwargs["model"])
+        except (LookupError, ValueError):
+            raise CommandError(f"Unknown model {kwargs['model']}")
+        if not hasattr(model, "export_fields"):
+            raise CommandError(f"{model._meta.label} can't be exported")
+
+        try:
+            queryset = select(
+                model.objects.all(),
+                kwargs["start"],
+                kwargs["end"],
+                kwargs["match_scheme"],
+                systems=kwargs["systems"],
+                services=kwargs["services"],
+                projects=kwargs["projects"],
+                accounts=kwargs["accounts"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = kwargs["output"]
+        if output == "-":
+            f = sys.stdout
+        elif output.endswith(".gz"):
+            f = gzip.open(output, "wt", newline="")
+        else:
+            f = open(output, "w", newline="")
+        try:
+            for line in lines(queryset, kwargs["format"], kwargs["chunk_size"]):
+                f.write(line)
+        finally:
+            if f is not sys.stdout:
+                f.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import gzip
+import sys
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.sacct import SACCT_FORMAT, parse, upsert
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update Jobs from the output of sacct --parsable2, e.g. "
+        "sacct --allusers --parsable2 --format=" + SACCT_FORMAT
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--input", required=False, default="-",
+            help="File to read, decompressed if it ends in .gz. Defaults to stdin"
+        )
+        parser.add_argument(
+            "--fields", required=False, default=None,
+            help="Comma separated sacct fields of output without a header, "
+            "e.g. " + SACCT_FORMAT
+        )
+        parser.add_argument(
+            "--batch-size", required=False, default=5000, type=int,
+            help="Number of jobs written per transaction"
+        )
+        parser.add_argument(
+            "--no-link", action="store_true",
+            help="Don't link envmodules commands to the imported jobs afterwards"
+        )
+
+    def handle(self, *args, **kwargs):
+        path = kwargs["input"]
+        if path == "-":
+            f = sys.stdin
+        elif path.endswith(".gz"):
+            f = gzip.open(path, "rt")
+        else:
+            f = open(path)
+        fields = kwargs["fields"].split(",") if kwargs["fields"] else None
+        skipped = 0
+
+        def invalid(number, line, reason):
+            nonlocal skipped
+            skipped += 1
+            if kwargs["verbosity"] > 0:
+                self.stderr.write(f"Skipped line {number} ({reason}): {line}")
+
+        try:
+            created, updated = upsert(
+                parse(f, fields, invalid=invalid), kwargs["batch_size"]
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        self.stdout.write(f"Created {created} jobs, updated {updated} jobs")
+        if skipped:
+            self.stderr.write(f"Skipped {skipped} invalid lines")
+
+        # Bulk writes skip the post_save handler which links commands to jobs
+        if (
+            not kwargs["no_link"]
+            and apps.is_installed("openacct.contrib.envmodules_records")
+        ):
+            call_command("openacct_link_envmodules_jobs", stdout=self.stdout)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.models import Service, User
+from openacct.quota import (
+    PARSERS, MalformedLine, MissingFilesystem, get_parser, ingest, parse_report,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Record AUDIT transactions for storage commitments from a filesystem "
+        "quota report, matching its rows to commitments by filesystem and path"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--input", required=False, default="-",
+            help="Report to read, decompressed if it ends in .gz. Defaults to stdin"
+        )
+        parser.add_argument(
+            "--parser", required=False, default="csv",
+            help="Report format, one of {} or the dotted path of a parser "
+            "function".format(", ".join(sorted(PARSERS)))
+        )
+        parser.add_argument(
+            "--service", required=True,
+            help="(Required) Name of the storage service to record usage of"
+        )
+        parser.add_argument(
+            "--user", required=True,
+            help="(Required) Name of the user recorded as creating the transactions"
+        )
+        parser.add_argument(
+            "--filesystem", required=False, default=None,
+            help="Filesystem of rows for which the report doesn't name one. "
+            "Required for the lfs and csv formats"
+        )
+        parser.add_argument(
+            "--path-prefix", required=False, default="",
+            help="Prefix joined to each reported path, e.g. the mount point of "
+            "GPFS filesets"
+        )
+        parser.add_argument(
+            "--bytes-per-unit", required=False, default=10 ** 12, type=int,
+            help="Bytes in one unit of usage, 10^12 (TB) by default"
+        )
+        parser.add_argument(
+            "--batch-size", required=False, default=1000, type=int,
+            help="Number of transactions inserted at a time"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["bytes_per_unit"] <= 0:
+            raise CommandError("Units must be positive")
+        try:
+            service = Service.objects.get(name=kwargs["service"])
+            user = User.objects.get(name=kwargs["user"])
+        except (Service.DoesNotExist, User.DoesNotExist) as e:
+            raise CommandError(e)
+        if kwargs["parser"] in ("lfs", "csv") and not kwargs["filesystem"]:
+            raise CommandError(
+                "--filesystem is required for the lfs and csv formats, whose "
+                "reports don't name one"
+            )
+        try:
+            parse = get_parser(kwargs["parser"])
+        except ImportError:
+            raise CommandError("Unknown parser: {}".format(kwargs["parser"]))
+
+        def report(row):
+            if kwargs["verbosity"] > 0:
+                self.stderr.write(f"Unmatched: {row.filesystem or ''} {row.path}")
+
+        path = kwargs["input"]
+        if path == "-":
+            f = sys.stdin
+        elif path.endswith(".gz"):
+            f = gzip.open(path, "rt", newline="")
+        else:
+            f = open(path, newline="")
+        try:
+            recorded, unmatched = ingest(
+                parse_report(parse, f),
+                service,
+                user,
+                filesystem=kwargs["filesystem"],
+                path_prefix=kwargs["path_prefix"],
+                bytes_per_unit=kwargs["bytes_per_unit"],
+                batch_size=kwargs["batch_size"],
+                unmatched=report,
+            )
+        except MissingFilesystem as e:
+            raise CommandError(f"{e}; give one with --filesystem")
+        except MalformedLine as e:
+            raise CommandError(f"Malformed report, nothing recorded. {e}")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        self.stdout.write(f"Recorded {recorded} transactions")
+        if unmatched:
+            self.stderr.write(f"{unmatched} rows matched no commitment")
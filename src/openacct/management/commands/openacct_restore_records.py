@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openacct.retention import find_archives, get_policies, restore
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-import rows from archives written by openacct_archive_records. "
+        "Rows which are still stored are skipped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*",
+            help="Archive files to restore. Defaults to those under --source"
+        )
+        parser.add_argument(
+            "--policy", required=True,
+            help="(Required) Name of the retention policy which wrote the archives"
+        )
+        parser.add_argument(
+            "--source", required=False, default=None,
+            help="Directory under which archives were written"
+        )
+        fmt = "ISO-formatted date, {} of the window of days to restore from --source"
+        parser.add_argument(
+            "--start", required=False, default=None,
+            type=datetime.date.fromisoformat, help=fmt.format("start")
+        )
+        parser.add_argument(
+            "--end", required=False, default=None,
+            type=datetime.date.fromisoformat, help=fmt.format("end")
+        )
+
+    def handle(self, *args, **kwargs):
+        policies = [p for p in get_policies() if p.name == kwargs["policy"]]
+        if not policies:
+            raise CommandError(f"No retention policy named {kwargs['policy']}")
+        policy = policies[0]
+
+        paths = kwargs["paths"]
+        if not paths:
+            if kwargs["source"] is None:
+                raise CommandError("Either archive paths or --source is required")
+            paths = find_archives(
+                kwargs["source"], policy, kwargs["start"], kwargs["end"]
+            )
+        restored, skipped = restore(policy, paths, log=self.stdout.write)
+        for path, row, error in skipped:
+            messages = "; ".join(getattr(error, "messages", [repr(error)]))
+            self.stderr.write(f"{path}: skipped {json.dumps(row)}: {messages}")
+        self.stdout.write(
+            f"{policy.name}: restored {restored} rows, skipped {len(skipped)}"
+        )
@@ -3,24 +3,14 @@ import datetime
 import logging
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import F, Q
+from django.db.models import F
 
+from openacct.filters import translate_names_to_filters
 from openacct.models import Account, Service, Transaction
 
 logger = logging.getLogger(__name__)
 
 
-def translate_names_to_filters(names, prefix, scheme):
-    """Given a list of names, translate them into a Q representing that set"""
-    key = prefix + {
-        "exact": "", "startswith": "__startswith", "contains": "__icontains"
-    }[scheme]
-    q = Q()
-    for name in names:
-        q |= Q(**{key: name})
-    return q
-
-
 class Command(BaseCommand):
     help = "Calculate charge amounts for a selection of transactions"
 
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import time
+
+from django.core.management.base import BaseCommand
+
+from openacct.tasks import claim_task, requeue_stale, run_task
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background tasks, such as invoice generation, polling for "
+        "new ones unless --once is given"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Run the tasks which are pending and exit"
+        )
+        parser.add_argument(
+            "--poll-interval", required=False, default=5.0, type=float,
+            help="Seconds to wait between checks for new tasks"
+        )
+        parser.add_argument(
+            "--stale-after", required=False, default=3600, type=int,
+            help="Requeue running tasks which haven't made progress for this "
+            "many seconds, assuming their worker died"
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            requeue_stale(kwargs["stale_after"])
+            task = claim_task()
+            if task is not None:
+                run_task(task)
+                self.stdout.write(f"{task.function} {task.kwargs}: {task.status}")
+                continue
+            if kwargs["once"]:
+                return
+            time.sleep(kwargs["poll_interval"])
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openacct', '0008_balancesheet_invoice'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['queued'], name='openacct_job_queued'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['completed'], name='openacct_job_completed'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['account', 'completed'], name='openacct_job_account_completed'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['created'], name='openacct_tx_created'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'created'], name='openacct_tx_account_created'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['service', 'created'], name='openacct_tx_service_created'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('active', True)), fields=['created'], name='openacct_tx_active_created'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openacct', '0010_invoice_tasks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='storagecommitment',
+            index=models.Index(fields=['filesystem', 'path'], name='openacct_storage_path'),
+        ),
+    ]
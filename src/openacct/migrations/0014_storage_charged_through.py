@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openacct', '0013_task_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagecommitment',
+            name='charged_through',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def normalize_paths(apps, schema_editor):
+    StorageCommitment = apps.get_model('openacct', 'StorageCommitment')
+    commitments = StorageCommitment.objects.filter(path__endswith='/').exclude(path='/')
+    for pk, path in commitments.values_list('pk', 'path').iterator():
+        StorageCommitment.objects.filter(pk=pk).update(path=path.rstrip('/') or '/')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openacct', '0014_storage_charged_through'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_paths, migrations.RunPython.noop),
+    ]
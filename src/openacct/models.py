@@ -3,7 +3,7 @@ import re
 from collections import defaultdict
 from typing import Union
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import m2m_changed
 
 class User(models.Model):
@@ -221,6 +221,28 @@ class Transaction(models.Model):
         ("GRANT", "GRANT"),
         ("REVOKE", "REVOKE"),
     )
+    # Columns and filters of exports, see openacct.export
+    export_fields = (
+        "id",
+        "created",
+        "active",
+        "tx_type",
+        "service__system__name",
+        "service__name",
+        "account__project__name",
+        "account__name",
+        "creator__name",
+        "amt_used",
+        "amt_charged",
+    )
+    export_date_field = "created"
+    export_filters = {
+        "systems": "service__system__name",
+        "services": "service__name",
+        "projects": "account__project__name",
+        "accounts": "account__name",
+    }
+
     created = models.DateTimeField(auto_now_add=True)
     active = models.BooleanField(blank=True, default=True)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
@@ -230,12 +252,86 @@ class Transaction(models.Model):
     amt_charged = models.FloatField(blank=True, default=0.0)
     tx_type = models.CharField(max_length=16, choices=TX_TYPES)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created"], name="openacct_tx_created"),
+            # Invoicing and reporting select an account's or service's
+            # transactions within a time window
+            models.Index(
+                fields=["account", "created"], name="openacct_tx_account_created"
+            ),
+            models.Index(
+                fields=["service", "created"], name="openacct_tx_service_created"
+            ),
+            # Charging only considers active transactions. Backends without
+            # partial indexes fall back to openacct_tx_created
+            models.Index(
+                fields=["created"],
+                condition=models.Q(active=True),
+                name="openacct_tx_active_created",
+            ),
+        ]
+
     def __str__(self):
         return "{} - {} - {}".format(
             self.created, self.service.name, self.account.name
         )
 
 
+MEMORY_UNITS = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40, "P": 2 ** 50}
+
+
+def parse_tres(value):
+    """Parse a Slurm TRES string, such as ``cpu=4,mem=16G,gres/gpu=1,node=1``,
+    into a dict of ``cpus``, ``mem`` (in bytes), ``gpus`` and ``nodes``.
+    Resources missing from the string are None. GPUs are counted from the
+    untyped ``gres/gpu`` entry, or failing that the sum of the typed ones.
+    """
+    tres = {"cpus": None, "mem": None, "gpus": None, "nodes": None}
+    typed_gpus = None
+    for item in value.split(","):
+        key, _, amount = item.partition("=")
+        try:
+            if key == "cpu":
+                tres["cpus"] = int(amount)
+            elif key == "node":
+                tres["nodes"] = int(amount)
+            elif key == "gres/gpu":
+                tres["gpus"] = int(amount)
+            elif key.startswith("gres/gpu:"):
+                typed_gpus = (typed_gpus or 0) + int(amount)
+            elif key == "mem":
+                unit = MEMORY_UNITS.get(amount[-1:].upper())
+                # Bare amounts are in megabytes
+                number = float(amount[:-1]) if unit else float(amount)
+                tres["mem"] = int(number * (unit or MEMORY_UNITS["M"]))
+        except ValueError:
+            continue
+    if tres["gpus"] is None:
+        tres["gpus"] = typed_gpus
+    return tres
+
+
+class JobQuerySet(models.QuerySet):
+    def with_usage(self):
+        """Annotate each job with the ``core_hours`` and ``gpu_hours`` it
+        was allocated, from ``alloc_cpus``, ``alloc_gpus`` and
+        ``wall_duration``. Sum them with ``aggregate`` or ``annotate``,
+        under names of their own, as reusing these names hides them.
+        """
+        hours = models.ExpressionWrapper(
+            models.F("wall_duration") / 3600.0, output_field=models.FloatField()
+        )
+        return self.annotate(
+            core_hours=models.ExpressionWrapper(
+                models.F("alloc_cpus") * hours, output_field=models.FloatField()
+            ),
+            gpu_hours=models.ExpressionWrapper(
+                models.F("alloc_gpus") * hours, output_field=models.FloatField()
+            ),
+        )
+
+
 class Job(models.Model):
     """Jobs encapsulate common metadata provided by batch schedulers about
     their workloads. Beyond the metadata, a job can create a number of
@@ -247,6 +343,35 @@ class Job(models.Model):
     the raw information to the site-wide accounting.
     """
 
+    # Columns and filters of exports, see openacct.export
+    export_fields = (
+        "id",
+        "jobid",
+        "name",
+        "cluster",
+        "account",
+        "submitter",
+        "partition",
+        "qos",
+        "queued",
+        "started",
+        "completed",
+        "wall_requested",
+        "wall_duration",
+        "tres_requested",
+        "tres_allocated",
+        "req_cpus",
+        "req_mem",
+        "req_gpus",
+        "req_nodes",
+        "alloc_cpus",
+        "alloc_mem",
+        "alloc_gpus",
+        "alloc_nodes",
+    )
+    export_date_field = "completed"
+    export_filters = {"systems": "cluster", "accounts": "account"}
+
     created = models.DateTimeField(auto_now_add=True)
     queued = models.DateTimeField()
     started = models.DateTimeField(blank=True, null=True)
@@ -266,10 +391,114 @@ class Job(models.Model):
     tres_allocated = models.TextField(blank=True, default="")
     wall_requested = models.IntegerField()
     wall_duration = models.IntegerField(blank=True, null=True)
+    # Parsed from tres_requested and tres_allocated when saved, mem in bytes
+    req_cpus = models.IntegerField(blank=True, null=True)
+    req_mem = models.BigIntegerField(blank=True, null=True)
+    req_gpus = models.IntegerField(blank=True, null=True)
+    req_nodes = models.IntegerField(blank=True, null=True)
+    alloc_cpus = models.IntegerField(blank=True, null=True)
+    alloc_mem = models.BigIntegerField(blank=True, null=True)
+    alloc_gpus = models.IntegerField(blank=True, null=True)
+    alloc_nodes = models.IntegerField(blank=True, null=True)
+
+    objects = JobQuerySet.as_manager()
+
+    # The TRES columns, set by parse_tres_fields
+    TRES_FIELDS = tuple(
+        prefix + name
+        for prefix in ("req_", "alloc_")
+        for name in ("cpus", "mem", "gpus", "nodes")
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["queued"], name="openacct_job_queued"),
+            models.Index(fields=["completed"], name="openacct_job_completed"),
+            models.Index(
+                fields=["account", "completed"], name="openacct_job_account_completed"
+            ),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.jobid, self.name)
 
+    def parse_tres_fields(self):
+        """Set the TRES columns from ``tres_requested`` and ``tres_allocated``"""
+        for prefix, value in (
+            ("req_", self.tres_requested),
+            ("alloc_", self.tres_allocated),
+        ):
+            for name, amount in parse_tres(value).items():
+                setattr(self, prefix + name, amount)
+
+    def save(self, *args, **kwargs):
+        self.parse_tres_fields()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and (
+            {"tres_requested", "tres_allocated"} & set(update_fields)
+        ):
+            kwargs["update_fields"] = set(update_fields) | set(self.TRES_FIELDS)
+        super().save(*args, **kwargs)
+
+
+def normalize_path(path):
+    """``path`` without trailing slashes, except for the root ``/``"""
+    return path.rstrip("/") or path[:1]
+
+
+def path_prefixes(path):
+    """The given path followed by each of its ancestors, longest first"""
+    prefixes = []
+    rest = normalize_path(path)
+    while rest:
+        prefixes.append(rest)
+        rest = rest.rpartition("/")[0]
+    if path.startswith("/"):
+        prefixes.append("/")
+    return prefixes
+
+
+class StorageCommitmentQuerySet(models.QuerySet):
+    def resolve(self, paths, batch_size=100, reclaimed=False):
+        """Yield ``(filesystem, path, commitment)`` for each ``(filesystem,
+        path)`` in ``paths``, where ``commitment`` is the one whose path is
+        the longest prefix of ``path``, by whole path components, or None.
+        Looks up exact paths with the ``(filesystem, path)`` index, making
+        one query per ``batch_size`` paths. The newest commitment wins where
+        a path was committed more than once. Reclaimed commitments are
+        ignored unless ``reclaimed`` is true.
+        """
+        qs = self if reclaimed else self.filter(reclaimed__isnull=True)
+        paths = iter(paths)
+        while True:
+            batch = [pair for _, pair in zip(range(batch_size), paths)]
+            if not batch:
+                return
+            wanted = defaultdict(set)
+            for filesystem, path in batch:
+                wanted[filesystem].update(path_prefixes(path))
+            q = models.Q()
+            for filesystem, prefixes in wanted.items():
+                q |= models.Q(filesystem=filesystem, path__in=prefixes)
+            found = {
+                (c.filesystem, c.path): c
+                for c in qs.filter(q).select_related("project").order_by("pk")
+            }
+            for filesystem, path in batch:
+                commitment = next(
+                    (
+                        found[(filesystem, prefix)]
+                        for prefix in path_prefixes(path)
+                        if (filesystem, prefix) in found
+                    ),
+                    None,
+                )
+                yield filesystem, path, commitment
+
+    def covering(self, filesystem, path, reclaimed=False):
+        """The commitment whose path is the longest prefix of ``path``"""
+        return next(self.resolve([(filesystem, path)], reclaimed=reclaimed))[2]
+
 
 class StorageCommitment(models.Model):
     """Storage commitments encapsulate extended information regarding the
@@ -298,13 +527,63 @@ class StorageCommitment(models.Model):
     permissions = models.CharField(max_length=8, default="0700")
     is_purged = models.BooleanField(blank=True, default=True)
     transactions = models.ManyToManyField(Transaction, blank=True)
+    # The end of the latest window charged by openacct.storage
+    charged_through = models.DateTimeField(blank=True, null=True)
+
+    objects = StorageCommitmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["filesystem", "path"], name="openacct_storage_path"),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.filesystem, self.path)
 
+    def save(self, *args, **kwargs):
+        # Paths are stored without trailing slashes, as they're looked up
+        self.path = normalize_path(self.path)
+        super().save(*args, **kwargs)
+
+
+# Lifecycle of background work, see Task and Invoice
+WORK_STATUSES = (
+    ("PENDING", "PENDING"),
+    ("RUNNING", "RUNNING"),
+    ("DONE", "DONE"),
+    ("FAILED", "FAILED"),
+)
+
+
+class Task(models.Model):
+    """A unit of background work, run by the ``openacct_run_tasks`` command
+    by calling the function at the dotted path ``function`` with ``kwargs``.
+    See ``openacct.tasks``.
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    function = models.CharField(max_length=256)
+    kwargs = models.JSONField(blank=True, default=dict)
+    status = models.CharField(max_length=16, choices=WORK_STATUSES, default="PENDING")
+    started = models.DateTimeField(blank=True, null=True)
+    # Touched by the running task as it makes progress, see ``tasks.beat``
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created"], name="openacct_task_status"),
+        ]
+
+    def __str__(self):
+        return "{} - {}".format(self.function, self.status)
+
 
 class Invoice(models.Model):
-    """A project usage invoice with related BalanceSheets."""
+    """A project usage invoice with related BalanceSheets. The sheets are
+    generated in the background, with ``status`` and ``progress``, a
+    percentage, tracking the work.
+    """
     created = models.DateTimeField(auto_now_add=True)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
@@ -313,6 +592,9 @@ class Invoice(models.Model):
         "self", on_delete=models.SET_NULL, related_name="descendants",
         blank=True, null=True, default=None
     )
+    status = models.CharField(max_length=16, choices=WORK_STATUSES, default="PENDING")
+    progress = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
 
     def previous_account_balance(self, account):
         """Determine the previous balance for the give account from a
@@ -329,12 +611,16 @@ class Invoice(models.Model):
             pass
         return balance
 
-    def generate_balance_sheets(self):
+    def generate_balance_sheets(self, progress=None, progress_every=10000):
         """Iterate active project accounts, generating BalanceSheets for
         each. The invoking Invoice must have been previously saved to
-        the database, otherwise it will not have a valid primary key
+        the database, otherwise it will not have a valid primary key.
+        ``progress`` is an optional callable, called with the number of
+        accounts done and the total after each account, and after every
+        ``progress_every`` transactions read within one.
         """
-        for account in self.project.account_set.filter(active=True):
+        accounts = list(self.project.account_set.filter(active=True))
+        for done, account in enumerate(accounts, 1):
             balance = self.previous_account_balance(account)
             data = defaultdict(
                 lambda : defaultdict(lambda : {"c": 0.0, "u": 0.0})
@@ -343,25 +629,39 @@ class Invoice(models.Model):
                 account=account,
                 created__gte=self.start_time,
                 created__lte=self.end_time
-            ).select_related("user", "service")
-            for tx in txs:
+            ).values_list(
+                "pk", "tx_type", "amt_used", "amt_charged",
+                "creator__name", "service__name",
+            )
+            pks = []
+            for pk, tx_type, used, charged, user, service in txs.iterator():
                 amt_used, amt_charged = 0, 0
-                if tx.type == "DEBIT":
-                    amt_used, amt_charged = tx.amt_used, tx.amt_charged
-                elif tx.type == "CREDIT":
-                    amt_used, amt_charged = -tx.amt_used, -tx.amt_charged
+                if tx_type == "DEBIT":
+                    amt_used, amt_charged = used, charged
+                elif tx_type == "CREDIT":
+                    amt_used, amt_charged = -used, -charged
 
-                data[tx.user.name][tx.service.name]["u"] += amt_used
-                data[tx.user.name][tx.service.name]["c"] += amt_charged
+                data[user][service]["u"] += amt_used
+                data[user][service]["c"] += amt_charged
                 balance += amt_charged
-
-            BalanceSheet.objects.create(
-                invoice=self,
-                account=account,
-                balance=balance,
-                transactions=txs,
-                contents=data
-            )
+                pks.append(pk)
+                if progress and len(pks) % progress_every == 0:
+                    progress(done - 1, len(accounts))
+
+            with transaction.atomic():
+                sheet = BalanceSheet.objects.create(
+                    invoice=self,
+                    account=account,
+                    balance=balance,
+                    contents=data
+                )
+                through = BalanceSheet.transactions.through
+                through.objects.bulk_create(
+                    [through(balancesheet=sheet, transaction_id=pk) for pk in pks],
+                    batch_size=1000,
+                )
+            if progress:
+                progress(done, len(accounts))
 
 
 class BalanceSheet(models.Model):
@@ -369,6 +669,23 @@ class BalanceSheet(models.Model):
     and balance summaries. The ``contents`` field will be a JSON object
     aggregating the transactions into balances and usage by user and service.
     """
+    # Columns and filters of exports, see openacct.export
+    export_fields = (
+        "id",
+        "invoice_id",
+        "invoice__start_time",
+        "invoice__end_time",
+        "account__project__name",
+        "account__name",
+        "balance",
+        "contents",
+    )
+    export_date_field = "invoice__end_time"
+    export_filters = {
+        "projects": "account__project__name",
+        "accounts": "account__name",
+    }
+
     invoice = models.ForeignKey(
         Invoice, on_delete=models.CASCADE, related_name="sheets"
     )
@@ -0,0 +1,154 @@
+"""
+    openacct.pagination
+    ~~~~~~~~~~~~~~~~~~~
+
+    Admin changelist support for tables too large to count or page through
+    with ``OFFSET``. ``EstimatedCountPaginator`` reads the row count of an
+    unfiltered table from the database's statistics, and counts filtered
+    results only up to a limit. ``CursorChangeList`` pages through results
+    in primary key order by remembering the last key shown, so every page
+    costs the same however deep it is. See ``LargeTableAdminMixin``.
+"""
+import hashlib
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+CURSOR_VAR = "cursor"
+
+
+def estimated_count(model, using="default"):
+    """Returns the row count of ``model``'s table from the statistics kept
+    by PostgreSQL or MySQL, or None if they aren't available.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples FROM pg_class WHERE relname = %s"
+    elif connection.vendor == "mysql":
+        sql = (
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s"
+        )
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables which have never been analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """A Paginator which avoids full ``COUNT(*)`` scans. Unfiltered tables
+    with more than ``max_count`` rows are counted from the database's
+    statistics, and other querysets are counted up to ``max_count + 1``
+    rows. ``count_is_exact`` is False when either shortcut applied.
+    """
+
+    max_count = 10000
+    count_is_exact = True
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.max_count:
+                self.count_is_exact = False
+                return estimate
+        count = queryset.order_by()[: self.max_count + 1].count()
+        if count > self.max_count:
+            self.count_is_exact = False
+        return count
+
+
+class CursorChangeList(ChangeList):
+    """A ChangeList which, unless the user sorts by a column or shows all
+    rows, lists results in descending primary key order starting below the
+    ``cursor`` parameter, instead of by page number.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor_enabled = ORDER_VAR not in request.GET and ALL_VAR not in request.GET
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+        # Keep the cursor out of filter and sorting links
+        self.params.pop(CURSOR_VAR, None)
+        getattr(self, "filter_params", {}).pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_ordering(self, request, queryset):
+        if self.cursor_enabled:
+            return ["-pk"]
+        return super().get_ordering(request, queryset)
+
+    def get_results(self, request):
+        if not self.cursor_enabled:
+            return super().get_results(request)
+
+        queryset = self.queryset
+        if self.cursor:
+            try:
+                queryset = queryset.filter(pk__lt=int(self.cursor))
+            except ValueError:
+                raise IncorrectLookupParameters
+        result_list = queryset[: self.list_per_page]
+        if len(result_list) == self.list_per_page:
+            self.next_cursor = result_list[self.list_per_page - 1].pk
+
+        self.paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page
+        )
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = self.result_count > self.list_per_page
+
+    def first_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR]) if self.cursor else None
+
+    def next_url(self):
+        if self.next_cursor is None:
+            return None
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+
+class CachedValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """An AllValuesFieldListFilter which caches the distinct values of its
+    field for ``timeout`` seconds, rather than scanning the table for them
+    on every page view. The values are cached per query, so a ModelAdmin
+    whose ``get_queryset`` shows each user different rows doesn't leak
+    values between them.
+    """
+
+    timeout = 600
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        choices = self.lookup_choices
+        query = hashlib.sha1(
+            repr(choices.query.sql_with_params()).encode("utf-8")
+        ).hexdigest()
+        key = "openacct:list_filter:{}:{}:{}".format(
+            model._meta.label, field_path, query
+        )
+        self.lookup_choices = cache.get_or_set(
+            key, lambda: list(choices), self.timeout
+        )
@@ -0,0 +1,236 @@
+"""
+    openacct.quota
+    ~~~~~~~~~~~~~~
+
+    Parsers for filesystem quota reports, and their ingestion as AUDIT
+    transactions against ``StorageCommitment``. A parser takes an iterable
+    of lines and yields a ``QuotaRow`` per directory, so reports of any size
+    are read as a stream. Parsers are registered by name with
+    ``register_parser``; ``lfs``, ``mmrepquota`` and ``csv`` are built in.
+    ``parse_report`` runs a parser, reporting the line it failed on.
+"""
+import csv
+import os
+
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import StorageCommitment, Transaction, normalize_path
+from .storage import bulk_create_transactions, project_accounts
+
+
+# ``filesystem`` is None when the report doesn't name one
+QuotaRow = namedtuple("QuotaRow", ["filesystem", "path", "bytes", "files"])
+
+PARSERS = {}
+
+
+class MissingFilesystem(ValueError):
+    """Raised by ``ingest`` for a row naming no filesystem when none is given"""
+
+
+class MalformedLine(ValueError):
+    """Raised by ``parse_report`` when its parser fails to read a line"""
+
+    def __init__(self, lineno, line, error):
+        super().__init__(f"Line {lineno}: {error}: {line.rstrip()!r}")
+        self.lineno, self.line = lineno, line
+
+
+def register_parser(name):
+    """Decorator adding a parser function to the registry under ``name``"""
+
+    def decorator(parser):
+        PARSERS[name] = parser
+        return parser
+
+    return decorator
+
+
+def get_parser(name):
+    """Return the registered parser ``name``, or import one by dotted path"""
+    return PARSERS[name] if name in PARSERS else import_string(name)
+
+
+def parse_report(parser, lines):
+    """Yield the ``QuotaRow``s ``parser`` reads from ``lines``, raising
+    MalformedLine with the line last read if the parser raises ValueError.
+    Parsers read lazily, so that is the line it failed on.
+    """
+    last = [0, ""]
+
+    def numbered():
+        for last[0], last[1] in enumerate(lines, 1):
+            yield last[1]
+
+    try:
+        yield from parser(numbered())
+    except ValueError as e:
+        raise MalformedLine(last[0], last[1], e) from e
+
+
+def _count(value):
+    # Values over quota are flagged with a trailing "*"
+    return int(value.rstrip("*"))
+
+
+@register_parser("lfs")
+def parse_lfs(lines):
+    """Parse the output of ``lfs quota`` for one or more directories. The
+    Filesystem column, which ``lfs`` prints on a line of its own when it's
+    long, is taken as the path. Usage is reported in kilobytes.
+    """
+    name = None
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0] in ("Disk", "Filesystem"):
+            continue
+        if len(fields) == 1:
+            name = fields[0]
+            continue
+        if name is None:
+            name, fields = fields[0], fields[1:]
+        if len(fields) >= 5 and fields[0].rstrip("*").isdigit():
+            yield QuotaRow(None, name, _count(fields[0]) * 1024, _count(fields[4]))
+        name = None
+
+
+# The quota types in the type column of printed mmrepquota reports
+MMREPQUOTA_TYPES = ("USR", "GRP", "FILESET")
+
+
+@register_parser("mmrepquota")
+def parse_mmrepquota(lines):
+    """Parse the output of GPFS ``mmrepquota``, either as printed or in the
+    colon separated ``-Y`` format, which is preferred. The quota's name,
+    such as a fileset, is taken as the path. Usage is reported in kilobytes.
+
+    Printed reports are split at the ``|`` between the block and file
+    limits, since the grace columns may hold several words, like ``7 days``.
+    Block usage follows the type column, which comes after an optional
+    fileset column, and file usage opens the file limits.
+    """
+    filesystem, header = None, None
+    for line in lines:
+        if line.startswith("mmrepquota:"):
+            fields = line.rstrip("\n").split(":")
+            if fields[2] == "HEADER":
+                header = {key: i for i, key in enumerate(fields)}
+            elif header is not None:
+                yield QuotaRow(
+                    fields[header["filesystemName"]],
+                    fields[header["name"]],
+                    int(fields[header["blockUsage"]]) * 1024,
+                    int(fields[header["filesUsage"]]),
+                )
+            continue
+
+        if line.startswith("***"):
+            # *** Report for USR GRP FILESET quotas on <filesystem>
+            filesystem = line.split()[-1]
+            continue
+        block, bar, files = line.partition("|")
+        block, files = block.split(), files.split()
+        if not bar or not files or not files[0].rstrip("*").isdigit():
+            continue
+        kind = next(
+            (i for i, field in enumerate(block[1:3], 1) if field in MMREPQUOTA_TYPES),
+            None,
+        )
+        usage = block[kind + 1 : kind + 2] if kind is not None else []
+        if not usage or not usage[0].rstrip("*").isdigit():
+            continue
+        yield QuotaRow(filesystem, block[0], _count(usage[0]) * 1024, _count(files[0]))
+
+
+@register_parser("csv")
+def parse_csv(lines):
+    """Parse rows of ``path,bytes,files``, skipping a header row if present"""
+    for row in csv.reader(lines):
+        if len(row) < 3 or not row[1].strip().isdigit():
+            continue
+        yield QuotaRow(None, row[0].strip(), int(row[1]), int(row[2]))
+
+
+def commitment_index():
+    """Map the ``(filesystem, path)`` of each unreclaimed commitment to its
+    ``(pk, project pk)``. Where a path was committed more than once, the
+    newest commitment wins.
+    """
+    return {
+        (filesystem, path): (pk, project)
+        for pk, project, filesystem, path in StorageCommitment.objects.filter(
+            reclaimed__isnull=True
+        ).order_by("pk").values_list("pk", "project_id", "filesystem", "path")
+    }
+
+
+@transaction.atomic
+def ingest(
+    rows,
+    service,
+    user,
+    filesystem=None,
+    path_prefix="",
+    bytes_per_unit=10 ** 12,
+    batch_size=1000,
+    unmatched=None,
+):
+    """Record an AUDIT transaction of ``service`` for each ``QuotaRow``
+    which matches a commitment, against its project's account and attached
+    to the commitment. ``filesystem`` applies to rows which don't name one,
+    and a row's path is joined to ``path_prefix``. Rows which match no
+    commitment are passed to ``unmatched``, if given, as they're read.
+    Returns the numbers of rows recorded and unmatched.
+
+    Transactions are inserted ``batch_size`` at a time within one database
+    transaction, so nothing is recorded if reading any row fails. Raises
+    MissingFilesystem for a row naming no filesystem when ``filesystem``
+    isn't given, as for ``lfs`` and ``csv`` reports.
+    """
+    index = commitment_index()
+    accounts = project_accounts({project for _, project in index.values()})
+    Link = StorageCommitment.transactions.through
+    recorded, missed, batch = 0, 0, []
+
+    def flush():
+        bulk_create_transactions([tx for _, tx in batch], batch_size)
+        Link.objects.bulk_create(
+            [Link(storagecommitment_id=pk, transaction_id=tx.pk) for pk, tx in batch],
+            batch_size=batch_size,
+        )
+        batch.clear()
+
+    for row in rows:
+        if not (row.filesystem or filesystem):
+            raise MissingFilesystem(f"No filesystem given for {row.path}")
+        key = (
+            row.filesystem or filesystem,
+            normalize_path(
+                os.path.join(path_prefix, row.path) if path_prefix else row.path
+            ),
+        )
+        match = index.get(key)
+        if match is None or match[1] not in accounts:
+            missed += 1
+            if unmatched is not None:
+                unmatched(row)
+            continue
+        batch.append((
+            match[0],
+            Transaction(
+                service=service,
+                account=accounts[match[1]],
+                creator=user,
+                amt_used=row.bytes / bytes_per_unit,
+                tx_type="AUDIT",
+            ),
+        ))
+        recorded += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return recorded, missed
@@ -0,0 +1,279 @@
+"""
+    openacct.retention
+    ~~~~~~~~~~~~~~~~~~
+
+    Time-based retention for tables which grow without bound. Each table
+    has a ``RetentionPolicy`` describing how its rows are serialized and
+    restored. Rows older than the policy's cutoff are exported, one day at a
+    time, to gzip-compressed NDJSON or CSV files partitioned by date, then
+    deleted in bounded batches once their file is complete.
+
+    Policies are enabled with the ``OPENACCT_RETENTION`` setting, which maps
+    the dotted path of each policy class to keyword arguments for it::
+
+        OPENACCT_RETENTION = {
+            "openacct.contrib.login_records.retention.LoginRecordPolicy": {
+                "days": 365,
+            },
+        }
+"""
+import csv
+import datetime
+import gzip
+import json
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+FORMATS = ("ndjson", "csv")
+
+
+class RetentionPolicy:
+    """Base class for retention policies. Subclasses set ``name``, which is
+    used in archive paths, ``model`` and ``fields``, the keys of serialized
+    rows and the columns of CSV archives, and implement ``serialize`` and
+    ``restore``. ``date_field`` is the datetime field rows are aged by.
+    Fields listed in ``nested_fields`` hold lists or dicts, or values whose
+    type must survive, and are stored as JSON in CSV archives.
+    """
+
+    name = None
+    model = None
+    date_field = "when"
+    fields = ()
+    nested_fields = ()
+
+    def __init__(self, days, format="ndjson", chunk_size=2000, delete_batch_size=1000):
+        if format not in FORMATS:
+            raise ValueError("Unknown archive format: {}".format(format))
+        self.days = days
+        self.format = format
+        self.chunk_size = chunk_size
+        self.delete_batch_size = delete_batch_size
+
+    def queryset(self):
+        """The rows to archive, with any relations ``serialize`` needs"""
+        return self.model.objects.all()
+
+    def serialize(self, obj):
+        """Returns a dict of JSON-compatible values keyed by ``fields``"""
+        raise NotImplementedError
+
+    def restore(self, rows):
+        """Re-insert a list of serialized rows, skipping any which are still
+        stored. Raises ValidationError, without inserting anything, if any
+        row is invalid. Returns the number of rows read.
+        """
+        raise NotImplementedError
+
+    def cutoff(self, now=None):
+        """Rows dated before the start of this day are due for archival"""
+        now = now if now else timezone.now()
+        return timezone.localdate(now) - datetime.timedelta(days=self.days)
+
+
+def get_policies():
+    """Instantiate the policies configured in ``OPENACCT_RETENTION``"""
+    return [
+        import_string(path)(**options)
+        for path, options in getattr(settings, "OPENACCT_RETENTION", {}).items()
+    ]
+
+
+def day_bounds(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    if settings.USE_TZ:
+        start = timezone.make_aware(start)
+    return start, start + datetime.timedelta(days=1)
+
+
+def archive_path(root, policy, day):
+    """A path for a new archive of ``day``, which never replaces an existing
+    one. A day archived twice, such as after an interrupted run, gets a
+    numbered second part.
+    """
+    directory = os.path.join(root, policy.name, "{:%Y/%m}".format(day))
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, "{}-{}".format(policy.name, day.isoformat()))
+    path, part = "{}.{}.gz".format(base, policy.format), 0
+    while os.path.exists(path):
+        part += 1
+        path = "{}.{}.{}.gz".format(base, part, policy.format)
+    return path
+
+
+def _chunks(queryset, chunk_size):
+    """Evaluate ``queryset`` in primary key order, one chunk at a time"""
+    queryset = queryset.order_by("pk")
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1].pk
+
+
+def write_archive(path, policy, queryset):
+    """Stream the rows of ``queryset`` into a compressed archive at ``path``.
+    The file is written under a temporary name and renamed when complete.
+    Returns the number of rows written.
+    """
+    count = 0
+    with gzip.open(path + ".tmp", "wt", newline="") as f:
+        if policy.format == "csv":
+            writer = csv.DictWriter(f, fieldnames=policy.fields)
+            writer.writeheader()
+        for chunk in _chunks(queryset, policy.chunk_size):
+            for obj in chunk:
+                row = policy.serialize(obj)
+                if policy.format == "csv":
+                    for field in policy.nested_fields:
+                        row[field] = json.dumps(row[field])
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(row) + "\n")
+            count += len(chunk)
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def delete_batched(queryset, batch_size):
+    """Delete the rows of ``queryset`` at most ``batch_size`` at a time, each
+    batch in its own transaction. Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            queryset.model.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+
+
+def archive(policy, root, cutoff=None, delete=True, log=None):
+    """Archive the rows dated before ``cutoff``, defaulting to the policy's,
+    one day at a time, oldest first, deleting each day's rows once its file
+    is written unless ``delete`` is False. Rows inserted after the run
+    starts are left alone. Returns a tuple of rows archived and deleted.
+    """
+    cutoff = cutoff if cutoff else policy.cutoff()
+    queryset = policy.queryset().filter(
+        **{policy.date_field + "__lt": day_bounds(cutoff)[0]}
+    )
+    max_pk = queryset.aggregate(max_pk=Max("pk"))["max_pk"]
+    if max_pk is None:
+        return 0, 0
+    queryset = queryset.filter(pk__lte=max_pk)
+
+    archived = deleted = 0
+    after = None
+    while True:
+        pending = queryset
+        if after is not None:
+            pending = pending.filter(**{policy.date_field + "__gte": after})
+        oldest = pending.aggregate(oldest=Min(policy.date_field))["oldest"]
+        if oldest is None:
+            return archived, deleted
+        day = timezone.localtime(oldest).date() if settings.USE_TZ else oldest.date()
+        start, after = day_bounds(day)
+        rows = queryset.filter(
+            **{policy.date_field + "__gte": start, policy.date_field + "__lt": after}
+        )
+
+        path = archive_path(root, policy, day)
+        count = write_archive(path, policy, rows)
+        archived += count
+        if delete:
+            deleted += delete_batched(rows, policy.delete_batch_size)
+        if log:
+            log(f"{path}: {count} rows")
+
+
+ARCHIVE_NAME = re.compile(
+    r"^(?P<name>.+)-(?P<day>\d{4}-\d{2}-\d{2})(?:\.\d+)?\.(?P<format>ndjson|csv)\.gz$"
+)
+
+
+def find_archives(root, policy, start=None, end=None):
+    """Archive files of ``policy`` under ``root`` for the days in
+    [start, end], oldest first.
+    """
+    found = []
+    for directory, _, files in os.walk(os.path.join(root, policy.name)):
+        for filename in files:
+            m = ARCHIVE_NAME.match(filename)
+            if m is None or m.group("name") != policy.name:
+                continue
+            day = datetime.date.fromisoformat(m.group("day"))
+            if (start and day < start) or (end and day > end):
+                continue
+            found.append((day, os.path.join(directory, filename)))
+    return [path for _, path in sorted(found)]
+
+
+def _csv_rows(f, policy):
+    for row in csv.DictReader(f):
+        for field in policy.nested_fields:
+            row[field] = json.loads(row[field])
+        yield row
+
+
+def read_archive(path, policy):
+    """Yield lists of at most ``policy.chunk_size`` rows from an archive"""
+    m = ARCHIVE_NAME.match(os.path.basename(path))
+    chunk_size = policy.chunk_size
+    with gzip.open(path, "rt", newline="") as f:
+        if m and m.group("format") == "csv":
+            rows = _csv_rows(f, policy)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _restore_chunk(policy, chunk, rejected):
+    """Restore a chunk of rows, falling back to one row at a time if any of
+    them is invalid. Invalid rows are appended to ``rejected`` along with
+    their error. Returns the number of rows restored.
+    """
+    try:
+        return policy.restore(chunk)
+    except (ValidationError, KeyError, TypeError, ValueError) as e:
+        if len(chunk) == 1:
+            rejected.append((chunk[0], e))
+            return 0
+    return sum(_restore_chunk(policy, [row], rejected) for row in chunk)
+
+
+def restore(policy, paths, log=None):
+    """Re-import archive files with ``policy``. Rows which fail validation
+    are skipped and the rest of their file is still restored. Returns the
+    number of rows restored, and a list of ``(path, row, error)`` for each
+    row skipped.
+    """
+    restored, skipped = 0, []
+    for path in paths:
+        count, rejected = 0, []
+        for chunk in read_archive(path, policy):
+            count += _restore_chunk(policy, chunk, rejected)
+        restored += count
+        skipped.extend((path, row, error) for row, error in rejected)
+        if log:
+            log(f"{path}: {count} rows, {len(rejected)} skipped")
+    return restored, skipped
@@ -0,0 +1,203 @@
+"""
+    openacct.sacct
+    ~~~~~~~~~~~~~~
+
+    Bulk import of Slurm accounting records into ``Job``. ``parse`` reads
+    the output of ``sacct --parsable2`` as a stream, skipping job steps, and
+    ``upsert`` writes jobs in batches keyed on ``jobid`` with one
+    ``bulk_create(update_conflicts=True)`` per batch, inserting new jobs and
+    updating known ones. Array tasks (``1234_7``) and heterogeneous job
+    components (``1234+1``) are kept as jobs of their own.
+
+    Bulk writes don't send ``post_save``, so anything listening for saved
+    jobs, such as the envmodules command linking, must be caught up after.
+"""
+import datetime
+
+from collections import defaultdict
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Job
+
+
+# The sacct --format which ``parse`` expects when the output has no header
+SACCT_FORMAT = (
+    "JobID,JobName,Cluster,Account,User,Partition,QOS,Submit,Start,End,"
+    "TimelimitRaw,ElapsedRaw,NodeList,ReqTRES,AllocTRES"
+)
+
+# sacct fields and the Job fields they're stored in
+FIELDS = {
+    "JobID": "jobid",
+    "JobName": "name",
+    "Cluster": "cluster",
+    "Account": "account",
+    "User": "submitter",
+    "Partition": "partition",
+    "QOS": "qos",
+    "Submit": "queued",
+    "Start": "started",
+    "End": "completed",
+    "Timelimit": "wall_requested",
+    "TimelimitRaw": "wall_requested",
+    "Elapsed": "wall_duration",
+    "ElapsedRaw": "wall_duration",
+    "NodeList": "host_list",
+    "ReqTRES": "tres_requested",
+    "AllocTRES": "tres_allocated",
+}
+
+
+def _timestamp(value):
+    if value in ("", "Unknown", "None"):
+        return None
+    return timezone.make_aware(datetime.datetime.fromisoformat(value))
+
+
+def _duration(value):
+    """Seconds in a ``[D-][HH:]MM:SS`` duration"""
+    if value in ("", "UNLIMITED", "Partition_Limit", "INVALID"):
+        return None
+    days, _, clock = value.rpartition("-")
+    seconds = 0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + int(part.split(".")[0])
+    return (int(days) if days else 0) * 86400 + seconds
+
+
+def _minutes(value):
+    return int(value) * 60 if value.isdigit() else None
+
+
+def _seconds(value):
+    return int(value) if value.isdigit() else None
+
+
+def _hosts(value):
+    return "" if value in ("None assigned", "(null)") else value
+
+
+CONVERTERS = {
+    "Submit": _timestamp,
+    "Start": _timestamp,
+    "End": _timestamp,
+    "Timelimit": _duration,
+    "TimelimitRaw": _minutes,
+    "Elapsed": _duration,
+    "ElapsedRaw": _seconds,
+    "NodeList": _hosts,
+}
+
+
+def parse(lines, fields=None, invalid=None):
+    """Yield a dict of Job field values for each job in the lines of
+    ``sacct --parsable2`` output. The field names are read from the header
+    unless ``fields``, a list like ``SACCT_FORMAT``, is given. Job steps,
+    such as ``1234.batch``, and jobs without a submit time are skipped.
+    ``wall_requested`` is left out where sacct has no time limit.
+
+    Lines with the wrong number of fields or values which can't be
+    converted are skipped, and passed to ``invalid``, if given, as
+    ``(line number, line, reason)``.
+    """
+    lines = iter(lines)
+    start = 1
+    if fields is None:
+        fields = next(lines, "").rstrip("\n").split("|")
+        start = 2
+    if "JobID" not in fields:
+        raise ValueError("sacct output must include JobID")
+    jobid = fields.index("JobID")
+    columns = [
+        (i, FIELDS[name], CONVERTERS.get(name))
+        for i, name in enumerate(fields)
+        if name in FIELDS
+    ]
+    lengths = {
+        f.name: f.max_length for f in Job._meta.fields if f.max_length is not None
+    }
+
+    for number, line in enumerate(lines, start):
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        values = line.split("|")
+        if len(values) != len(fields):
+            if invalid is not None:
+                invalid(
+                    number, line, f"{len(values)} fields, expected {len(fields)}"
+                )
+            continue
+        if "." in values[jobid]:
+            continue
+        job = {}
+        try:
+            for i, field, convert in columns:
+                value = convert(values[i]) if convert else values[i]
+                if field in lengths and value:
+                    value = value[: lengths[field]]
+                job[field] = value
+        except ValueError as e:
+            if invalid is not None:
+                invalid(number, line, f"{fields[i]}: {e}")
+            continue
+        if job.get("queued") is None:
+            continue
+        if job.get("wall_requested") is None:
+            job.pop("wall_requested", None)
+        yield job
+
+
+def upsert(jobs, batch_size=5000):
+    """Create or update the jobs, dicts of Job field values such as those
+    from ``parse``, in batches keyed on ``jobid``. Within a batch the last
+    record of a jobid wins. Only the fields a record has are updated, so a
+    known job without ``wall_requested`` keeps its own, while a new one gets
+    0. Returns the numbers of jobs created and updated.
+    """
+    # MySQL takes any unique key as the conflict target and refuses one named
+    conflict_target = (
+        ["jobid"]
+        if connections[Job.objects.db].features.supports_update_conflicts_with_target
+        else None
+    )
+    jobs = iter(jobs)
+    created = updated = 0
+    while True:
+        batch = {}
+        for job in jobs:
+            batch[job["jobid"]] = job
+            if len(batch) >= batch_size:
+                break
+        if not batch:
+            return created, updated
+
+        # Records with the same fields update the same columns
+        groups = defaultdict(list)
+        for job in batch.values():
+            groups[frozenset(job)].append(Job(**{"wall_requested": 0, **job}))
+        with transaction.atomic():
+            known = Job.objects.filter(jobid__in=batch).count()
+            for fields, group in groups.items():
+                fields = set(fields) - {"jobid"}
+                if fields & {"tres_requested", "tres_allocated"}:
+                    fields |= set(Job.TRES_FIELDS)
+                # Bulk writes bypass Job.save, which parses the TRES columns
+                for job in group:
+                    job.parse_tres_fields()
+                if fields:
+                    Job.objects.bulk_create(
+                        group,
+                        batch_size=1000,
+                        update_conflicts=True,
+                        unique_fields=conflict_target,
+                        update_fields=sorted(fields),
+                    )
+                else:
+                    Job.objects.bulk_create(
+                        group, batch_size=1000, ignore_conflicts=True
+                    )
+        created += len(batch) - known
+        updated += known
@@ -0,0 +1,137 @@
+"""
+    openacct.storage
+    ~~~~~~~~~~~~~~~~
+
+    Charging for the storage described by ``StorageCommitment``. A
+    commitment holds ``commitment`` bytes from when it was ``allocated``
+    (or created) until its ``end_date`` or until it was ``reclaimed``,
+    whichever is first. ``commitment_usage`` finds the part of that span
+    which overlaps a billing window for every commitment in one query, and
+    ``charge_commitments`` turns the byte-days into DEBIT transactions.
+    Each commitment remembers the end of the latest window it was charged
+    for as ``charged_through``, and storage before it is never charged
+    again, so windows should be charged in order.
+"""
+from django.db import connections, transaction
+from django.db.models import (
+    DateTimeField, DurationField, ExpressionWrapper, F, Q, Value,
+)
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Account, StorageCommitment, Transaction
+
+
+SECONDS_PER_DAY = 86400
+
+
+def commitment_usage(start, end, queryset=None, uncharged=False):
+    """Yield ``(commitment pk, project pk, byte-days)`` for each commitment
+    in ``queryset`` (by default all of them) which held storage during the
+    window [start, end). Commitments which overlap the window's edges are
+    clipped to it, and if ``uncharged`` is set, to after the end of the
+    window they were last charged for.
+    """
+    queryset = StorageCommitment.objects.all() if queryset is None else queryset
+    start = Value(start, output_field=DateTimeField())
+    end = Value(end, output_field=DateTimeField())
+    held_from = [Coalesce("allocated", "created"), start]
+    if uncharged:
+        held_from.append(Coalesce("charged_through", start))
+    queryset = queryset.filter(commitment__gt=0).annotate(
+        held_from=Greatest(*held_from),
+        held_until=Least(
+            Coalesce("end_date", end), Coalesce("reclaimed", end), end
+        ),
+    ).filter(held_from__lt=F("held_until")).annotate(
+        held=ExpressionWrapper(
+            F("held_until") - F("held_from"), output_field=DurationField()
+        )
+    )
+    for pk, project, commitment, held in queryset.values_list(
+        "pk", "project_id", "commitment", "held"
+    ).iterator():
+        yield pk, project, commitment * held.total_seconds() / SECONDS_PER_DAY
+
+
+def bulk_create_transactions(transactions, batch_size=1000):
+    """Insert unsaved Transactions with ``bulk_create``, so that they have
+    primary keys to be linked by afterwards. Databases which can't return
+    the keys of a bulk insert fall back to saving them one at a time.
+    """
+    connection = connections[Transaction.objects.db]
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Transaction.objects.bulk_create(transactions, batch_size=batch_size)
+    for tx in transactions:
+        tx.save()
+    return transactions
+
+
+def project_accounts(projects):
+    """Map the given project pks to their most recently created active
+    Account, the one ``record_transaction`` charges for a project.
+    """
+    accounts = {}
+    for account in Account.objects.filter(
+        project__in=projects, active=True
+    ).order_by("created"):
+        accounts[account.project_id] = account
+    return accounts
+
+
+def charge_commitments(
+    start,
+    end,
+    service,
+    user,
+    queryset=None,
+    bytes_per_unit=10 ** 12,
+    days_per_unit=30,
+):
+    """Record a DEBIT transaction of ``service`` for the storage each
+    commitment held during [start, end) which wasn't already charged,
+    against its project's account and attached to the commitment.
+    ``amt_used`` is measured in units of ``bytes_per_unit`` held for
+    ``days_per_unit`` days, TB-months by default, and ``amt_charged`` at the
+    service's ``charge_rate``. The commitments are locked while they're
+    charged, and their ``charged_through`` moved up to ``end``. Returns the
+    transactions, and the pks of commitments skipped because their project
+    has no active account.
+    """
+    queryset = StorageCommitment.objects.all() if queryset is None else queryset
+    unit = bytes_per_unit * days_per_unit
+    Link = StorageCommitment.transactions.through
+
+    with transaction.atomic():
+        usage = list(
+            commitment_usage(start, end, queryset.select_for_update(), uncharged=True)
+        )
+        accounts = project_accounts({project for _, project, _ in usage})
+        commitments, transactions, skipped = [], [], []
+        for pk, project, byte_days in usage:
+            if project not in accounts:
+                skipped.append(pk)
+                continue
+            commitments.append(pk)
+            transactions.append(
+                Transaction(
+                    service=service,
+                    account=accounts[project],
+                    creator=user,
+                    amt_used=byte_days / unit,
+                    amt_charged=byte_days / unit * service.charge_rate,
+                    tx_type="DEBIT",
+                )
+            )
+
+        bulk_create_transactions(transactions)
+        Link.objects.bulk_create(
+            [
+                Link(storagecommitment_id=pk, transaction_id=tx.pk)
+                for pk, tx in zip(commitments, transactions)
+            ],
+            batch_size=1000,
+        )
+        StorageCommitment.objects.filter(pk__in=commitments).filter(
+            Q(charged_through__isnull=True) | Q(charged_through__lt=end)
+        ).update(charged_through=end)
+    return transactions, skipped
@@ -0,0 +1,160 @@
+"""
+    openacct.tasks
+    ~~~~~~~~~~~~~~
+
+    A small background task queue kept in the ``Task`` table, so that slow
+    work like generating invoices runs outside of web requests without an
+    external broker. ``enqueue`` records a call to a function by its dotted
+    path, and the ``openacct_run_tasks`` command claims and runs pending
+    tasks one at a time. Several workers may run at once on databases which
+    support ``SELECT ... FOR UPDATE SKIP LOCKED``. A running task calls
+    ``beat`` as it makes progress, and tasks which stop beating, such as
+    when their worker is killed, are requeued by ``requeue_stale``. A task
+    which beats within a transaction keeps its row locked until it commits,
+    and ``requeue_stale`` skips it while it does.
+"""
+import contextvars
+import datetime
+import traceback
+
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Invoice, Task
+
+
+# The Task being run by ``run_task``
+_current_task = contextvars.ContextVar("openacct_current_task", default=None)
+
+
+def enqueue(function, **kwargs):
+    """Queue a call of the function at the dotted path ``function`` with
+    JSON-serializable ``kwargs``. The task is saved with any enclosing
+    transaction, so it never runs if that is rolled back.
+    """
+    return Task.objects.create(function=function, kwargs=kwargs)
+
+
+def claim_task():
+    """Mark the oldest pending task as running and return it, or None"""
+    with transaction.atomic():
+        task = (
+            Task.objects.filter(status="PENDING")
+            .select_for_update(skip_locked=True)
+            .order_by("created", "pk")
+            .first()
+        )
+        if task is None:
+            return None
+        task.status, task.started = "RUNNING", timezone.now()
+        task.heartbeat = task.started
+        task.save(update_fields=["status", "started", "heartbeat"])
+    return task
+
+
+def current_task():
+    """The Task being run by ``run_task``, or None outside of one"""
+    return _current_task.get()
+
+
+def beat():
+    """Record that the current task, if any, is still making progress, so
+    that ``requeue_stale`` leaves it running.
+    """
+    task = _current_task.get()
+    if task is not None:
+        task.heartbeat = timezone.now()
+        Task.objects.filter(pk=task.pk).update(heartbeat=task.heartbeat)
+
+
+def run_task(task):
+    """Call a claimed task's function, recording whether it succeeded"""
+    token = _current_task.set(task)
+    try:
+        import_string(task.function)(**task.kwargs)
+    except Exception:
+        task.status, task.error = "FAILED", traceback.format_exc()
+    else:
+        task.status = "DONE"
+    finally:
+        _current_task.reset(token)
+    task.finished = timezone.now()
+    task.save(update_fields=["status", "error", "finished"])
+    return task
+
+
+def requeue_stale(seconds):
+    """Return running tasks which haven't beaten for more than ``seconds``,
+    such as those of a worker which was killed, to the queue. Returns the
+    number requeued. Tasks whose rows are locked are skipped, as their
+    worker is alive and beating within a transaction it hasn't committed.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=seconds)
+    with transaction.atomic():
+        stale = list(
+            Task.objects.alias(last_beat=Coalesce("heartbeat", "started"))
+            .filter(status="RUNNING", last_beat__lt=cutoff)
+            .select_for_update(skip_locked=True)
+            .values_list("pk", flat=True)
+        )
+        return Task.objects.filter(pk__in=stale).update(
+            status="PENDING", started=None, heartbeat=None
+        )
+
+
+def queue_invoice(invoice):
+    """Mark ``invoice`` pending and queue the generation of its sheets"""
+    Invoice.objects.filter(pk=invoice.pk).update(
+        status="PENDING", progress=0, error=""
+    )
+    invoice.status, invoice.progress, invoice.error = "PENDING", 0, ""
+    return enqueue("openacct.tasks.generate_invoice", invoice=invoice.pk)
+
+
+def generate_invoice(invoice):
+    """Task generating the BalanceSheets of the Invoice with primary key
+    ``invoice``, replacing any it already has. The invoice is claimed under
+    a ``SELECT ... FOR UPDATE SKIP LOCKED``, and left alone if another
+    worker is claiming it or another running task is generating it. The
+    old sheets are replaced in one transaction, so a failure leaves them
+    in place, and the task beats as each account's transactions are read.
+    """
+    task = current_task()
+    with transaction.atomic():
+        obj = (
+            Invoice.objects.select_for_update(skip_locked=True)
+            .filter(pk=invoice)
+            .first()
+        )
+        if obj is None:
+            return
+        others = Task.objects.filter(
+            status="RUNNING",
+            function="openacct.tasks.generate_invoice",
+            kwargs__invoice=invoice,
+        )
+        if task is not None:
+            others = others.exclude(pk=task.pk)
+        if obj.status == "RUNNING" and others.exists():
+            return
+        obj.status, obj.progress, obj.error = "RUNNING", 0, ""
+        obj.save(update_fields=["status", "progress", "error"])
+
+    invoices = Invoice.objects.filter(pk=invoice)
+
+    def progress(done, total):
+        invoices.update(progress=100 * done // total)
+        beat()
+
+    try:
+        with transaction.atomic():
+            # Lock the task's row from the start, see requeue_stale
+            beat()
+            obj.sheets.all().delete()
+            obj.generate_balance_sheets(progress=progress)
+    except Exception:
+        invoices.update(status="FAILED", error=traceback.format_exc())
+        raise
+    invoices.update(status="DONE", progress=100)
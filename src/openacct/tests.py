@@ -1,3 +1,883 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import types
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, skipUnlessDBFeature
+from django.utils import timezone
+
+from .admin import JobAdmin
+from .export import lines, select
+from .models import (
+    Account, Invoice, Job, Project, Service, StorageCommitment, System, Task,
+    Transaction, User, parse_tres,
+)
+from .pagination import CachedValuesFieldListFilter
+from .quota import (
+    MalformedLine, MissingFilesystem, QuotaRow, ingest, parse_csv, parse_lfs,
+    parse_mmrepquota, parse_report,
+)
+from .sacct import parse as parse_sacct, upsert
+from .storage import charge_commitments
+from .tasks import (
+    beat, claim_task, enqueue, generate_invoice, queue_invoice, requeue_stale,
+    run_task,
+)
+from .views import StorageLookupView
+
+
+class HotPathIndexTests(TestCase):
+    """Check with EXPLAIN that the queries made by charging, invoicing and
+    reporting are answered from the indexes meant for them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(name="user")
+        cls.project = Project.objects.create(name="project", pi=cls.user)
+        cls.account = Account.objects.create(name="account", project=cls.project)
+        system = System.objects.create(name="system")
+        cls.service = Service.objects.create(
+            name="service", units="hours", system=system
+        )
+        cls.start = timezone.now() - datetime.timedelta(days=30)
+        cls.end = timezone.now()
+
+        Transaction.objects.bulk_create([
+            Transaction(
+                service=cls.service,
+                account=cls.account,
+                creator=cls.user,
+                amt_used=i,
+                tx_type="DEBIT",
+                active=i % 10 != 0,
+            )
+            for i in range(200)
+        ])
+        Job.objects.bulk_create([
+            Job(
+                jobid=str(i),
+                queued=cls.start + datetime.timedelta(hours=i),
+                completed=cls.start + datetime.timedelta(hours=i + 1),
+                account="account",
+                wall_requested=3600,
+            )
+            for i in range(200)
+        ])
+
+    def assertUsesIndex(self, queryset, index):
+        if connection.vendor == "postgresql":
+            # Tables this small are cheaper to scan, so rule that out
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+
+    def test_transaction_created(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(created__gte=self.start), "openacct_tx_created"
+        )
+
+    def test_transaction_account_window(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                account=self.account, created__gte=self.start, created__lte=self.end
+            ),
+            "openacct_tx_account_created",
+        )
+
+    def test_transaction_service_window(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                service=self.service, created__gte=self.start, created__lte=self.end
+            ),
+            "openacct_tx_service_created",
+        )
+
+    @skipUnlessDBFeature("supports_partial_indexes")
+    def test_transaction_active_window(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                active=True, created__gte=self.start, created__lte=self.end
+            ),
+            "openacct_tx_active_created",
+        )
+
+    def test_job_queued(self):
+        self.assertUsesIndex(
+            Job.objects.filter(queued__gte=self.start), "openacct_job_queued"
+        )
+
+    def test_job_completed(self):
+        self.assertUsesIndex(
+            Job.objects.filter(completed__gte=self.start, completed__lte=self.end),
+            "openacct_job_completed",
+        )
+
+    def test_job_account_completed(self):
+        self.assertUsesIndex(
+            Job.objects.filter(
+                account="account", completed__gte=self.start, completed__lte=self.end
+            ),
+            "openacct_job_account_completed",
+        )
+
+
+class ScopedJobAdmin(JobAdmin):
+    """Shows each user only the jobs of the account named after them"""
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(account=request.user.username)
+
+
+class CachedValuesFieldListFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for jobid, account, cluster in (
+            ("1", "alpha", "east"), ("2", "alpha", "east"), ("3", "beta", "west")
+        ):
+            Job.objects.create(
+                jobid=jobid, account=account, cluster=cluster,
+                queued=timezone.now(), wall_requested=60,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def choices(self, username):
+        request = RequestFactory().get("/")
+        request.user = types.SimpleNamespace(username=username)
+        list_filter = CachedValuesFieldListFilter(
+            Job._meta.get_field("cluster"), request, {}, Job,
+            ScopedJobAdmin(Job, admin.site), "cluster",
+        )
+        return list(list_filter.lookup_choices)
+
+    def test_cached_per_scope(self):
+        self.assertEqual(self.choices("alpha"), ["east"])
+        self.assertEqual(self.choices("beta"), ["west"])
+        Job.objects.create(
+            jobid="4", account="alpha", cluster="north",
+            queued=timezone.now(), wall_requested=60,
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.choices("alpha"), ["east"])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        for n, (account, cluster) in enumerate(
+            [("alpha", "east"), ("alpha-2", "west"), ("beta", "east")]
+        ):
+            Job.objects.create(
+                jobid=str(n + 1), account=account, cluster=cluster,
+                queued=start, completed=start + datetime.timedelta(days=n),
+                wall_requested=60, tres_allocated="cpu=4,mem=1G",
+            )
+
+    def jobids(self, **kwargs):
+        return list(select(Job.objects.all(), **kwargs).values_list("jobid", flat=True))
+
+    def test_csv(self):
+        rows = list(csv.reader("".join(lines(Job.objects.all(), "csv")).splitlines()))
+        self.assertEqual(rows[0], list(Job.export_fields))
+        self.assertEqual([row[1] for row in rows[1:]], ["1", "2", "3"])
+        row = dict(zip(rows[0], rows[2]))
+        self.assertEqual(row["completed"], "2024-01-02T00:00:00+00:00")
+        self.assertEqual((row["alloc_cpus"], row["alloc_mem"]), ("4", str(2**30)))
+        self.assertEqual(row["started"], "")
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in lines(Job.objects.all(), "ndjson")]
+        self.assertEqual([row["jobid"] for row in rows], ["1", "2", "3"])
+        self.assertEqual(rows[0]["queued"], "2024-01-01T00:00:00+00:00")
+        self.assertEqual(rows[0]["alloc_cpus"], 4)
+        self.assertIsNone(rows[0]["started"])
+        with self.assertRaises(ValueError):
+            list(lines(Job.objects.all(), "xml"))
+
+    def test_filters(self):
+        day = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+        self.assertEqual(self.jobids(start=day), ["2", "3"])
+        self.assertEqual(self.jobids(end=day), ["1", "2"])
+        self.assertEqual(self.jobids(systems="east"), ["1", "3"])
+        self.assertEqual(self.jobids(accounts="alpha,beta"), ["1", "3"])
+        self.assertEqual(
+            self.jobids(accounts="alpha", match_scheme="startswith"), ["1", "2"]
+        )
+        self.assertEqual(self.jobids(systems="east", accounts="alpha"), ["1"])
+        with self.assertRaises(ValueError):
+            self.jobids(services="compute")
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, opener in [("jobs.ndjson", open), ("jobs.ndjson.gz", gzip.open)]:
+                path = os.path.join(tmp, name)
+                call_command(
+                    "openacct_export_records", "--model=openacct.Job",
+                    "--format=ndjson", "--systems=west", "--output=" + path,
+                )
+                with opener(path, "rt") as f:
+                    self.assertEqual([json.loads(line)["jobid"] for line in f], ["2"])
+        with self.assertRaises(CommandError):
+            call_command("openacct_export_records", "--model=openacct.Project")
+        with self.assertRaises(CommandError):
+            call_command(
+                "openacct_export_records", "--model=openacct.Job", "--services=x"
+            )
+
+    def test_admin_action(self):
+        model_admin = JobAdmin(Job, admin.site)
+        self.assertIn("export_csv", model_admin.actions)
+        self.assertIn("export_ndjson", model_admin.actions)
+        request = RequestFactory().post("/")
+        queryset = Job.objects.filter(cluster="east")
+
+        response = model_admin.export_csv(request, queryset)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertRegex(
+            response["Content-Disposition"], r'attachment; filename="job-\d+\.csv"'
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(
+            [row[1] for row in csv.reader(content.splitlines())], ["jobid", "1", "3"]
+        )
+
+        response = model_admin.export_ndjson(request, queryset)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(
+            [json.loads(line)["jobid"] for line in content.splitlines()], ["1", "3"]
+        )
+
+
+# Calls made by the tasks of TaskTests
+task_calls = []
+
+
+def record_call(**kwargs):
+    beat()
+    task_calls.append(kwargs)
+
+
+def fail():
+    raise RuntimeError("task failed")
+
+
+class TaskTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        pi = User.objects.create(name="pi")
+        cls.project = Project.objects.create(name="project", pi=pi)
+        for name in ("first", "second"):
+            Account.objects.create(name=name, project=cls.project)
+
+    def setUp(self):
+        task_calls.clear()
+
+    def age(self, task, seconds, fields=("started", "heartbeat")):
+        past = timezone.now() - datetime.timedelta(seconds=seconds)
+        Task.objects.filter(pk=task.pk).update(**dict.fromkeys(fields, past))
+
+    def test_run(self):
+        enqueue("openacct.tests.record_call", value=1)
+        enqueue("openacct.tests.fail")
+        done = run_task(claim_task())
+        self.assertEqual(done.status, "DONE")
+        self.assertEqual(task_calls, [{"value": 1}])
+        failed = run_task(claim_task())
+        self.assertEqual(failed.status, "FAILED")
+        self.assertIn("task failed", failed.error)
+        self.assertIsNone(claim_task())
+
+    def test_beat(self):
+        task = enqueue("openacct.tests.record_call")
+        claim_task()
+        self.age(task, 60)
+        run_task(Task.objects.get(pk=task.pk))
+        task.refresh_from_db()
+        self.assertGreater(task.heartbeat, task.started)
+
+    def test_requeue_stale(self):
+        beating, stale = [enqueue("openacct.tests.record_call") for _ in range(2)]
+        claim_task(), claim_task()
+        self.age(beating, 120, ["started"])
+        self.age(stale, 120)
+        self.assertEqual(requeue_stale(60), 1)
+        self.assertEqual(
+            dict(Task.objects.values_list("pk", "status")),
+            {beating.pk: "RUNNING", stale.pk: "PENDING"},
+        )
+
+    def invoice(self):
+        now = timezone.now()
+        invoice = Invoice.objects.create(
+            project=self.project,
+            start_time=now - datetime.timedelta(days=30),
+            end_time=now,
+        )
+        queue_invoice(invoice)
+        return invoice
+
+    def test_generate_invoice(self):
+        invoice = self.invoice()
+        run_task(claim_task())
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.progress), ("DONE", 100))
+        self.assertEqual(invoice.sheets.count(), 2)
+
+    def test_invoice_generated_once(self):
+        invoice = self.invoice()
+        queue_invoice(invoice)
+        first = claim_task()
+        Invoice.objects.filter(pk=invoice.pk).update(status="RUNNING")
+        # The second task finds the first generating the invoice
+        run_task(claim_task())
+        self.assertEqual(invoice.sheets.count(), 0)
+        # Once the first is requeued as stale, the invoice is generated again
+        self.age(first, 120)
+        requeue_stale(60)
+        run_task(claim_task())
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, "DONE")
+        self.assertEqual(invoice.sheets.count(), 2)
+
+    def test_progress_within_account(self):
+        user = User.objects.get(name="pi")
+        service = Service.objects.create(
+            name="service", units="hours", system=System.objects.create(name="s")
+        )
+        Transaction.objects.bulk_create(
+            Transaction(
+                service=service, account=account, creator=user, amt_used=1,
+                tx_type="DEBIT",
+            )
+            for account in Account.objects.all()
+            for _ in range(5)
+        )
+        invoice = self.invoice()
+        calls = []
+        invoice.generate_balance_sheets(
+            progress=lambda done, total: calls.append((done, total)),
+            progress_every=2,
+        )
+        self.assertEqual(
+            calls, [(0, 2), (0, 2), (1, 2), (1, 2), (1, 2), (2, 2)]
+        )
+
+    def test_failed_generation_keeps_sheets(self):
+        invoice = self.invoice()
+        run_task(claim_task())
+        sheets = set(invoice.sheets.values_list("pk", flat=True))
+        queue_invoice(invoice)
+        with mock.patch.object(
+            Invoice, "previous_account_balance",
+            side_effect=[0.0, RuntimeError("no balance")],
+        ):
+            task = run_task(claim_task())
+        self.assertEqual(task.status, "FAILED")
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, "FAILED")
+        self.assertIn("no balance", invoice.error)
+        self.assertEqual(set(invoice.sheets.values_list("pk", flat=True)), sheets)
+
+
+class StorageChargingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(name="admin")
+        system = System.objects.create(name="storage")
+        cls.service = Service.objects.create(
+            name="project", units="TB-months", system=system, charge_rate=10
+        )
+        cls.project = Project.objects.create(name="project", pi=cls.user)
+        cls.account = Account.objects.create(name="account", project=cls.project)
+        orphan = Project.objects.create(name="orphan", pi=cls.user)
+        cls.jan = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        cls.commitment, cls.unaccounted = [
+            StorageCommitment.objects.create(
+                dir_type="PROJECT", project=project, filesystem="/gpfs",
+                path="/gpfs/" + project.name, commitment=10 ** 12,
+                allocated=cls.jan,
+            )
+            for project in (cls.project, orphan)
+        ]
+
+    def days(self, n):
+        return self.jan + datetime.timedelta(days=n)
+
+    def charge(self, start, end):
+        return charge_commitments(
+            self.days(start), self.days(end), self.service, self.user
+        )
+
+    def test_charge(self):
+        transactions, skipped = self.charge(0, 30)
+        self.assertEqual(skipped, [self.unaccounted.pk])
+        (tx,) = transactions
+        self.assertEqual((tx.account, tx.tx_type), (self.account, "DEBIT"))
+        self.assertAlmostEqual(tx.amt_used, 1)
+        self.assertAlmostEqual(tx.amt_charged, 10)
+        self.assertEqual(list(self.commitment.transactions.all()), [tx])
+        self.commitment.refresh_from_db()
+        self.assertEqual(self.commitment.charged_through, self.days(30))
+
+    def test_charged_once(self):
+        self.charge(0, 30)
+        self.assertEqual(self.charge(0, 30)[0], [])
+        self.assertEqual(self.charge(10, 20)[0], [])
+        (tx,) = self.charge(15, 45)[0]
+        self.assertAlmostEqual(tx.amt_used, 0.5)
+        self.assertEqual(self.commitment.transactions.count(), 2)
+
+    def test_clipped_when_reclaimed(self):
+        StorageCommitment.objects.filter(pk=self.commitment.pk).update(
+            allocated=self.days(6), reclaimed=self.days(21)
+        )
+        (tx,) = self.charge(0, 30)[0]
+        self.assertAlmostEqual(tx.amt_used, 0.5)
+
+
+MMREPQUOTA = """\
+*** Report for FILESET quotas on gpfs1
+                         Block Limits                                    |     File Limits
+Name       fileset    type             KB      quota      limit   in_doubt    grace |    files   quota    limit in_doubt    grace
+alpha      alpha      FILESET       4096       2048       8192          0   7 days |       10       0        0        0     none
+beta                  FILESET       1024          0          0          0     none |     12*        0        0        0  expired
+*** Report for USR quotas on gpfs2
+Name       type             KB      quota      limit   in_doubt    grace |    files   quota    limit in_doubt    grace
+bob        USR            2048          0          0          0     none |        3       0        0        0     none
+"""
+
+MMREPQUOTA_Y = """\
+mmrepquota::HEADER:version:reserved:reserved:filesystemName:quotaType:id:name:blockUsage:blockQuota:blockLimit:blockInDoubt:blockGrace:filesUsage:filesQuota:filesLimit:filesInDoubt:filesGrace:remarks:quota:defQuota:fid:filesetname:
+mmrepquota::0:1:::gpfs1:FILESET:1:alpha:8192:0:0:0:7 days:20:0:0:0:none:i:on:off:::
+"""
+
+LFS = """\
+Disk quotas for prj 1001 (pid 1001):
+     Filesystem  kbytes   quota   limit   grace   files   quota   limit   grace
+/lustre/projects/alpha
+                  4096*      0    2048  6d23h59m      10       0       0       -
+/lustre/beta        1024      0       0       -       5       0       0       -
+"""
+
+
+class QuotaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(name="admin")
+        system = System.objects.create(name="storage")
+        cls.service = Service.objects.create(
+            name="project", units="TB", system=system, charge_rate=10
+        )
+        project = Project.objects.create(name="alpha", pi=cls.user)
+        cls.account = Account.objects.create(name="alpha", project=project)
+        cls.commitment = StorageCommitment.objects.create(
+            dir_type="PROJECT", project=project, filesystem="gpfs1",
+            path="/gpfs1/alpha", commitment=10 ** 12,
+        )
+
+    def test_parse_mmrepquota(self):
+        self.assertEqual(
+            list(parse_mmrepquota(MMREPQUOTA.splitlines())),
+            [
+                QuotaRow("gpfs1", "alpha", 4096 * 1024, 10),
+                QuotaRow("gpfs1", "beta", 1024 * 1024, 12),
+                QuotaRow("gpfs2", "bob", 2048 * 1024, 3),
+            ],
+        )
+        self.assertEqual(
+            list(parse_mmrepquota(MMREPQUOTA_Y.splitlines())),
+            [QuotaRow("gpfs1", "alpha", 8192 * 1024, 20)],
+        )
+
+    def test_parse_lfs(self):
+        self.assertEqual(
+            list(parse_lfs(LFS.splitlines())),
+            [
+                QuotaRow(None, "/lustre/projects/alpha", 4096 * 1024, 10),
+                QuotaRow(None, "/lustre/beta", 1024 * 1024, 5),
+            ],
+        )
+
+    def test_parse_csv(self):
+        lines = ["path,bytes,files", "/gpfs1/alpha,100,2", "bad,row"]
+        self.assertEqual(
+            list(parse_csv(lines)), [QuotaRow(None, "/gpfs1/alpha", 100, 2)]
+        )
+
+    def test_ingest(self):
+        rows = parse_mmrepquota(MMREPQUOTA.splitlines())
+        unmatched = []
+        recorded, missed = ingest(
+            rows, self.service, self.user, path_prefix="/gpfs1",
+            bytes_per_unit=1024, unmatched=unmatched.append,
+        )
+        self.assertEqual((recorded, missed), (1, 2))
+        self.assertEqual([row.path for row in unmatched], ["beta", "bob"])
+        (tx,) = self.commitment.transactions.all()
+        self.assertEqual((tx.account, tx.tx_type), (self.account, "AUDIT"))
+        self.assertEqual(tx.amt_used, 4096)
+
+    def test_filesystem_required(self):
+        with self.assertRaises(MissingFilesystem):
+            ingest(parse_csv(["/gpfs1/alpha,100,2"]), self.service, self.user)
+        self.assertEqual(
+            ingest(
+                parse_csv(["/gpfs1/alpha,100,2"]), self.service, self.user,
+                filesystem="gpfs1",
+            ),
+            (1, 0),
+        )
+
+    def test_parse_report(self):
+        lines = ["/gpfs1/alpha,100,2", "/gpfs1/alpha,100,many"]
+        rows = parse_report(parse_csv, lines)
+        self.assertEqual(next(rows), QuotaRow(None, "/gpfs1/alpha", 100, 2))
+        with self.assertRaisesMessage(MalformedLine, "Line 2") as cm:
+            next(rows)
+        self.assertEqual((cm.exception.lineno, cm.exception.line), (2, lines[1]))
+
+    def test_ingest_atomic(self):
+        lines = ["/gpfs1/alpha,100,2"] * 3 + ["/gpfs1/alpha,100,many"]
+        with self.assertRaises(MalformedLine):
+            ingest(
+                parse_report(parse_csv, lines), self.service, self.user,
+                filesystem="gpfs1", batch_size=1,
+            )
+        self.assertFalse(self.commitment.transactions.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def command(self, report, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write(report)
+            f.flush()
+            out = io.StringIO()
+            call_command(
+                "openacct_ingest_quotas", "--service", "project", "--user", "admin",
+                "--input", f.name, *args, stdout=out, stderr=io.StringIO(),
+            )
+        return out.getvalue()
+
+    def test_command(self):
+        with self.assertRaisesMessage(CommandError, "--filesystem"):
+            self.command("")
+        self.assertEqual(
+            self.command("/gpfs1/alpha,100,2\n", "--filesystem", "gpfs1"),
+            "Recorded 1 transactions\n",
+        )
+        self.assertEqual(self.commitment.transactions.count(), 1)
+
+    def test_command_malformed(self):
+        report = "path,bytes,files\n/gpfs1/alpha,100,2\n/gpfs1/alpha,100,2x\n"
+        with self.assertRaisesMessage(CommandError, "Line 3") as cm:
+            self.command(report, "--filesystem", "gpfs1", "--batch-size", "1")
+        self.assertNotIn("--filesystem", str(cm.exception))
+        self.assertIn("/gpfs1/alpha,100,2x", str(cm.exception))
+        self.assertEqual(self.commitment.transactions.count(), 0)
+
+    def test_command_missing_filesystem(self):
+        # A custom parser whose rows may not name a filesystem
+        with self.assertRaisesMessage(CommandError, "give one with --filesystem"):
+            self.command("/gpfs1/alpha,100,2\n", "--parser", "openacct.quota.parse_csv")
+
+
+class StorageResolveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(name="admin")
+        project = Project.objects.create(name="project", pi=user)
+
+        def commit(path, **kwargs):
+            return StorageCommitment.objects.create(
+                dir_type="PROJECT", project=project, filesystem="gpfs1", path=path,
+                **kwargs
+            )
+
+        cls.project = commit("/gpfs1/project/")
+        cls.nested = commit("/gpfs1/project/data")
+        cls.reclaimed = commit(
+            "/gpfs1/project/data/old", reclaimed=timezone.now()
+        )
+
+    def covering(self, path, **kwargs):
+        return StorageCommitment.objects.covering("gpfs1", path, **kwargs)
+
+    def test_path_normalized(self):
+        self.assertEqual(self.project.path, "/gpfs1/project")
+        self.assertEqual(self.covering("/gpfs1/project/"), self.project)
+        self.assertEqual(self.covering("/gpfs1/project"), self.project)
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.covering("/gpfs1/project/other/x"), self.project)
+        self.assertEqual(self.covering("/gpfs1/project/data/x/"), self.nested)
+        self.assertIsNone(self.covering("/gpfs1/projects"))
+        self.assertIsNone(
+            StorageCommitment.objects.covering("gpfs2", "/gpfs1/project")
+        )
+
+    def test_reclaimed_ignored(self):
+        self.assertEqual(self.covering("/gpfs1/project/data/old/x"), self.nested)
+        self.assertEqual(
+            self.covering("/gpfs1/project/data/old/x", reclaimed=True),
+            self.reclaimed,
+        )
+
+    def lookup(self, request, user=None):
+        request.user = user or types.SimpleNamespace(
+            is_authenticated=True, is_staff=True
+        )
+        response = StorageLookupView.as_view()(request)
+        if response.status_code != 200:
+            return response.status_code
+        return [
+            (row["path"], row["commitment"], row["commitment_path"], row["project"])
+            for row in json.loads(response.content)["results"]
+        ]
+
+    def test_lookup_get(self):
+        request = RequestFactory().get(
+            "/", {"filesystem": "gpfs1", "path": "/gpfs1/project/data/old/x"}
+        )
+        self.assertEqual(
+            self.lookup(request),
+            [
+                (
+                    "/gpfs1/project/data/old/x", self.nested.pk,
+                    "/gpfs1/project/data", "project",
+                )
+            ],
+        )
+        for params in [{"filesystem": "gpfs1"}, {"path": "/gpfs1/project"}]:
+            self.assertEqual(self.lookup(RequestFactory().get("/", params)), 400)
+
+    def test_lookup_post(self):
+        paths = [
+            ["gpfs1", "/gpfs1/project/data/"],
+            ["gpfs1", "/gpfs1/project/database"],
+            ["gpfs1", "/gpfs1/other"],
+            ["gpfs2", "/gpfs1/project"],
+        ]
+        request = RequestFactory().post(
+            "/", json.dumps({"paths": paths}), content_type="application/json"
+        )
+        with self.assertNumQueries(1):
+            results = self.lookup(request)
+        self.assertEqual(
+            results,
+            [
+                (
+                    "/gpfs1/project/data/", self.nested.pk, "/gpfs1/project/data",
+                    "project",
+                ),
+                (
+                    "/gpfs1/project/database", self.project.pk, "/gpfs1/project",
+                    "project",
+                ),
+                ("/gpfs1/other", None, None, None),
+                ("/gpfs1/project", None, None, None),
+            ],
+        )
+
+    def test_lookup_malformed(self):
+        for body in [
+            "{", "[]", '{"paths": 5}', '{"paths": [["gpfs1"]]}', '{"path": []}'
+        ]:
+            request = RequestFactory().post(
+                "/", body, content_type="application/json"
+            )
+            self.assertEqual(self.lookup(request), 400)
+
+    def test_lookup_staff_only(self):
+        request = RequestFactory().get(
+            "/", {"filesystem": "gpfs1", "path": "/gpfs1/project"}
+        )
+        with self.assertRaises(PermissionDenied):
+            self.lookup(
+                request,
+                types.SimpleNamespace(is_authenticated=True, is_staff=False),
+            )
+        self.assertEqual(self.lookup(request, AnonymousUser()), 302)
+
+
+SACCT = """\
+JobID|JobName|Submit|TimelimitRaw|ElapsedRaw|NodeList|AllocTRES
+100|train|2024-01-05T10:00:00|60|120|node01|cpu=4,mem=16G,gres/gpu:a100=2,node=1
+100.batch|batch|2024-01-05T10:00:00|60|120|node01|cpu=4,mem=16G,node=1
+101_7|array|2024-01-05T10:00:00|UNLIMITED|30|None assigned|cpu=1,mem=500,node=1
+102|short|2024-01-05T10:00:00|60
+103|badtime|yesterday|60|30|node01|cpu=1
+104|pending|Unknown|60|0|None assigned|
+"""
+
+
+class SacctTests(TestCase):
+    def parse(self, text):
+        invalid = []
+        jobs = list(
+            parse_sacct(
+                text.splitlines(),
+                invalid=lambda number, line, reason: invalid.append(number),
+            )
+        )
+        return jobs, invalid
+
+    def test_parse(self):
+        jobs, invalid = self.parse(SACCT)
+        self.assertEqual([job["jobid"] for job in jobs], ["100", "101_7"])
+        self.assertEqual(invalid, [5, 6])
+        self.assertEqual(jobs[0]["wall_requested"], 3600)
+        self.assertIsNotNone(jobs[0]["queued"].tzinfo)
+        self.assertNotIn("wall_requested", jobs[1])
+        self.assertEqual(jobs[1]["host_list"], "")
+
+    def test_too_many_fields(self):
+        _, invalid = self.parse(
+            "JobID|Submit\n105|2024-01-05T10:00:00|extra\n"
+        )
+        self.assertEqual(invalid, [2])
+
+    def test_upsert(self):
+        jobs, _ = self.parse(SACCT)
+        self.assertEqual(upsert(jobs), (2, 0))
+        job = Job.objects.get(jobid="100")
+        self.assertEqual((job.alloc_cpus, job.alloc_gpus), (4, 2))
+        self.assertEqual(job.alloc_mem, 16 * 2 ** 30)
+        self.assertEqual(Job.objects.get(jobid="101_7").wall_requested, 0)
+
+        # A later record without a time limit keeps the known one
+        rerun, _ = self.parse(SACCT.replace("|60|120|", "|UNLIMITED|240|"))
+        self.assertEqual(upsert(rerun, batch_size=1), (0, 2))
+        job.refresh_from_db()
+        self.assertEqual((job.wall_requested, job.wall_duration), (3600, 240))
+
+    def test_command_reports_invalid_lines(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+            f.write(SACCT)
+            f.flush()
+            call_command(
+                "openacct_import_sacct", "--input", f.name, "--no-link",
+                stdout=stdout, stderr=stderr,
+            )
+        self.assertIn("Created 2 jobs", stdout.getvalue())
+        self.assertIn("Skipped line 5", stderr.getvalue())
+        self.assertIn("Skipped 2 invalid lines", stderr.getvalue())
+
+    def test_parse_tres(self):
+        self.assertEqual(
+            parse_tres("cpu=8,mem=1.5T,gres/gpu=4,gres/gpu:a100=4,node=2"),
+            {"cpus": 8, "mem": int(1.5 * 2 ** 40), "gpus": 4, "nodes": 2},
+        )
+        self.assertEqual(
+            parse_tres("cpu=2,mem=512,gres/gpu:a100=1,gres/gpu:v100=2"),
+            {"cpus": 2, "mem": 512 * 2 ** 20, "gpus": 3, "nodes": None},
+        )
+        self.assertEqual(
+            parse_tres(""),
+            {"cpus": None, "mem": None, "gpus": None, "nodes": None},
+        )
+
+
+class JobTresTests(TestCase):
+    def job(self, jobid, **kwargs):
+        return Job(
+            jobid=jobid, queued=timezone.now(), wall_requested=3600, **kwargs
+        )
+
+    def test_save_parses_tres(self):
+        job = self.job("1", tres_requested="cpu=2,mem=4G", tres_allocated="cpu=4")
+        job.save()
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.req_cpus, job.req_mem, job.alloc_cpus), (2, 4 * 2 ** 30, 4)
+        )
+        job.tres_allocated = "cpu=8,gres/gpu=1,node=1"
+        job.save(update_fields=["tres_allocated"])
+        job.refresh_from_db()
+        self.assertEqual((job.alloc_cpus, job.alloc_gpus, job.alloc_nodes), (8, 1, 1))
+
+    def test_with_usage(self):
+        for jobid, tres, duration in [
+            ("1", "cpu=4,mem=16G,gres/gpu=2,node=1", 1800),
+            ("2", "cpu=16,mem=64G,node=2", 7200),
+            ("3", "cpu=1", None),
+        ]:
+            self.job(jobid, tres_allocated=tres, wall_duration=duration).save()
+        usage = {
+            job.jobid: (job.alloc_mem, job.core_hours, job.gpu_hours)
+            for job in Job.objects.with_usage()
+        }
+        self.assertEqual(
+            usage,
+            {
+                "1": (16 * 2 ** 30, 2.0, 1.0),
+                "2": (64 * 2 ** 30, 32.0, None),
+                "3": (None, None, None),
+            },
+        )
+        self.assertEqual(
+            Job.objects.with_usage().aggregate(
+                cores=Sum("core_hours"), gpus=Sum("gpu_hours")
+            ),
+            {"cores": 34.0, "gpus": 1.0},
+        )
+
+    def test_backfill_command(self):
+        # bulk_create doesn't call save, leaving the TRES columns empty
+        Job.objects.bulk_create([
+            self.job(
+                str(jobid), name=f"job{jobid}", account="alpha", wall_duration=60,
+                tres_requested="cpu=2,mem=1G", tres_allocated=f"cpu={jobid},node=1",
+            )
+            for jobid in range(1, 6)
+        ] + [self.job("6", name="empty")])
+        # A job whose columns are already filled is left alone without --all
+        Job.objects.filter(jobid="5").update(alloc_cpus=99)
+        other_fields = [
+            field.attname for field in Job._meta.concrete_fields
+            if field.attname not in Job.TRES_FIELDS
+        ]
+        before = list(Job.objects.order_by("pk").values_list(*other_fields))
+
+        out = io.StringIO()
+        call_command("openacct_backfill_job_tres", "--chunk-size=2", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Updated 4 jobs")
+        tres = {
+            jobid: (req_cpus, req_mem, alloc_cpus, alloc_nodes)
+            for jobid, req_cpus, req_mem, alloc_cpus, alloc_nodes in
+            Job.objects.values_list(
+                "jobid", "req_cpus", "req_mem", "alloc_cpus", "alloc_nodes"
+            )
+        }
+        self.assertEqual(
+            tres,
+            {str(jobid): (2, 2 ** 30, jobid, 1) for jobid in range(1, 5)}
+            | {"5": (None, None, 99, None), "6": (None, None, None, None)},
+        )
+        self.assertEqual(
+            list(Job.objects.order_by("pk").values_list(*other_fields)), before
+        )
+
+        out = io.StringIO()
+        call_command("openacct_backfill_job_tres", "--all", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Updated 5 jobs")
+        self.assertEqual(Job.objects.get(jobid="5").alloc_cpus, 5)
+        self.assertEqual(
+            list(Job.objects.order_by("pk").values_list(*other_fields)), before
+        )
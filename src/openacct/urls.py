@@ -11,6 +11,7 @@ from .views import (
     JobEditView,
     JobListView,
     JobView,
+    StorageLookupView,
 )
 
 app_name = "openacct"
@@ -30,4 +31,5 @@ urlpatterns = [
     path("job_list/", JobListView.as_view(), name="job_list"),
     path("job_id/<int:byid>/", JobView.as_view(), name="job_byid"),
     path("job/<byname>/", JobView.as_view(), name="job_byname"),
+    path("storage_lookup/", StorageLookupView.as_view(), name="storage_lookup"),
 ]
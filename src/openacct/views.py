@@ -1,3 +1,5 @@
+import json
+
 from datetime import datetime
 
 from django.core import serializers
@@ -9,7 +11,16 @@ from django.views.generic import View
 from django.views.decorators.csrf import csrf_exempt
 
 from .forms import JobQueuedForm, JobStartedForm, JobCompletedForm
-from .models import User, Project, Account, System, Service, Transaction, Job
+from .models import (
+    User,
+    Project,
+    Account,
+    System,
+    Service,
+    Transaction,
+    Job,
+    StorageCommitment,
+)
 
 
 #######################################################################
@@ -399,6 +410,53 @@ class JobView(LoginRequiredMixin, View):
         )
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class StorageLookupView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Resolves filesystem paths to the storage commitments covering them,
+    by exact or longest prefix match. GET looks up the ``filesystem`` and
+    ``path`` parameters, and POST a JSON body of the form
+    ``{"paths": [[filesystem, path], ...]}``. Reclaimed commitments are
+    ignored.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def lookup(self, paths):
+        resolved = StorageCommitment.objects.resolve(paths)
+        return JsonResponse(
+            {
+                "results": [
+                    {
+                        "filesystem": filesystem,
+                        "path": path,
+                        "commitment": c.pk if c else None,
+                        "commitment_path": c.path if c else None,
+                        "project": c.project.name if c else None,
+                    }
+                    for filesystem, path, c in resolved
+                ]
+            }
+        )
+
+    def get(self, request):
+        if not request.GET.get("filesystem") or not request.GET.get("path"):
+            return HttpResponseBadRequest("filesystem and path are required")
+        return self.lookup([(request.GET["filesystem"], request.GET["path"])])
+
+    def post(self, request):
+        try:
+            paths = [
+                (str(filesystem), str(path))
+                for filesystem, path in json.loads(request.body)["paths"]
+            ]
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest(
+                'Expected {"paths": [[filesystem, path], ...]}'
+            )
+        return self.lookup(paths)
+
+
 #######################################################################
 #
 #   Create/Modify Views